@@ -8,16 +8,27 @@ from werkzeug.exceptions import (
     Unauthorized,
     InternalServerError,
 )
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
 
+from .database import init_sessions, make_engine
+from .identities import init_identities
 from .models import Base, setup_schema
 from .fixtures import load_fixture_data
+from .migrations import migrate
+from .oso_http import oso_latency
+from .authorization import oso
+from .facts import FactReplica, reconcile
+from .instrumentation import Instrumentation
+from .local_authorization import parse_endpoints
 
 PRODUCTION = os.environ.get("PRODUCTION", "0") == "1"
-PRODUCTION_DB = os.environ.get("PRODUCTION_DB", PRODUCTION)
-TRACING = os.environ.get("TRACING", PRODUCTION)
+PRODUCTION_DB = os.environ.get("PRODUCTION_DB", "1" if PRODUCTION else "0") == "1"
+TRACING = os.environ.get("TRACING", "1" if PRODUCTION else "0") == "1"
+SQL_AUTHZ_FILTER = os.environ.get("SQL_AUTHZ_FILTER", "")
+LOCAL_FACTS = os.environ.get("LOCAL_FACTS", "0") == "1"
+# Per-request SQL and Oso counts, see `instrumentation`.
+INSTRUMENTATION = os.environ.get("INSTRUMENTATION", "0") == "1"
+SQL_ECHO = os.environ.get("SQL_ECHO", "0") == "1"
 WEB_URL = (
     "https://gitcloud.vercel.app"
     if PRODUCTION
@@ -27,18 +38,12 @@ WEB_URL = (
 
 def create_app(db_path="sqlite:///roles.db", load_fixtures=False):
     from . import routes
+    from .schema import GraphQLView, schema
 
-    if PRODUCTION_DB:
-        engine = create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True)
-    else:
-        # Init DB engine.
-        engine = create_engine(
-            db_path,
-            # ignores errors from reusing connections across threads
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,
-            echo=True,
-        )
+    # Init DB engine, see `database` for pool settings.
+    engine = make_engine(
+        os.environ["DATABASE_URL"] if PRODUCTION_DB else db_path, echo=SQL_ECHO
+    )
 
     # Init Flask app.
     app = Flask(__name__)
@@ -47,14 +52,40 @@ def create_app(db_path="sqlite:///roles.db", load_fixtures=False):
     app.config["SESSION_COOKIE_SAMESITE"] = "None"
     app.config["SESSION_COOKIE_HTTPONLY"] = True
     app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(1)
+    # Endpoints that filter listings in SQL, see `local_authorization`.
+    app.config["SQL_AUTHZ_FILTER"] = parse_endpoints(SQL_AUTHZ_FILTER)
+    # Filtering in SQL reads the replica, so it needs it kept up to date too.
+    app.config["LOCAL_FACTS"] = LOCAL_FACTS or bool(app.config["SQL_AUTHZ_FILTER"])
+    oso.replica = FactReplica() if app.config["LOCAL_FACTS"] else None
 
     app.secret_key = b"ball outside of the school"
+
+    # Init session factory, before the blueprints whose ETags count its writes
+    # (see `conditional`).
+    Session = sessionmaker(bind=engine)
+    init_sessions(app, Session)
+    # Resolves users by id or username, see `identities`.
+    init_identities(app, Session)
+
     app.register_blueprint(routes.orgs.bp)
     app.register_blueprint(routes.repos.bp)
     app.register_blueprint(routes.role_assignments.bp)
     app.register_blueprint(routes.role_choices.bp)
     app.register_blueprint(routes.session.bp)
     app.register_blueprint(routes.users.bp)
+    app.add_url_rule(
+        "/graphql",
+        view_func=GraphQLView.as_view(
+            "graphql", schema=schema, graphiql=not PRODUCTION
+        ),
+    )
+
+    if TRACING:
+        from .tracing import instrument
+
+        instrument(app, engine, oso)
+    if INSTRUMENTATION:
+        Instrumentation(app, engine, oso)
 
     # Set up error handlers.
     @app.errorhandler(BadRequest)
@@ -85,22 +116,32 @@ def create_app(db_path="sqlite:///roles.db", load_fixtures=False):
         load_fixture_data(Session())
         return {}
 
-    Base.metadata.create_all(bind=engine)  # type: ignore
-    setup_schema(Base)
+    @app.route("/_oso_latency", methods=["GET"])
+    def oso_latency_histograms():
+        # Round trips to Oso Cloud from this process, see `oso_http`.
+        return oso_latency.as_dict()
 
-    # Init session factory
-    Session = sessionmaker(bind=engine)
+    # Create or upgrade the schema, see `migrations`. Without the replica,
+    # backfilled member counts come from Oso Cloud.
+    migrate(engine, oso_client=None if app.config["LOCAL_FACTS"] else oso.client)
+    setup_schema(Base)
 
     if load_fixtures:
         # Called during tests to reset the database
         Base.metadata.drop_all(bind=engine)  # type: ignore
         Base.metadata.create_all(bind=engine)  # type: ignore
         load_fixture_data(Session())
+    elif app.config["LOCAL_FACTS"]:
+        reconcile(Session(), oso.client)
+
+    @app.cli.command("reconcile-facts")
+    def reconcile_facts():
+        """Re-sync the local fact replica from Oso Cloud."""
+        print("Copied %d facts from Oso Cloud" % reconcile(Session(), oso.client))
 
     @app.before_request
-    def set_current_user_and_session():
+    def set_current_user():
         flask_session.permanent = True
-        g.session = Session()
         request_id = request.headers.get("oso-request-id")
         g.oso_request_id = request_id
 
@@ -118,19 +159,17 @@ def create_app(db_path="sqlite:///roles.db", load_fixtures=False):
     def add_cors_headers(res):
         res.headers.add("Access-Control-Allow-Origin", WEB_URL)
         res.headers.add("Vary", "Origin")
-        res.headers.add("Access-Control-Allow-Headers", "Accept,Content-Type,x-user-id")
+        res.headers.add(
+            "Access-Control-Allow-Headers",
+            "Accept,Content-Type,If-None-Match,x-user-id",
+        )
         res.headers.add("Access-Control-Allow-Methods", "DELETE,GET,OPTIONS,PATCH,POST")
         res.headers.add("Access-Control-Allow-Credentials", "true")
+        res.headers.add("Access-Control-Expose-Headers", "ETag,Link,X-Next-Cursor")
         res.headers.add("Access-Control-Max-Age", "60")
 
         return res
 
-    @app.after_request
-    def close_session(res):
-        if "session" in g:
-            g.session.close()
-        return res
-
     return app
 
 
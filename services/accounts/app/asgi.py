@@ -0,0 +1,98 @@
+"""ASGI entry point, for serving with an async server such as uvicorn:
+
+    uvicorn --factory app.asgi:create_asgi_app --port 5000
+
+Views are still synchronous Flask, each running on a thread from a pool of
+`ASGI_THREADS` (32), while the server's event loop accepts connections and
+reads and writes the sockets. A worker can then hold many more slow
+connections open than with one thread per request. Oso calls inside a view can
+overlap with each other and with queries through `oso.futures`.
+
+asgiref's own `WsgiToAsgi` runs every request on one shared thread, which
+would serialize the whole app, so requests are handed to the pool instead.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from asgiref.sync import AsyncToSync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from . import create_app
+
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("ASGI_THREADS", "32")),
+    thread_name_prefix="asgi",
+)
+
+
+class _ThreadedInstance(WsgiToAsgiInstance):
+    """Handles one request, running the app on a thread from `executor`.
+
+    Reading the body and sending the response are done here, so only
+    `WsgiToAsgiInstance`'s public `build_environ` and `start_response` are
+    reused.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("WSGI wrapper received a non-HTTP scope")
+        self.scope = scope
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message["type"] != "http.request":
+                    raise ValueError("WSGI wrapper received a non-HTTP-request message")
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            await sync_to_async(self._run, thread_sensitive=False, executor=executor)(
+                body, AsyncToSync(send)
+            )
+
+    def _run(self, body, send):
+        environ = self.build_environ(self.scope, body)
+        started = False
+        sent = 0
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in response:
+                if not started:
+                    started = True
+                    send(self.response_start)
+                length = self.response_content_length
+                if length is not None:
+                    # Never more than the app's Content-Length.
+                    output = output[: length - sent]
+                send({"type": "http.response.body", "body": output, "more_body": True})
+                sent += len(output)
+                if sent == length:
+                    break
+        finally:
+            # Runs Flask's teardown for streamed responses.
+            if hasattr(response, "close"):
+                response.close()
+        if not started:
+            send(self.response_start)
+        send({"type": "http.response.body"})
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """Serves a WSGI app over ASGI, a request per thread from `executor`."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        await _ThreadedInstance(self.wsgi_application)(scope, receive, send)
+
+
+def create_asgi_app(*args, **kwargs) -> ThreadedWsgiToAsgi:
+    """`create_app`, served over ASGI."""
+    return ThreadedWsgiToAsgi(create_app(*args, **kwargs))
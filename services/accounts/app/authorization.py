@@ -1,4 +1,536 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
 from os import getenv
-from oso_cloud import Oso
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
-oso = Oso(url=getenv("OSO_URL", "https://api.osohq.com"), api_key=getenv("OSO_AUTH"))
+from flask import g, has_request_context
+from oso_cloud import Fact, Oso, Value, VariableFact
+
+from . import oso_http
+from .conditional import mark_changed
+
+ValueKey = Tuple[str, str]
+
+
+def value_key(value: Any) -> Optional[ValueKey]:
+    """Normalize an Oso value into a hashable `(type, id)` pair.
+
+    Returns `None` for anything that isn't a concrete value, in which case the
+    call is passed straight through to Oso Cloud.
+    """
+    if isinstance(value, str):
+        return ("String", value)
+    if not isinstance(value, dict):
+        return None
+    if value.get("type") is None or value.get("id") is None:
+        return None
+    return (value["type"], str(value["id"]))
+
+
+def _concrete_key(value: Any) -> ValueKey:
+    key = value_key(value)
+    if key is None:
+        raise TypeError(f"Expected a concrete value with type and ID, got {value!r}")
+    return key
+
+
+_MISSING = object()
+
+# The `permissions` each resource type declares in `policy/authorization.polar`,
+# which `actions_many` checks one at a time. `tests/test_authorization.py`
+# fails if they differ.
+PERMISSIONS = {
+    "User": ["read", "read_profile"],
+    "Application": ["create_organization"],
+    "Organization": [
+        "read",
+        "read_details",
+        "view_members",
+        "manage_members",
+        "set_default_role",
+        "create_repositories",
+        "delete",
+    ],
+    "Repository": [
+        "read",
+        "create",
+        "update",
+        "delete",
+        "invite",
+        "write",
+        "read_issues",
+        "manage_issues",
+        "create_issues",
+        "read_jobs",
+        "manage_jobs",
+        "view_members",
+        "manage_members",
+    ],
+    "Issue": ["read", "comment", "close"],
+}
+
+# Argument positions that hold a role or relation name rather than an actor or
+# resource. Wildcards there don't widen the set of affected decisions.
+_NAME_ARGS = {"has_role": 1, "has_relation": 1}
+
+
+class DecisionCache:
+    """Process-wide LRU of authorization decisions with a TTL.
+
+    Every cache key embeds the current *fact version* of the values it depends
+    on, so invalidating a value is just a matter of bumping its version: the
+    old entries become unreachable and age out of the LRU. Writes that can't be
+    pinned to concrete values (e.g. deleting `has_role(_, _, org)`) bump a
+    global epoch, which drops everything.
+
+    The TTL bounds how stale a decision can be when facts are changed by
+    someone other than this process.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._versions: Dict[Any, int] = {}
+        self._epoch = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def versions(self, *keys: Any) -> Tuple[int, ...]:
+        return (self._epoch, *(self._versions.get(k, 0) for k in keys))
+
+    def get(self, key: Any) -> Any:
+        if not self.enabled:
+            return _MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, facts: Iterable[Any]):
+        """Bump the versions of every value (and value type) in `facts`."""
+        with self._lock:
+            for fact in facts:
+                for i, arg in enumerate(fact["args"]):
+                    if isinstance(arg, str) or _NAME_ARGS.get(fact["name"]) == i:
+                        continue
+                    key = value_key(arg)
+                    if key is None:
+                        self.clear()
+                        return
+                    self._versions[key] = self._versions.get(key, 0) + 1
+                    type_key = (key[0],)
+                    self._versions[type_key] = self._versions.get(type_key, 0) + 1
+
+    def clear(self):
+        self._epoch += 1
+        self._versions.clear()
+        self._entries.clear()
+
+
+class OsoFutures:
+    """`CachedOso` with every method returning a `Future`, so that a handler
+    can make independent calls concurrently instead of one round trip after
+    another:
+
+        permissions = oso.futures.actions(user, org)
+        readable = oso.futures.authorize(user, "read", target_user)
+        if "manage_members" not in permissions.result():
+            raise Forbidden
+
+    Calls run on a pool of their own (so they can still fan out through
+    `actions_many`) in a copy of the caller's context, which shares the
+    request's caches and attributes the calls to the request.
+
+    Reads answered from the fact replica use `g.session`, so don't wait on
+    them while the handler is using the session itself.
+    """
+
+    def __init__(self, oso: "CachedOso", max_workers: int):
+        self.oso = oso
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="oso-futures"
+        )
+
+    def __getattr__(self, name: str) -> Callable[..., Future]:
+        method = getattr(self.oso, name)
+
+        def submit(*args, **kwargs) -> Future:
+            # Created here rather than racing to create it in the workers.
+            self.oso._request_cache()
+            return self.executor.submit(copy_context().run, method, *args, **kwargs)
+
+        return submit
+
+
+class CachedOso:
+    """Wraps the Oso Cloud client with two layers of decision caching.
+
+    Handlers routinely check the same (actor, action, resource) triple more than
+    once, or call `authorize` after `actions` on the same resource, so results
+    are memoized on `flask.g` for the current request. Behind that sits a
+    process-wide `DecisionCache` shared by all requests.
+
+    Every fact written through this wrapper invalidates the affected actors and
+    resources, so the service always reads back its own writes.
+
+    When `replica` is set (see `facts.FactReplica`), writes are mirrored into
+    the local `facts` table and `get` is answered from it.
+    """
+
+    def __init__(
+        self,
+        client: Oso,
+        decisions: Optional[DecisionCache] = None,
+        max_workers: int = 8,
+        replica: Any = None,
+    ):
+        self.client = client
+        self.decisions = decisions if decisions is not None else DecisionCache(0, 0)
+        self.max_workers = max_workers
+        self.replica = replica
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures: Optional[OsoFutures] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="oso"
+            )
+        return self._executor
+
+    @property
+    def futures(self) -> OsoFutures:
+        """This client with methods that run in the background, see
+        `OsoFutures`."""
+        if self._futures is None:
+            self._futures = OsoFutures(self, self.max_workers)
+        return self._futures
+
+    def _request_cache(self) -> Optional[Dict[Any, Any]]:
+        if not has_request_context():
+            return None
+        if "oso_cache" not in g:
+            g.oso_cache = {}
+        return g.oso_cache
+
+    def _cached(self, key: Any) -> Any:
+        request_cache = self._request_cache()
+        if request_cache is not None and key in request_cache:
+            return request_cache[key]
+        value = self.decisions.get(key)
+        if value is not _MISSING and request_cache is not None:
+            request_cache[key] = value
+        return value
+
+    def _store(self, key: Any, value: Any):
+        self.decisions.set(key, value)
+        request_cache = self._request_cache()
+        if request_cache is not None:
+            request_cache[key] = value
+
+    def _fetch(self, key: Any, fetch: Callable[[], Any]) -> Any:
+        value = self._cached(key)
+        if value is _MISSING:
+            value = fetch()
+            self._store(key, value)
+        return value
+
+    def authorize(
+        self,
+        actor: Value,
+        action: str,
+        resource: Value,
+        context_facts: List[Fact] = [],
+    ) -> bool:
+        actor_key, resource_key = value_key(actor), value_key(resource)
+        if context_facts or actor_key is None or resource_key is None:
+            return self.client.authorize(actor, action, resource, context_facts)
+
+        versions = self.decisions.versions(actor_key, resource_key)
+        # An earlier `actions` call already answers every `authorize` question
+        # for this actor and resource.
+        actions = self._cached(("actions", actor_key, resource_key, versions))
+        if actions is not _MISSING:
+            return action in actions
+
+        return self._fetch(
+            ("authorize", actor_key, action, resource_key, versions),
+            lambda: self.client.authorize(actor, action, resource),
+        )
+
+    def actions(
+        self,
+        actor: Value,
+        resource: Value,
+        context_facts: List[Fact] = [],
+    ) -> List[str]:
+        actor_key, resource_key = value_key(actor), value_key(resource)
+        if context_facts or actor_key is None or resource_key is None:
+            return self.client.actions(actor, resource, context_facts)
+
+        versions = self.decisions.versions(actor_key, resource_key)
+        actions = self._fetch(
+            ("actions", actor_key, resource_key, versions),
+            lambda: self.client.actions(actor, resource),
+        )
+        return list(actions)
+
+    def authorize_many(
+        self, actor: Value, action: str, resources: Sequence[Value]
+    ) -> Dict[str, bool]:
+        """Check `action` on many resources of one type in a single round trip.
+
+        Returns a dict mapping each resource id to whether the action is
+        allowed. Decisions that are already cached aren't asked for again.
+        """
+        actor_key = _concrete_key(actor)
+        results: Dict[str, bool] = {}
+        missing = []
+        for resource in resources:
+            resource_key = _concrete_key(resource)
+            versions = self.decisions.versions(actor_key, resource_key)
+            actions = self._cached(("actions", actor_key, resource_key, versions))
+            if actions is not _MISSING:
+                results[resource_key[1]] = action in actions
+                continue
+            key = ("authorize", actor_key, action, resource_key, versions)
+            allowed = self._cached(key)
+            if allowed is not _MISSING:
+                results[resource_key[1]] = allowed
+            else:
+                missing.append((resource, resource_key, key))
+
+        if missing:
+            authorized = self.client.authorize_resources(
+                actor, action, [resource for resource, _, _ in missing]
+            )
+            authorized_keys = {value_key(r) for r in authorized}
+            for _, resource_key, key in missing:
+                allowed = resource_key in authorized_keys
+                self._store(key, allowed)
+                results[resource_key[1]] = allowed
+        return results
+
+    def actions_many(
+        self, actor: Value, resources: Sequence[Value]
+    ) -> Dict[str, List[str]]:
+        """Fetch the actions allowed on many resources of one type.
+
+        Oso Cloud has no bulk `actions` endpoint. For batches of at least as
+        many resources as the type has `PERMISSIONS`, each permission is checked
+        on every uncached resource with one `authorize_resources` call, so a
+        page of 10,000 costs no more round trips than a page of 20. Smaller
+        batches, and types without declared permissions, get an `actions` call
+        per resource instead. Either way the calls run concurrently over the
+        client's pooled HTTP session.
+
+        Returns a dict mapping each resource id to its sorted list of actions.
+        """
+        actor_key = _concrete_key(actor)
+        results: Dict[str, List[str]] = {}
+        missing = []
+        for resource in resources:
+            resource_key = _concrete_key(resource)
+            versions = self.decisions.versions(actor_key, resource_key)
+            key = ("actions", actor_key, resource_key, versions)
+            actions = self._cached(key)
+            if actions is not _MISSING:
+                results[resource_key[1]] = list(actions)
+            else:
+                missing.append((resource, resource_key, key))
+        if not missing:
+            return results
+
+        # Each call runs in a copy of the caller's context, so it's attributed
+        # to the current request (see `instrumentation`).
+        permissions = PERMISSIONS.get(missing[0][1][0])
+        missing_resources = [resource for resource, _, _ in missing]
+        if permissions is None or len(missing) < len(permissions):
+            fetched = list(
+                self.executor.map(
+                    lambda context, resource: context.run(
+                        self.client.actions, actor, resource
+                    ),
+                    [copy_context() for _ in missing],
+                    missing_resources,
+                )
+            )
+        else:
+            authorized = self.executor.map(
+                lambda context, action: context.run(
+                    self.client.authorize_resources, actor, action, missing_resources
+                ),
+                [copy_context() for _ in permissions],
+                permissions,
+            )
+            allowed: Dict[ValueKey, List[str]] = {key: [] for _, key, _ in missing}
+            for action, resources_allowed in zip(permissions, authorized):
+                for resource in resources_allowed or []:
+                    resource_key = value_key(resource)
+                    if resource_key in allowed:
+                        allowed[resource_key].append(action)
+            fetched = [allowed[resource_key] for _, resource_key, _ in missing]
+        for (_, resource_key, key), actions in zip(missing, fetched):
+            actions = sorted(actions)
+            self._store(key, actions)
+            results[resource_key[1]] = list(actions)
+        return results
+
+    def add_permissions(
+        self, actor: Value, resource_type: str, rows: List[Dict[str, Any]]
+    ):
+        """Set `permissions` on each serialized resource in `rows`."""
+        permissions = self.actions_many(
+            actor, [{"type": resource_type, "id": str(row["id"])} for row in rows]
+        )
+        for row in rows:
+            row["permissions"] = permissions[str(row["id"])]
+
+    def list(
+        self,
+        actor: Value,
+        action: str,
+        resource_type: str,
+        context_facts: List[Fact] = [],
+    ) -> List[str]:
+        actor_key = value_key(actor)
+        if context_facts or actor_key is None:
+            return self.client.list(actor, action, resource_type, context_facts)
+
+        versions = self.decisions.versions(actor_key, (resource_type,))
+        ids = self._fetch(
+            ("list", actor_key, action, resource_type, versions),
+            lambda: self.client.list(actor, action, resource_type),
+        )
+        return list(ids)
+
+    # Versions are bumped after the write lands, so a read racing with the
+    # write can only ever populate a key that is already stale.
+
+    def tell(self, fact: Fact):
+        result = self.client.tell(fact)
+        self.record_writes(tell=[fact])
+        return result
+
+    def bulk_tell(self, facts: List[Fact]):
+        result = self.client.bulk_tell(facts)
+        self.record_writes(tell=facts)
+        return result
+
+    def delete(self, fact: Fact):
+        result = self.client.delete(fact)
+        self.record_writes(delete=[fact])
+        return result
+
+    def bulk_delete(self, facts: List[Fact]):
+        result = self.client.bulk_delete(facts)
+        self.record_writes(delete=facts)
+        return result
+
+    def bulk(self, delete: Sequence[VariableFact] = [], tell: Sequence[Fact] = []):
+        result = self.client.bulk(delete=delete, tell=tell)
+        self.record_writes(delete=delete, tell=tell)
+        return result
+
+    def record_writes(
+        self, delete: Sequence[VariableFact] = [], tell: Sequence[Fact] = []
+    ):
+        """Mirror and invalidate for facts already written to Oso Cloud.
+
+        Every write method calls this; callers that write through `client`
+        directly (e.g. from worker threads) call it once the write has landed.
+        """
+        if self.replica is not None:
+            self.replica.delete(delete)
+            self.replica.tell(tell)
+        self.decisions.invalidate([*delete, *tell])
+        # Opens the request's session if the view hasn't yet, so that it's
+        # marked whichever comes first.
+        session = getattr(g, "session", None) if has_request_context() else None
+        if session is not None:
+            # Versions ETags once the request commits, see `conditional`.
+            mark_changed(session, "facts")
+
+    def local_facts(self) -> Any:
+        """The fact replica, if it's enabled and has a session to read from."""
+        if self.replica is not None and self.replica.session() is not None:
+            return self.replica
+        return None
+
+    def get(self, fact: VariableFact) -> List[Fact]:
+        replica = self.local_facts()
+        if replica is not None and replica.covers(fact):
+            return replica.get(fact)
+        return self.client.get(fact)
+
+    def get_in(
+        self, fact: VariableFact, arg: int, ids: Sequence[str]
+    ) -> Dict[str, List[Fact]]:
+        """The facts matching `fact` with argument `arg` set to each of `ids`,
+        grouped by that id.
+
+        Argument `arg` of `fact` should give just a type. The fact replica
+        answers with one `IN` query. Otherwise there's a `get` for each id,
+        with the id bound, fanned out concurrently like `actions_many`, so
+        each only returns the facts about that one resource.
+        """
+        ids = list(dict.fromkeys(str(id) for id in ids))
+        if not ids:
+            return {}
+        replica = self.local_facts()
+        if replica is not None and replica.covers(fact):
+            results: Dict[str, List[Fact]] = {id: [] for id in ids}
+            for matched in replica.get_in(fact, arg, ids):
+                results[str(matched["args"][arg]["id"])].append(matched)  # type: ignore
+            return results
+
+        def bound(id: str) -> VariableFact:
+            args = list(fact["args"])
+            args[arg] = {**args[arg], "id": id}  # type: ignore
+            return {"name": fact["name"], "args": args}
+
+        fetched = self.executor.map(
+            lambda context, pattern: context.run(self.client.get, pattern),
+            [copy_context() for _ in ids],
+            [bound(id) for id in ids],
+        )
+        return dict(zip(ids, fetched))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+oso = CachedOso(
+    # Pool size and timeouts are set in `oso_http`.
+    oso_http.configure(
+        Oso(url=getenv("OSO_URL", "https://api.osohq.com"), api_key=getenv("OSO_AUTH"))
+    ),
+    DecisionCache(
+        maxsize=int(getenv("OSO_CACHE_SIZE", "10000")),
+        ttl=float(getenv("OSO_CACHE_TTL", "30")),
+    ),
+    max_workers=int(getenv("OSO_MAX_WORKERS", "8")),
+)
@@ -0,0 +1,202 @@
+"""ETags for a blueprint's listings, and compression for its JSON responses.
+
+    bp = Blueprint("orgs", __name__, url_prefix="/orgs")
+    conditional.enable(bp, tables=["organizations", "facts"], views=["index"])
+
+Every transaction from the app's sessionmaker that writes to a table bumps its
+row in `change_counters` as part of the same commit, and writes to Oso through
+`CachedOso` count as writes to `facts`. A listing's ETag hashes the URL, the
+current user, the versions of the `tables` the blueprint reads, a random epoch
+picked whenever `change_counters` is created, and the version of the facts
+about the user in `oso.decisions`. A request whose `If-None-Match`
+still matches gets a `304` before the view runs, at the cost of one small
+query instead of the listing's queries, Oso calls and serialization. Other
+views don't get ETags, and don't open a session for them.
+
+The `304` skips the view's authorization checks too, so the hash is keyed with
+the app's `secret_key`: an ETag can't be made up, only replayed by the user it
+was served to, for a response they were allowed to see, until their facts
+change.
+
+Facts changed by anyone other than this service don't bump `facts`, so ETags
+also roll over every `ETAG_TTL` seconds (30, like `OSO_CACHE_TTL`): a response
+is never reused for longer than a cached decision would be.
+
+Responses of at least `min_size` bytes (`GZIP_MIN_SIZE`, 1024) are gzipped for
+clients that accept it; pass `min_size=None` to leave a blueprint's responses
+uncompressed.
+"""
+import gzip
+import os
+import random
+from hashlib import blake2b
+from time import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+from flask import Blueprint, Response, current_app, g, request
+from flask.blueprints import BlueprintSetupState
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import ORMExecuteState, Session, sessionmaker
+
+from .models import ChangeCounter
+
+GZIP_MIN_SIZE = int(os.environ.get("GZIP_MIN_SIZE", "1024"))
+ETAG_TTL = float(os.environ.get("ETAG_TTL", "30"))
+# The `change_counters` row of the schema's random epoch, see `_seed_epoch`.
+EPOCH = "epoch"
+
+
+def mark_changed(session: Session, *tables: str):
+    """Bump the version of `tables` when `session` next commits."""
+    session.info.setdefault("changed_tables", set()).update(tables)
+
+
+def watch(Session: sessionmaker):
+    """Count the tables written by sessions from `Session`, once they commit.
+
+    `enable` calls this for the app's own sessionmaker; writes through any
+    other sessionmaker don't change ETags.
+    """
+    if event.contains(Session, "before_commit", _bump_versions):
+        return
+    event.listen(Session, "after_flush", _record_flush)
+    event.listen(Session, "do_orm_execute", _record_statement)
+    event.listen(Session, "before_commit", _bump_versions)
+    event.listen(Session, "after_rollback", _forget_changes)
+
+
+def _record_flush(session: Session, _):
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        table = getattr(obj, "__tablename__", None)
+        if table is not None and table != ChangeCounter.__tablename__:
+            mark_changed(session, table)
+
+
+def _record_statement(state: ORMExecuteState):
+    if state.is_insert or state.is_update or state.is_delete:
+        table = state.statement.table.name  # type: ignore
+        if table != ChangeCounter.__tablename__:
+            mark_changed(state.session, table)
+
+
+def _bump_versions(session: Session):
+    # Flushed now, so that the flush's own changes are counted too.
+    session.flush()
+    changed: Set[str] = session.info.pop("changed_tables", set())
+    for name in sorted(changed):
+        result = session.execute(
+            update(ChangeCounter)
+            .where(ChangeCounter.name == name)
+            .values(version=ChangeCounter.version + 1)
+        )
+        if result.rowcount == 0:  # type: ignore
+            session.execute(insert(ChangeCounter).values(name=name, version=1))
+
+
+def _forget_changes(session: Session):
+    session.info.pop("changed_tables", None)
+
+
+@event.listens_for(ChangeCounter.__table__, "after_create")
+def _seed_epoch(table, connection, **_):
+    # The counters start over whenever the schema is recreated (e.g. by
+    # `/_reset`), so ETags also hash a random epoch that doesn't.
+    connection.execute(insert(table).values(name=EPOCH, version=random.getrandbits(31)))
+
+
+def versions(session: Session, tables: Iterable[str]) -> Dict[str, int]:
+    rows = session.execute(
+        select(ChangeCounter.name, ChangeCounter.version).where(
+            ChangeCounter.name.in_(list(tables))
+        )
+    )
+    return dict(rows.all())
+
+
+def compute_etag(tables: Iterable[str], ttl: float = ETAG_TTL) -> str:
+    from .authorization import oso, value_key
+
+    tables = sorted([EPOCH, *tables])
+    user = g.get("current_user")
+    actor = value_key({"type": "User", "id": user}) if user is not None else None
+    key = [
+        request.full_path,
+        str(user),
+        *(f"{name}={version}" for name, version in versions(g.session, tables).items()),
+        # Bumped by this process's writes to facts about the user, including
+        # ones made outside of a request, like revoking their roles.
+        ",".join(map(str, oso.decisions.versions(actor))),
+        str(int(time() // ttl)) if ttl > 0 else "",
+    ]
+    return blake2b("\n".join(key).encode(), digest_size=16, key=_etag_key()).hexdigest()
+
+
+def _etag_key() -> bytes:
+    secret = current_app.secret_key
+    if secret is None:
+        raise RuntimeError("ETags are keyed with the app's secret_key, set it")
+    if isinstance(secret, str):
+        secret = secret.encode()
+    # blake2b keys are at most 64 bytes.
+    return secret if len(secret) <= 64 else blake2b(secret).digest()
+
+
+def gzip_response(response: Response, min_size: int = GZIP_MIN_SIZE) -> Response:
+    """Compress `response` in place if it's large and the client accepts gzip."""
+    if (
+        "gzip" in request.headers.get("Accept-Encoding", "")
+        and "Content-Encoding" not in response.headers
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and response.content_length
+        and response.content_length >= min_size
+    ):
+        response.set_data(gzip.compress(response.get_data(), compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def enable(
+    bp: Blueprint,
+    tables: Iterable[str],
+    views: Iterable[str] = (),
+    min_size: Optional[int] = GZIP_MIN_SIZE,
+    ttl: float = ETAG_TTL,
+):
+    """Serve GETs of `bp`'s listing `views` with ETags derived from the
+    versions of `tables`, and compress its responses of at least `min_size`
+    bytes."""
+    tables = list(tables)
+    endpoints = {f"{bp.name}.{view}" for view in views}
+
+    @bp.record_once
+    def watch_sessions(state: BlueprintSetupState):
+        Session = state.app.extensions.get("sessionmaker")
+        if Session is None:
+            raise RuntimeError(
+                f"call init_sessions before registering {bp.name!r}, its ETags "
+                "are versioned by the app's sessions"
+            )
+        watch(Session)
+
+    @bp.before_request
+    def check_etag() -> Any:
+        if request.method != "GET" or request.endpoint not in endpoints:
+            return None
+        g.etag = compute_etag(tables, ttl)
+        if g.etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(g.etag)
+            return response
+        return None
+
+    @bp.after_request
+    def add_etag(response: Response) -> Response:
+        if "etag" in g and response.status_code in (200, 304):
+            response.set_etag(g.etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.update(["Cookie", "x-user-id"])
+        if min_size is not None:
+            gzip_response(response, min_size)
+        return response
@@ -0,0 +1,175 @@
+"""Engine and connection pool setup for `create_app`.
+
+Pool settings come from the environment:
+
+- `DB_POOL_SIZE` (5): connections kept open.
+- `DB_MAX_OVERFLOW` (10): extra connections opened under load.
+- `DB_POOL_TIMEOUT` (30): seconds to wait for a connection before failing.
+- `DB_POOL_RECYCLE` (1800): seconds before a connection is replaced, to stay
+  under server and proxy idle timeouts.
+- `DB_CONNECT_TIMEOUT` (10): seconds to wait when opening a connection to a
+  database server.
+
+File-backed SQLite databases get a real pool too, with WAL journaling so
+readers don't block on a writer, and `SQLITE_BUSY_TIMEOUT` (5000) ms to wait
+for a lock. In-memory databases only exist on a single connection, so they
+keep sharing one across threads.
+
+Time spent waiting for a connection is kept in `pool_metrics` and added to
+the current request's `Server-Timing` (see `instrumentation`).
+
+Requests get their session through `RequestGlobals`: `g.session` is only
+opened when a view first uses it, and `close_request_session` releases it in
+teardown, including after an unhandled exception.
+"""
+import os
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+from typing import Any, Dict
+
+from flask import Flask, current_app, g
+from flask.ctx import _AppCtxGlobals
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from .instrumentation import current_metrics
+
+
+def _env(name: str, default: float) -> Any:
+    return type(default)(os.environ.get(name, default))
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    wait_time: float = 0.0
+    max_wait: float = 0.0
+    timeouts: int = 0
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    def record(self, elapsed: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_time += elapsed
+            self.max_wait = max(self.max_wait, elapsed)
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """A `QueuePool` that records how long each checkout waited."""
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_metrics.record(perf_counter() - start, timed_out=True)
+            raise
+        elapsed = perf_counter() - start
+        pool_metrics.record(elapsed)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add_pool_wait(elapsed)
+        return connection
+
+    def status_dict(self) -> Dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "checkouts": pool_metrics.checkouts,
+            "wait_ms": round(pool_metrics.wait_time * 1000, 3),
+            "max_wait_ms": round(pool_metrics.max_wait * 1000, 3),
+            "timeouts": pool_metrics.timeouts,
+        }
+
+
+def _pool_options() -> Dict[str, Any]:
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": _env("DB_POOL_SIZE", 5),
+        "max_overflow": _env("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": _env("DB_POOL_TIMEOUT", 30.0),
+        "pool_recycle": _env("DB_POOL_RECYCLE", 1800),
+    }
+
+
+def _enable_wal(engine: Engine):
+    busy_timeout = _env("SQLITE_BUSY_TIMEOUT", 5000)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        cursor.close()
+
+
+def make_engine(url: str, echo: bool = False) -> Engine:
+    """An engine for `url`, pooled according to the environment."""
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_engine(
+            url,
+            pool_pre_ping=True,
+            connect_args={"connect_timeout": _env("DB_CONNECT_TIMEOUT", 10)},
+            echo=echo,
+            **_pool_options(),
+        )
+
+    database = make_url(url).database
+    if not database or database == ":memory:":
+        return create_engine(
+            url,
+            # ignores errors from reusing connections across threads
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+            echo=echo,
+        )
+
+    engine = create_engine(
+        url,
+        # Connections move between threads through the pool, but are only
+        # used by one at a time.
+        connect_args={"check_same_thread": False},
+        echo=echo,
+        **_pool_options(),
+    )
+    _enable_wal(engine)
+    return engine
+
+
+class RequestGlobals(_AppCtxGlobals):
+    """Flask's `g`, opening `g.session` from the app's session factory the
+    first time it's read. `"session" in g` stays false until then, so code
+    that needs the session reads it (`getattr(g, "session", None)` outside of
+    apps with `init_sessions`) rather than checking for it."""
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "session" and "sessionmaker" in current_app.extensions:
+            session = current_app.extensions["sessionmaker"]()
+            self.session = session
+            return session
+        return super().__getattr__(name)
+
+
+def close_request_session(_=None):
+    session = g.pop("session", None)
+    if session is not None:
+        session.close()
+
+
+def init_sessions(app: Flask, Session: sessionmaker):
+    """Give each request a lazily opened `g.session` from `Session`."""
+    app.app_ctx_globals_class = RequestGlobals
+    app.extensions["sessionmaker"] = Session
+    app.teardown_request(close_request_session)
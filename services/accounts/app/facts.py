@@ -0,0 +1,211 @@
+"""A local replica of the facts this service writes to Oso Cloud.
+
+Most facts Oso knows about (roles, repository relations and attributes) are
+written by this service, so reading them back with `oso.get` is a network
+round trip for data we already had. With the replica enabled (`LOCAL_FACTS=1`),
+every write made through `authorization.CachedOso` is also applied to the
+`facts` table in the request's session, so it commits or rolls back with the
+rest of the request, and `oso.get` for a replicated predicate is answered
+from an indexed local query.
+
+Facts written to Oso by anyone else only show up locally after `reconcile`,
+which is run at startup and by `flask reconcile-facts`.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from flask import g, has_request_context
+from oso_cloud import Fact as OsoFact, VariableFact
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.orm.session import Session
+from sqlalchemy.sql import ColumnElement, Select
+
+from .authorization import value_key
+from .migrations import backfill_member_counts
+from .models import Fact
+
+# Everything kept in the replica, as `oso.get` patterns.
+REPLICATED_FACTS: List[VariableFact] = [
+    {"name": "has_role", "args": [{"type": "User"}, None, {"type": "Organization"}]},
+    {"name": "has_role", "args": [{"type": "User"}, None, {"type": "Repository"}]},
+    {
+        "name": "has_relation",
+        "args": [{"type": "Repository"}, "organization", {"type": "Organization"}],
+    },
+    {"name": "is_public", "args": [{"type": "Repository"}]},
+    {"name": "is_protected", "args": [{"type": "Repository"}, {"type": "Boolean"}]},
+]
+REPLICATED_PREDICATES = {pattern["name"] for pattern in REPLICATED_FACTS}
+# The `facts` table has columns for facts of up to three arguments.
+MAX_ARGS = 3
+
+
+def fact_row(fact: OsoFact) -> Dict[str, Any]:
+    """The `facts` columns for an Oso fact with concrete arguments."""
+    # Unused arguments are explicit `NULL`s, so rows for facts of different
+    # arities can share one executemany.
+    row: Dict[str, Any] = {"name": fact["name"]}
+    for i in range(MAX_ARGS):
+        row[f"arg{i}_type"] = row[f"arg{i}_id"] = None
+    for i, arg in enumerate(fact["args"]):
+        key = value_key(arg)
+        if key is None:
+            raise TypeError(f"Expected a concrete value with type and ID, got {arg!r}")
+        row[f"arg{i}_type"], row[f"arg{i}_id"] = key
+    return row
+
+
+def fact_rows(facts: Iterable[OsoFact]) -> List[Dict[str, Any]]:
+    """`fact_row` for each of `facts`, skipping duplicates."""
+    rows = {tuple(row.items()): row for row in map(fact_row, facts)}
+    return list(rows.values())
+
+
+def _arg(i: int) -> List[Any]:
+    return [getattr(Fact, f"arg{i}_type"), getattr(Fact, f"arg{i}_id")]
+
+
+def fact_filter(fact: VariableFact) -> ColumnElement:
+    """A `WHERE` clause matching `fact`, where `None` or `{}` matches any
+    argument and `{"type": ...}` any argument of that type."""
+    clauses = [Fact.name == fact["name"]]
+    for i, arg in enumerate(fact["args"]):
+        if isinstance(arg, str):
+            arg = {"type": "String", "id": arg}
+        elif not arg:
+            continue
+        type_column, id_column = _arg(i)
+        if arg.get("type") is not None:
+            clauses.append(type_column == arg["type"])
+        if arg.get("id") is not None:
+            clauses.append(id_column == str(arg["id"]))
+    return and_(*clauses)
+
+
+def output_fact(row: Any) -> OsoFact:
+    """The row as `oso.get` would return it."""
+    args = []
+    for i in range(MAX_ARGS):
+        type, id = (getattr(row, column.key) for column in _arg(i))
+        if type is None:
+            break
+        args.append({"type": type, "id": id})
+    return {"name": row.name, "args": args}
+
+
+def fact_to_pattern(row: Dict[str, Any]) -> VariableFact:
+    return {
+        "name": row["name"],
+        "args": [
+            {"type": row[f"arg{i}_type"], "id": row[f"arg{i}_id"]}
+            for i in range(MAX_ARGS)
+            if row.get(f"arg{i}_type") is not None
+        ],
+    }
+
+
+class FactReplica:
+    """Reads and writes the `facts` table on behalf of `CachedOso`.
+
+    Writes go to the session bound with `bind`, or else the request's
+    `g.session`. Outside of both there's no transaction to join, so writes are
+    skipped and picked up by the next `reconcile`.
+    """
+
+    def __init__(self):
+        self._session: ContextVar[Optional[Session]] = ContextVar(
+            "fact_replica_session", default=None
+        )
+
+    @contextmanager
+    def bind(self, session: Session) -> Iterator[Session]:
+        token = self._session.set(session)
+        try:
+            yield session
+        finally:
+            self._session.reset(token)
+
+    def session(self) -> Optional[Session]:
+        session = self._session.get()
+        if session is None and has_request_context():
+            # Opens the request's session if the view hasn't yet (see
+            # `database.RequestGlobals`).
+            session = getattr(g, "session", None)
+        return session
+
+    def covers(self, fact: VariableFact) -> bool:
+        return fact["name"] in REPLICATED_PREDICATES
+
+    def tell(self, facts: Iterable[OsoFact]):
+        session = self.session()
+        rows = fact_rows(fact for fact in facts if self.covers(fact))
+        if session is None or not rows:
+            return
+        # Facts are a set, so drop any copy we already have first.
+        session.execute(
+            delete(Fact)
+            .where(or_(*(fact_filter(fact_to_pattern(row)) for row in rows)))
+            .execution_options(synchronize_session=False)
+        )
+        session.execute(insert(Fact), rows)
+
+    def delete(self, facts: Iterable[VariableFact]):
+        session = self.session()
+        facts = [fact for fact in facts if self.covers(fact)]
+        if session is None or not facts:
+            return
+        session.execute(
+            delete(Fact)
+            .where(or_(*map(fact_filter, facts)))
+            .execution_options(synchronize_session=False)
+        )
+
+    def select(self, fact: VariableFact, *columns: Any) -> Select:
+        return select(*(columns or [Fact])).where(fact_filter(fact))
+
+    def get(self, fact: VariableFact) -> List[OsoFact]:
+        session = self.session()
+        assert session is not None
+        rows = session.execute(self.select(fact).order_by(Fact.id)).scalars()
+        return [output_fact(row) for row in rows]
+
+    def get_in(self, fact: VariableFact, arg: int, ids: Sequence[str]) -> List[OsoFact]:
+        """`get` for the facts matching `fact` whose argument `arg` is one of
+        `ids`."""
+        session = self.session()
+        assert session is not None
+        statement = self.select(fact).where(_arg(arg)[1].in_(list(ids)))
+        rows = session.execute(statement.order_by(Fact.id)).scalars()
+        return [output_fact(row) for row in rows]
+
+    def ids(self, fact: VariableFact, arg: int) -> Select:
+        """A subquery of the ids in position `arg` of the facts matching
+        `fact`, e.g. to filter with `Model.id.in_(...)`."""
+        return self.select(fact, _arg(arg)[1])
+
+    def count(self, fact: VariableFact) -> int:
+        session = self.session()
+        assert session is not None
+        return session.execute(self.select(fact, func.count())).scalar_one()
+
+
+def reconcile(
+    session: Session,
+    client: Any,
+    patterns: Optional[List[VariableFact]] = None,
+) -> int:
+    """Replace the local copy of each of `patterns` with what's in Oso Cloud,
+    and rebuild the member counts from it.
+
+    `client` must be the plain Oso client, not `CachedOso`, which would answer
+    from the replica. Returns the number of facts copied.
+    """
+    patterns = REPLICATED_FACTS if patterns is None else patterns
+    rows = fact_rows(fact for pattern in patterns for fact in client.get(pattern))
+    session.execute(delete(Fact).where(or_(*map(fact_filter, patterns))))
+    if rows:
+        session.execute(insert(Fact), rows)
+    backfill_member_counts(session)
+    session.commit()
+    return len(rows)
@@ -0,0 +1,571 @@
+"""An in-process stand-in for Oso Cloud, for benchmarks and offline tests.
+
+`FakeOso` has the same methods as `oso_cloud.Oso` and answers them from an
+in-memory, indexed set of facts, evaluating the rules in
+`policy/authorization.polar` directly in Python (reusing the role and
+permission tables in `local_authorization`; keep all three in sync).
+
+Every call is counted in `calls` and can be delayed by `latency` seconds, to
+stand in for the round trip to Oso Cloud:
+
+    oso.client = FakeOso(latency=0.005)
+
+`FakeOsoServer` serves the same over the Oso Cloud HTTP API, so the real
+client (with its connection pooling and retries) can be exercised too, and
+`python -m app.fake_oso --port 8080` runs one for other processes to use
+through `OSO_URL`. Tests use it unless `OSO_URL` points at a real Oso Cloud.
+"""
+import argparse
+from collections import Counter, defaultdict
+from threading import RLock, Thread
+from time import sleep
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, cast
+
+from flask import Flask, jsonify, request
+from oso_cloud import Fact, Oso, Value, VariableFact
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from . import oso_http
+from .authorization import ValueKey, value_key
+from .conditional import gzip_response
+from .local_authorization import (
+    ORGANIZATION_PERMISSIONS,
+    ORGANIZATION_REPOSITORY_ROLES,
+    ORGANIZATION_ROLES,
+    REPOSITORY_PERMISSIONS,
+    REPOSITORY_ROLES,
+)
+
+StoredFact = Tuple[Any, ...]
+
+# Actions every user has on every resource of a type, which `list` answers
+# with `["*"]`.
+UNCONDITIONAL = {
+    "Organization": {"read"},
+    "User": {"read"},
+    "Application": {"create_organization"},
+}
+ISSUE_PERMISSIONS = {
+    "read": "read",
+    "comment": "manage_issues",
+    "close": "manage_issues",
+}
+
+FALSE: ValueKey = ("Boolean", "false")
+
+
+def _implied(hierarchy: Sequence[str], roles: Iterable[str]) -> Set[str]:
+    """Every role at or below one of `roles`."""
+    implied: Set[str] = set()
+    for role in roles:
+        if role in hierarchy:
+            implied.update(hierarchy[: hierarchy.index(role) + 1])
+    return implied
+
+
+def _output(fact: StoredFact) -> Fact:
+    return {"name": fact[0], "args": [{"type": t, "id": i} for t, i in fact[1:]]}
+
+
+class FactStore:
+    """Facts indexed by predicate and by each concrete argument."""
+
+    def __init__(self, facts: Iterable[StoredFact] = ()):
+        self._by_name: Dict[str, Set[StoredFact]] = defaultdict(set)
+        self._by_arg: Dict[Tuple[str, int, ValueKey], Set[StoredFact]] = defaultdict(
+            set
+        )
+        self._by_type: Dict[str, Set[str]] = defaultdict(set)
+        for fact in facts:
+            self.add(fact)
+
+    @staticmethod
+    def key(fact: Fact) -> StoredFact:
+        args = []
+        for arg in fact["args"]:
+            key = value_key(arg)
+            if key is None:
+                raise TypeError(
+                    f"Expected a concrete value with type and ID, got {arg!r}"
+                )
+            args.append(key)
+        return (fact["name"], *args)
+
+    def __iter__(self):
+        for facts in self._by_name.values():
+            yield from facts
+
+    def __len__(self) -> int:
+        return sum(map(len, self._by_name.values()))
+
+    def add(self, fact: StoredFact):
+        self._by_name[fact[0]].add(fact)
+        for i, arg in enumerate(fact[1:]):
+            self._by_arg[(fact[0], i, arg)].add(fact)
+            self._by_type[arg[0]].add(arg[1])
+
+    def remove(self, fact: StoredFact):
+        self._by_name[fact[0]].discard(fact)
+        for i, arg in enumerate(fact[1:]):
+            self._by_arg[(fact[0], i, arg)].discard(fact)
+
+    def match(self, pattern: VariableFact) -> List[StoredFact]:
+        """Facts matching `pattern`, where `None` or `{}` matches anything and
+        `{"type": ...}` any value of that type.
+
+        Missing trailing arguments match anything too, as they do in a
+        `GET /facts` query string.
+        """
+        candidates = self._by_name.get(pattern["name"], set())
+        # Each argument must equal a `(type, id)` key, or just have a type.
+        constraints: List[Tuple[int, Any]] = []
+        for i, arg in enumerate(pattern["args"]):
+            if isinstance(arg, str):
+                arg = {"type": "String", "id": arg}
+            if not arg:
+                continue
+            key = value_key(arg)
+            if key is not None:
+                indexed = self._by_arg.get((pattern["name"], i, key), set())
+                if len(indexed) < len(candidates):
+                    candidates = indexed
+                constraints.append((i, key))
+            elif arg.get("type") is not None:
+                constraints.append((i, arg["type"]))
+        return [
+            fact
+            for fact in candidates
+            if len(fact) > len(pattern["args"])
+            and all(
+                fact[i + 1] == want
+                if isinstance(want, tuple)
+                else fact[i + 1][0] == want
+                for i, want in constraints
+            )
+        ]
+
+    def args(
+        self, name: str, known: Dict[int, ValueKey], position: int
+    ) -> Set[ValueKey]:
+        """The values at `position` of the `name` facts with the `known` args.
+
+        Only the first of `known` is looked up in the index, so put the most
+        selective first.
+        """
+        if not known:
+            return {fact[position + 1] for fact in self._by_name.get(name, ())}
+        (i, key), *rest = known.items()
+        return {
+            fact[position + 1]
+            for fact in self._by_arg.get((name, i, key), ())
+            if all(fact[j + 1] == value for j, value in rest)
+        }
+
+    def ids(self, type: str) -> Set[str]:
+        """The ids of every value of `type` mentioned by a fact."""
+        return self._by_type.get(type, set())
+
+    def exists(self, *fact: Any) -> bool:
+        name, *args = fact
+        return fact in self._by_arg.get((name, 0, args[0]), ())
+
+
+class Policy:
+    """`policy/authorization.polar`, evaluated against a `FactStore`."""
+
+    def __init__(self, facts: FactStore):
+        self.facts = facts
+
+    def _roles(self, actor: ValueKey, resource: ValueKey) -> Set[str]:
+        return {
+            role[1]
+            for role in self.facts.args("has_role", {0: actor, 2: resource}, 1)
+            if role[0] == "String"
+        }
+
+    def organization_roles(self, actor: ValueKey, org: ValueKey) -> Set[str]:
+        return _implied(ORGANIZATION_ROLES, self._roles(actor, org))
+
+    def repository_roles(self, actor: ValueKey, repo: ValueKey) -> Set[str]:
+        roles = self._roles(actor, repo)
+        for org in self.facts.args(
+            "has_relation", {0: repo, 1: ("String", "organization")}, 2
+        ):
+            for org_role in self.organization_roles(actor, org):
+                if org_role in ORGANIZATION_REPOSITORY_ROLES:
+                    roles.add(ORGANIZATION_REPOSITORY_ROLES[org_role])
+        if self.facts.exists("is_public", repo):
+            roles.add("reader")
+        return _implied(REPOSITORY_ROLES, roles)
+
+    def actions(self, actor: ValueKey, resource: ValueKey) -> Set[str]:
+        if actor[0] != "User":
+            return set()
+        type = resource[0]
+        actions = set(UNCONDITIONAL.get(type, ()))
+        if type == "User" and actor == resource:
+            actions.add("read_profile")
+        elif type == "Organization":
+            roles = self.organization_roles(actor, resource)
+            actions.update(p for p, r in ORGANIZATION_PERMISSIONS.items() if r in roles)
+        elif type == "Repository":
+            roles = self.repository_roles(actor, resource)
+            actions.update(p for p, r in REPOSITORY_PERMISSIONS.items() if r in roles)
+            if "maintainer" in roles and self.facts.exists(
+                "is_protected", resource, FALSE
+            ):
+                actions.add("delete")
+        elif type == "Issue":
+            for repo in self.facts.args(
+                "has_relation", {0: resource, 1: ("String", "repository")}, 2
+            ):
+                repo_actions = self.actions(actor, repo)
+                actions.update(
+                    p for p, a in ISSUE_PERMISSIONS.items() if a in repo_actions
+                )
+            if self.facts.exists(
+                "has_relation", resource, ("String", "creator"), actor
+            ):
+                actions.add("close")
+            if "read" in actions and self.facts.exists("is_closed", resource, FALSE):
+                actions.add("comment")
+        return actions
+
+    def candidates(self, actor: ValueKey, type: str) -> Set[str]:
+        """Ids of the resources of `type` that `actor` might have an action on."""
+        roles = self.facts.args("has_role", {0: actor}, 2)
+        if type == "Repository":
+            ids = {id for t, id in roles if t == type}
+            for org in {key for key in roles if key[0] == "Organization"}:
+                ids.update(
+                    id
+                    for _, id in self.facts.args(
+                        "has_relation", {2: org, 1: ("String", "organization")}, 0
+                    )
+                )
+            ids.update(id for _, id in self.facts.args("is_public", {}, 0))
+            return ids
+        if type == "Organization":
+            return {id for t, id in roles if t == type}
+        return set(self.facts.ids(type))
+
+
+class FakeOso:
+    """Answers the `oso_cloud.Oso` API from memory. Thread-safe."""
+
+    def __init__(self, facts: Iterable[Fact] = (), latency: float = 0.0):
+        self.store = FactStore(map(FactStore.key, facts))
+        self.rules = Policy(self.store)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = RLock()
+
+    def _call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            sleep(self.latency)
+
+    def _policy(self, context_facts: Sequence[Fact]) -> Policy:
+        if not context_facts:
+            return self.rules
+        store = FactStore(self.store)
+        for fact in context_facts:
+            store.add(FactStore.key(fact))
+        return Policy(store)
+
+    def authorize(
+        self,
+        actor: Value,
+        action: str,
+        resource: Value,
+        context_facts: List[Fact] = [],
+    ) -> bool:
+        self._call("authorize")
+        actor_key, resource_key = value_key(actor), value_key(resource)
+        if actor_key is None or resource_key is None:
+            return False
+        with self._lock:
+            return action in self._policy(context_facts).actions(
+                actor_key, resource_key
+            )
+
+    def authorize_resources(
+        self,
+        actor: Value,
+        action: str,
+        resources: Optional[List[Value]],
+        context_facts: List[Fact] = [],
+    ) -> List[Value]:
+        self._call("authorize_resources")
+        actor_key = value_key(actor)
+        if not resources or actor_key is None:
+            return []
+        with self._lock:
+            policy = self._policy(context_facts)
+            return [
+                resource
+                for resource in resources
+                if action in policy.actions(actor_key, value_key(resource))  # type: ignore
+            ]
+
+    def actions(
+        self, actor: Value, resource: Value, context_facts: List[Fact] = []
+    ) -> List[str]:
+        self._call("actions")
+        actor_key, resource_key = value_key(actor), value_key(resource)
+        if actor_key is None or resource_key is None:
+            return []
+        with self._lock:
+            return sorted(self._policy(context_facts).actions(actor_key, resource_key))
+
+    def list(
+        self,
+        actor: Value,
+        action: str,
+        resource_type: str,
+        context_facts: List[Fact] = [],
+    ) -> List[str]:
+        self._call("list")
+        actor_key = value_key(actor)
+        if actor_key is None:
+            return []
+        if actor_key[0] == "User" and action in UNCONDITIONAL.get(resource_type, ()):
+            return ["*"]
+        with self._lock:
+            policy = self._policy(context_facts)
+            return sorted(
+                id
+                for id in policy.candidates(actor_key, resource_type)
+                if action in policy.actions(actor_key, (resource_type, id))
+            )
+
+    def get(self, fact: VariableFact) -> List[Fact]:
+        self._call("get")
+        with self._lock:
+            return [_output(f) for f in self.store.match(fact)]
+
+    def query(self, query: VariableFact, context_facts: List[Fact] = []) -> List[Fact]:
+        """Only stored facts; rules aren't queryable."""
+        self._call("query")
+        with self._lock:
+            store = self._policy(context_facts).facts
+            return [_output(f) for f in store.match(query)]
+
+    def tell(self, fact: Fact) -> Fact:
+        self.bulk(tell=[fact])
+        return _output(FactStore.key(fact))
+
+    def bulk_tell(self, facts: List[Fact]):
+        self.bulk(tell=facts)
+
+    def delete(self, fact: Fact):
+        self.bulk(delete=[fact])
+
+    def bulk_delete(self, facts: List[Fact]):
+        self.bulk(delete=facts)
+
+    def bulk(self, delete: Sequence[VariableFact] = [], tell: Sequence[Fact] = []):
+        self._call("bulk")
+        with self._lock:
+            for pattern in delete:
+                for fact in self.store.match(pattern):
+                    self.store.remove(fact)
+            for fact in tell:
+                self.store.add(FactStore.key(fact))
+
+    def clear(self):
+        with self._lock:
+            self.store = FactStore()
+            self.rules = Policy(self.store)
+
+    def policy(self, policy: str):
+        self._call("policy")
+
+
+def _from_api(fact: Dict[str, Any]) -> Any:
+    """An API fact (`{"predicate": ..., "args": [...]}`) as a client fact."""
+    args = [
+        arg if arg.get("id") is not None else arg if arg.get("type") else None
+        for arg in fact["args"]
+    ]
+    return {"name": fact["predicate"], "args": args}
+
+
+def _to_api(fact: Fact) -> Dict[str, Any]:
+    return {"predicate": fact["name"], "args": fact["args"]}
+
+
+def create_server(fake: FakeOso) -> Flask:
+    """The Oso Cloud HTTP API, as used by `oso_cloud.Oso`, answered by `fake`."""
+    server = Flask(__name__)
+
+    @server.before_request
+    def check_token():
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return {"message": "Unauthorized"}, 401
+
+    server.after_request(gzip_response)
+
+    def body() -> Dict[str, Any]:
+        return cast(dict, request.get_json(force=True))
+
+    def context_facts() -> List[Any]:
+        return [_from_api(fact) for fact in body().get("context_facts") or []]
+
+    def value(data: Dict[str, Any], prefix: str) -> Value:
+        return {"type": data[f"{prefix}_type"], "id": data[f"{prefix}_id"]}
+
+    @server.route("/api")
+    def index():
+        return {"message": "Fake Oso Cloud"}
+
+    @server.route("/api/authorize", methods=["POST"])
+    def authorize():
+        data = body()
+        allowed = fake.authorize(
+            value(data, "actor"),
+            data["action"],
+            value(data, "resource"),
+            context_facts(),
+        )
+        return {"allowed": allowed}
+
+    @server.route("/api/authorize_resources", methods=["POST"])
+    def authorize_resources():
+        data = body()
+        results = fake.authorize_resources(
+            value(data, "actor"), data["action"], data["resources"], context_facts()
+        )
+        return {"results": results}
+
+    @server.route("/api/actions", methods=["POST"])
+    def actions():
+        data = body()
+        results = fake.actions(
+            value(data, "actor"), value(data, "resource"), context_facts()
+        )
+        return {"results": results}
+
+    @server.route("/api/list", methods=["POST"])
+    def list_():
+        data = body()
+        results = fake.list(
+            value(data, "actor"), data["action"], data["resource_type"], context_facts()
+        )
+        return {"results": results}
+
+    @server.route("/api/query", methods=["POST"])
+    def query():
+        data = body()
+        results = fake.query(_from_api(data["fact"]), context_facts())
+        return {"results": [_to_api(fact) for fact in results]}
+
+    @server.route("/api/facts", methods=["GET"])
+    def get_facts():
+        args: List[Dict[str, str]] = []
+        for key, arg in request.args.items():
+            if key.startswith("args."):
+                _, i, field = key.split(".")
+                while len(args) <= int(i):
+                    args.append({})
+                args[int(i)][field] = arg
+        pattern = {"name": request.args["predicate"], "args": args}
+        return jsonify([_to_api(fact) for fact in fake.get(pattern)])
+
+    @server.route("/api/facts", methods=["POST"])
+    def tell():
+        return _to_api(fake.tell(_from_api(body())))
+
+    @server.route("/api/facts", methods=["DELETE"])
+    def delete():
+        fake.delete(_from_api(body()))
+        return {"message": "ok"}
+
+    @server.route("/api/bulk_load", methods=["POST"])
+    def bulk_load():
+        fake.bulk_tell([_from_api(fact) for fact in body()])
+        return {"message": "ok"}
+
+    @server.route("/api/bulk_delete", methods=["POST"])
+    def bulk_delete():
+        fake.bulk_delete([_from_api(fact) for fact in body()])
+        return {"message": "ok"}
+
+    @server.route("/api/bulk", methods=["POST"])
+    def bulk():
+        data = body()
+        fake.bulk(
+            delete=[_from_api(fact) for fact in data["delete"]],
+            tell=[_from_api(fact) for fact in data["tell"]],
+        )
+        return {"message": "ok"}
+
+    @server.route("/api/clear_data", methods=["POST"])
+    def clear_data():
+        fake.clear()
+        return {"message": "ok"}
+
+    @server.route("/api/policy", methods=["POST"])
+    def policy():
+        fake.policy(body()["src"])
+        return {"message": "ok"}
+
+    return server
+
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+
+class FakeOsoServer:
+    """Serves a `FakeOso` over HTTP from a background thread.
+
+    with FakeOsoServer(latency=0.005) as server:
+        oso.client = server.client()
+    """
+
+    def __init__(
+        self,
+        fake: Optional[FakeOso] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+    ):
+        self.fake = fake or FakeOso(latency=latency)
+        self._server = make_server(
+            host,
+            port,
+            create_server(self.fake),
+            threaded=True,
+            # Keeps connections open between calls, like Oso Cloud.
+            request_handler=_KeepAliveHandler,
+        )
+        self.url = f"http://{host}:{self._server.server_port}"
+
+    def client(self) -> Oso:
+        return oso_http.configure(Oso(url=self.url, api_key="fake"))
+
+    def __enter__(self) -> "FakeOsoServer":
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Oso Cloud.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each call"
+    )
+    args = parser.parse_args()
+    server = FakeOsoServer(host=args.host, port=args.port, latency=args.latency)
+    print(f"Fake Oso Cloud listening on {server.url}, set OSO_URL to use it")
+    server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
 from random import randint
-from .models import OrgRole, RepoRole, Organization, Repository, User
+from .models import Fact, Organization, Repository, User
 from .authorization import oso
+from .ingest import BATCH_SIZE, ingest
+from .migrations import backfill_repository_counts
 
 from faker import Faker
 import faker_microservice
 
-from oso_cloud import Fact
+from oso_cloud import Fact as OsoFact
 
 FAKE_USERS = 100
 FAKE_ORGANIZATIONS = 10
@@ -14,35 +17,17 @@ FAKE_REPOSITORIES = 20
 FAKE_ISSUES = 100
 
 
-def limit_bulk_tell(facts, bulk_limit=20):
-    start_index = 0
-    end_index = min(len(facts), bulk_limit)
-    total_facts_added = 0
-    total_number_facts = len(facts)
-    while start_index < total_number_facts:
-        oso_response = oso.bulk_tell(facts=facts[start_index:end_index])
-        if oso_response is not None:
-            print(
-                "An issue occurred adding facts {} - {})".format(start_index, end_index)
-            )
-        else:
-            total_facts_added += end_index - start_index
-
-        start_index = end_index
-        end_index = start_index + min(total_number_facts - start_index, bulk_limit)
-
-    if total_facts_added == total_number_facts:
-        print(
-            "All {} facts were successfully added to Oso Cloud!".format(
-                total_facts_added
-            )
-        )
-    else:
+def limit_bulk_tell(facts, bulk_limit=BATCH_SIZE):
+    result = ingest(facts, batch_size=bulk_limit)
+    if result.failed:
         print(
             "An error occurred. Not all facts were properly uploaded ({} of {}).".format(
-                total_facts_added, total_number_facts
+                result.sent, result.total
             )
         )
+    else:
+        print("All {} facts were successfully added to Oso Cloud!".format(result.sent))
+    return result
 
 
 def load_fixture_data(session):
@@ -58,9 +43,10 @@ def load_fixture_data(session):
     session.query(User).delete()
     session.query(Organization).delete()
     session.query(Repository).delete()
+    session.query(Fact).delete()
 
-    deletions: list[Fact] = []
-    facts: list[Fact] = []
+    deletions: list[OsoFact] = []
+    facts: list[OsoFact] = []
 
     john = User(username="john", name="John Lennon", email="john@beatles.com")
     paul = User(username="paul", name="Paul McCartney", email="paul@beatles.com")
@@ -159,6 +145,7 @@ def load_fixture_data(session):
 
     # https://github.com/osohq/oso/blob/70965f2277d7167c38d3641140e6e97dec78e3bf/languages/python/sqlalchemy-oso/tests/test_roles.py#L132-L133
     session.flush()
+    backfill_repository_counts(session)
     session.commit()
     # session.close()
 
@@ -224,14 +211,15 @@ def load_fixture_data(session):
     # Org roles #
     #############
 
+    # (user id, org id, role)
     org_roles = [
-        OrgRole(user_id=john.id, org_id=beatles.id, role="admin"),
-        OrgRole(user_id=paul.id, org_id=beatles.id, role="member"),
-        OrgRole(user_id=ringo.id, org_id=beatles.id, role="member"),
-        OrgRole(user_id=george.id, org_id=beatles.id, role="member"),
-        OrgRole(user_id=mike.id, org_id=monsters.id, role="admin"),
-        OrgRole(user_id=sully.id, org_id=monsters.id, role="member"),
-        OrgRole(user_id=randall.id, org_id=monsters.id, role="member"),
+        (john.id, beatles.id, "admin"),
+        (paul.id, beatles.id, "member"),
+        (ringo.id, beatles.id, "member"),
+        (george.id, beatles.id, "member"),
+        (mike.id, monsters.id, "admin"),
+        (sully.id, monsters.id, "member"),
+        (randall.id, monsters.id, "member"),
     ]
 
     org_role_choices = OrderedDict(
@@ -245,24 +233,18 @@ def load_fixture_data(session):
     for org in orgs[2:]:
         # make sure every org has an admin
         admin = faker.random_element(elements=users)
-        org_roles.append(OrgRole(user_id=admin.id, org_id=org.id, role="admin"))
+        org_roles.append((admin.id, org.id, "admin"))
         org_users = faker.random_elements(
             elements=users, length=randint(1, 10), unique=True
         )
         for user in org_users:
-            org_roles.append(
-                OrgRole(
-                    user_id=user.id,
-                    org_id=org.id,
-                    role=faker.random_element(org_role_choices),
-                )
-            )
+            org_roles.append((user.id, org.id, faker.random_element(org_role_choices)))
 
     # make sure every user has at least one org
     for user in users:
         org = faker.random_element(orgs)
         role = faker.random_element(org_role_choices)
-        org_roles.append(OrgRole(user_id=user.id, org_id=org.id, role=role))
+        org_roles.append((user.id, org.id, role))
 
     deletions.append(
         {
@@ -270,19 +252,19 @@ def load_fixture_data(session):
             "args": [{"type": "User"}, {"type": "String"}, {"type": "Organization"}],
         }
     )
-    for org_role in org_roles:
-        session.add(org_role)
+    for (user_id, org_id, role) in org_roles:
         facts.append(
             {
                 "name": "has_role",
                 "args": [
-                    {"type": "User", "id": str(org_role.user_id)},
-                    str(org_role.role),
-                    {"type": "Organization", "id": str(org_role.org_id)},
+                    {"type": "User", "id": str(user_id)},
+                    role,
+                    {"type": "Organization", "id": str(org_id)},
                 ],
             }
         )
 
+    # (user id, repo id, role)
     repo_roles = []
 
     repo_role_choices = OrderedDict(
@@ -297,11 +279,7 @@ def load_fixture_data(session):
         )
         for user in repo_users:
             repo_roles.append(
-                RepoRole(
-                    user_id=user.id,
-                    repo_id=repo.id,
-                    role=faker.random_element(repo_role_choices),
-                )
+                (user.id, repo.id, faker.random_element(repo_role_choices))
             )
 
     deletions.append(
@@ -310,24 +288,33 @@ def load_fixture_data(session):
             "args": [{"type": "User"}, {"type": "String"}, {"type": "Repository"}],
         }
     )
-    for repo_role in repo_roles:
-        session.add(repo_role)
+    for (user_id, repo_id, role) in repo_roles:
         facts.append(
             {
                 "name": "has_role",
                 "args": [
-                    {"type": "User", "id": str(repo_role.user_id)},
-                    repo_role.role,
-                    {"type": "Repository", "id": str(repo_role.repo_id)},
+                    {"type": "User", "id": str(user_id)},
+                    role,
+                    {"type": "Repository", "id": str(repo_id)},
                 ],
             }
         )
 
     # delete old facts
-    oso.bulk(deletions, [])
+    # Mirror the facts into this session rather than the request's.
+    replica = nullcontext() if oso.replica is None else oso.replica.bind(session)
+    with replica:
+        oso.bulk(deletions, [])
 
-    for idx in range(0, len(facts), 20):
-        print(oso.bulk_tell(facts=facts[idx : idx + 20]))
+        result = limit_bulk_tell(facts)
+
+    if result.failed:
+        # The counts would include roles that Oso Cloud doesn't have.
+        print("Skipped member counts, `replay` the failed facts and backfill them.")
+    else:
+        member_counts = Counter(org_id for (_, org_id, _) in set(org_roles))
+        for org in orgs:
+            org.member_count = member_counts[org.id]
 
     session.flush()
     session.commit()
@@ -0,0 +1,219 @@
+"""Generate a synthetic dataset of any size, for load testing.
+
+    python -m app.generator --users 100000 --orgs 10000 --db sqlite:///load.db
+
+Rows are written with Core bulk inserts with ids assigned up front, so the
+matching Oso facts can be produced alongside them without a flush. Names are
+drawn from small pools built once from a seeded `Faker` and made unique by
+suffixing the row id, so the same arguments always produce the same data.
+
+Facts are uploaded through `ingest` (or only written to the local `facts`
+table with `--no-oso`, e.g. for a stand-in Oso backed by it).
+"""
+import argparse
+from dataclasses import dataclass
+from random import Random
+from typing import Any, Dict, Iterator, List
+
+from faker import Faker
+from oso_cloud import Fact as OsoFact
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.session import Session
+
+from .facts import REPLICATED_FACTS, fact_rows
+from .ingest import batches, ingest
+from .migrations import migrate
+from .models import Fact, Organization, Repository, User
+
+# Rows per insert statement, and facts per batch written locally.
+INSERT_BATCH_SIZE = 5_000
+POOL_SIZE = 1_000
+
+
+@dataclass
+class Scale:
+    users: int = 100
+    orgs: int = 10
+    # Each organization gets a uniformly random number of repositories and
+    # members up to these.
+    repos_per_org: int = 20
+    members_per_org: int = 10
+    # Users given a role directly on each repository, at most.
+    roles_per_repo: int = 4
+    admin_fraction: float = 0.1
+    public_fraction: float = 0.1
+    protected_fraction: float = 0.05
+
+
+def _value(type: str, id: int) -> Dict[str, str]:
+    return {"type": type, "id": str(id)}
+
+
+class _Pools:
+    """Realistic looking words, drawn once and reused."""
+
+    def __init__(self, seed: int):
+        faker = Faker()
+        faker.seed_instance(seed)
+        self.first_names = [faker.first_name() for _ in range(POOL_SIZE)]
+        self.last_names = [faker.last_name() for _ in range(POOL_SIZE)]
+        self.words = [faker.word() for _ in range(POOL_SIZE)]
+        self.phrases = [faker.catch_phrase() for _ in range(POOL_SIZE)]
+        self.addresses = [faker.address() for _ in range(POOL_SIZE)]
+
+
+def _insert(session: Session, model: Any, rows: List[Dict[str, Any]]):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        session.execute(insert(model), rows[start : start + INSERT_BATCH_SIZE])
+
+
+def _users(session: Session, scale: Scale, rng: Random, pools: _Pools):
+    for start in range(1, scale.users + 1, INSERT_BATCH_SIZE):
+        rows = []
+        for id in range(start, min(start + INSERT_BATCH_SIZE, scale.users + 1)):
+            first, last = rng.choice(pools.first_names), rng.choice(pools.last_names)
+            username = f"{first.lower()}{id}"
+            rows.append(
+                {
+                    "id": id,
+                    "username": username,
+                    "name": f"{first} {last}",
+                    "email": f"{username}@example.com",
+                }
+            )
+        session.execute(insert(User), rows)
+
+
+def generate(session: Session, scale: Scale, seed: int = 0) -> Iterator[OsoFact]:
+    """Replace the users, organizations and repositories in `session` with
+    generated ones, yielding the Oso facts that go with them.
+
+    Rows are inserted as the facts are consumed, an organization at a time.
+    Commit once the iterator is exhausted.
+    """
+    rng = Random(seed)
+    pools = _Pools(seed)
+
+    for model in [Repository, Organization, User]:
+        session.execute(delete(model))
+    _users(session, scale, rng, pools)
+
+    repo_id = 0
+    orgs: List[Dict[str, Any]] = []
+    repos: List[Dict[str, Any]] = []
+    for org_id in range(1, scale.orgs + 1):
+        org = _value("Organization", org_id)
+        members = rng.sample(
+            range(1, scale.users + 1),
+            min(rng.randint(1, max(scale.members_per_org, 1)), scale.users),
+        )
+        for i, user_id in enumerate(members):
+            # The first member is always an admin.
+            admin = i == 0 or rng.random() < scale.admin_fraction
+            yield {
+                "name": "has_role",
+                "args": [_value("User", user_id), "admin" if admin else "member", org],
+            }
+
+        repository_count = rng.randint(0, scale.repos_per_org)
+        for _ in range(repository_count):
+            repo_id += 1
+            public = rng.random() < scale.public_fraction
+            protected = rng.random() < scale.protected_fraction
+            repos.append(
+                {
+                    "id": repo_id,
+                    "name": f"{rng.choice(pools.words)}-{repo_id}",
+                    "description": rng.choice(pools.phrases),
+                    "org_id": org_id,
+                    "public": public,
+                    "protected": protected,
+                }
+            )
+            repo = _value("Repository", repo_id)
+            yield {"name": "has_relation", "args": [repo, "organization", org]}
+            yield {
+                "name": "is_protected",
+                "args": [repo, {"type": "Boolean", "id": str(protected).lower()}],
+            }
+            if public:
+                yield {"name": "is_public", "args": [repo]}
+            for user_id in rng.sample(
+                members, min(rng.randint(0, scale.roles_per_repo), len(members))
+            ):
+                role = rng.choice(["editor", "maintainer"])
+                yield {
+                    "name": "has_role",
+                    "args": [_value("User", user_id), role, repo],
+                }
+
+        orgs.append(
+            {
+                "id": org_id,
+                "name": f"{rng.choice(pools.words)}-{org_id}",
+                "description": rng.choice(pools.phrases),
+                "billing_address": rng.choice(pools.addresses),
+                "repository_count": repository_count,
+                "member_count": len(members),
+            }
+        )
+        if len(orgs) >= INSERT_BATCH_SIZE or len(repos) >= INSERT_BATCH_SIZE:
+            _insert(session, Organization, orgs)
+            _insert(session, Repository, repos)
+            orgs, repos = [], []
+
+    _insert(session, Organization, orgs)
+    _insert(session, Repository, repos)
+
+
+def write_local_facts(session: Session, facts: Iterator[OsoFact]) -> int:
+    """Replace the local fact replica with `facts`, without telling Oso."""
+    session.execute(delete(Fact))
+    count = 0
+    for batch in batches(facts, INSERT_BATCH_SIZE):
+        session.execute(insert(Fact), fact_rows(batch))
+        count += len(batch)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="sqlite:///roles.db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-oso",
+        dest="oso",
+        action="store_false",
+        help="only write facts to the local replica",
+    )
+    for name, default in vars(Scale()).items():
+        parser.add_argument(
+            "--" + name.replace("_", "-"), type=type(default), default=default
+        )
+    args = parser.parse_args()
+    scale = Scale(**{name: getattr(args, name) for name in vars(Scale())})
+
+    engine = create_engine(args.db)
+    migrate(engine)
+    session = sessionmaker(bind=engine)()
+    facts = generate(session, scale, args.seed)
+
+    if args.oso:
+        from .authorization import oso
+        from .facts import FactReplica
+
+        oso.replica = FactReplica()
+        with oso.replica.bind(session):
+            oso.bulk(delete=REPLICATED_FACTS)
+            result = ingest(facts)
+        if result.failed:
+            print(f"{len(result.failed)} batches failed; rerun to retry them")
+    else:
+        print(f"Wrote {write_local_facts(session, facts)} facts locally")
+    session.commit()
+    print(f"Generated {scale}")
+
+
+if __name__ == "__main__":
+    main()
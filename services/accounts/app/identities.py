@@ -0,0 +1,194 @@
+"""An in-process map from user ids and usernames to public profiles.
+
+Requests name users both ways: `g.current_user` is an id (from the session
+cookie or `x-user-id`), while `/users/<username>/...` names one by username.
+Oso facts use ids, so the username has to be resolved first. Both lookups, and
+`/session`, go through `identities()` and skip SQL once a user has been seen:
+
+    identity = identities().by_username(g.session, username)
+    if identity is None:
+        raise NotFound
+    actor = {"type": "User", "id": str(identity.id)}
+
+The map is per app, holds at most `IDENTITY_CACHE_SIZE` (10,000) users, least
+recently used first out, and forgets a user when a session from the app's
+`sessionmaker` writes to them. Bulk writes to `users` (e.g. `/_reset`) clear
+it. Entries also expire after `IDENTITY_CACHE_TTL` seconds (30, like
+`OSO_CACHE_TTL`), which bounds how stale a profile can be when it's changed by
+another process.
+
+Misses aren't cached, so a user created elsewhere can log in straight away.
+"""
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session, sessionmaker
+
+from .models import User
+from .serializers import serializer_for
+
+IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = float(os.environ.get("IDENTITY_CACHE_TTL", "30"))
+
+
+class Identity:
+    """A user's id, username and public profile (`User.as_json()`).
+
+    Shared between requests, so don't modify `profile`.
+    """
+
+    __slots__ = ("id", "username", "profile", "expires_at")
+
+    def __init__(self, profile: Dict[str, Any], expires_at: float):
+        self.id: int = profile["id"]
+        self.username: Optional[str] = profile["username"]
+        self.profile = profile
+        self.expires_at = expires_at
+
+    def __repr__(self) -> str:
+        return f"Identity(id={self.id!r}, username={self.username!r})"
+
+
+class IdentityMap:
+    def __init__(
+        self, maxsize: int = IDENTITY_CACHE_SIZE, ttl: float = IDENTITY_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._by_id: "OrderedDict[int, Identity]" = OrderedDict()
+        self._by_username: Dict[str, Identity] = {}
+        # Bumped by every invalidation, so that a lookup that raced with a
+        # write doesn't cache what it read before the write.
+        self._generation = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def by_id(self, session: Session, id: Any) -> Optional[Identity]:
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+        identity = self._get(self._by_id, id)
+        if identity is None:
+            identity = self._load(session, User.id == id)
+        return identity
+
+    def by_username(self, session: Session, username: str) -> Optional[Identity]:
+        identity = self._get(self._by_username, username)
+        if identity is None:
+            identity = self._load(session, User.username == username)
+        return identity
+
+    def _get(self, index: Dict[Any, Identity], key: Any) -> Optional[Identity]:
+        with self._lock:
+            identity = index.get(key)
+            if identity is None:
+                return None
+            if identity.expires_at < monotonic():
+                self._remove(identity.id)
+                return None
+            self._by_id.move_to_end(identity.id)
+            return identity
+
+    def _load(self, session: Session, criterion: Any) -> Optional[Identity]:
+        generation = self._generation
+        serializer = serializer_for(User)
+        # `username` isn't unique, so take the first, as `users.show` does.
+        statement = serializer.select().filter(criterion).order_by(User.id).limit(1)
+        rows = serializer.rows(session.execute(statement))
+        if not rows:
+            return None
+        identity = Identity(rows[0], monotonic() + self.ttl)
+        if self.enabled:
+            self._set(identity, generation)
+        return identity
+
+    def _set(self, identity: Identity, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._remove(identity.id)
+            self._by_id[identity.id] = identity
+            if identity.username is not None:
+                self._by_username.setdefault(identity.username, identity)
+            while len(self._by_id) > self.maxsize:
+                self._remove(next(iter(self._by_id)))
+
+    def _remove(self, id: int):
+        identity = self._by_id.pop(id, None)
+        if identity is not None and identity.username is not None:
+            if self._by_username.get(identity.username) is identity:
+                del self._by_username[identity.username]
+
+    def invalidate(self, ids: Any):
+        """Forget the users with `ids`."""
+        with self._lock:
+            self._generation += 1
+            for id in ids:
+                self._remove(id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._by_id.clear()
+            self._by_username.clear()
+
+    def watch(self, Session: sessionmaker):
+        """Invalidate users written through sessions from `Session`.
+
+        Users are forgotten when a flush writes them, so the writing session
+        doesn't read its old profile back, and again on commit, in case
+        another request cached the old profile in between.
+        """
+        event.listen(Session, "after_flush", self._record_flush)
+        event.listen(Session, "do_orm_execute", self._record_statement)
+        event.listen(Session, "after_commit", self._forget_changed)
+        event.listen(Session, "after_rollback", self._forget_changed)
+
+    def _record_flush(self, session: Session, _):
+        ids = {
+            obj.id
+            for obj in [*session.new, *session.dirty, *session.deleted]
+            if isinstance(obj, User) and obj.id is not None
+        }
+        if ids:
+            session.info.setdefault("changed_users", set()).update(ids)
+            self.invalidate(ids)
+
+    def _record_statement(self, state: ORMExecuteState):
+        if state.is_insert or state.is_update or state.is_delete:
+            if state.statement.table.name == User.__tablename__:  # type: ignore
+                state.session.info["changed_users_all"] = True
+                self.clear()
+
+    def _forget_changed(self, session: Session):
+        if session.info.pop("changed_users_all", False):
+            self.clear()
+        ids = session.info.pop("changed_users", None)
+        if ids:
+            self.invalidate(ids)
+
+
+def identities() -> IdentityMap:
+    """The current app's `IdentityMap`."""
+    return current_app.extensions["identities"]
+
+
+def init_identities(app: Flask, Session: sessionmaker) -> IdentityMap:
+    """Give `app` an `IdentityMap` kept up to date with writes through
+    `Session`."""
+    identity_map = IdentityMap()
+    identity_map.watch(Session)
+    app.extensions["identities"] = identity_map
+    return identity_map
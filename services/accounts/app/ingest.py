@@ -0,0 +1,147 @@
+"""Concurrent bulk upload of facts to Oso Cloud.
+
+Sending facts one `bulk_tell` at a time leaves the process waiting on the
+network for every batch. `ingest` keeps up to `max_workers` batches in flight
+on a thread pool, retries each with exponential backoff if it failed for a
+reason that might go away (see `retryable`), and collects the batches that
+still failed so they can be retried later with `replay`.
+
+Only the HTTP calls run on the pool. Each batch is recorded with
+`CachedOso.record_writes` on the calling thread once it lands, so the fact
+replica joins the caller's session like any other write.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from os import getenv
+import re
+from time import monotonic
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import backoff
+import requests
+from oso_cloud import Fact
+
+from .authorization import CachedOso, oso as default_oso
+
+BATCH_SIZE = int(getenv("OSO_INGEST_BATCH_SIZE", "100"))
+MAX_WORKERS = int(getenv("OSO_INGEST_WORKERS", "8"))
+MAX_TRIES = int(getenv("OSO_INGEST_MAX_TRIES", "5"))
+# Seconds between progress reports.
+REPORT_INTERVAL = 5.0
+# How `oso_cloud` reports an error response, which it raises as a plain
+# `Exception`.
+_STATUS_ERROR = re.compile(r"Got unexpected error from Oso Service: (\d{3})")
+
+
+@dataclass
+class IngestResult:
+    total: int = 0
+    sent: int = 0
+    failed: List[List[Fact]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def failed_facts(self) -> List[Fact]:
+        return [fact for batch in self.failed for fact in batch]
+
+    @property
+    def throughput(self) -> float:
+        """Facts sent per second."""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        status = (
+            f"{self.sent}/{self.total} facts in {self.elapsed:.1f}s"
+            f" ({self.throughput:.0f} facts/s)"
+        )
+        if self.failed:
+            status += f", {len(self.failed)} batches failed"
+        return status
+
+
+def batches(facts: Iterable[Fact], batch_size: int) -> Iterator[List[Fact]]:
+    batch: List[Fact] = []
+    for fact in facts:
+        batch.append(fact)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def retryable(error: Exception) -> bool:
+    """Whether sending a batch again might succeed: the connection failed or
+    timed out, or Oso Cloud answered 429 or 5xx. Anything else (e.g. a 400
+    for a malformed fact) fails the same way every time."""
+    if isinstance(
+        error,
+        (
+            ConnectionError,
+            TimeoutError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ),
+    ):
+        return True
+    match = _STATUS_ERROR.match(str(error))
+    return match is not None and (match[1] == "429" or match[1].startswith("5"))
+
+
+def ingest(
+    facts: Iterable[Fact],
+    oso: Optional[CachedOso] = None,
+    batch_size: int = BATCH_SIZE,
+    max_workers: int = MAX_WORKERS,
+    max_tries: int = MAX_TRIES,
+    progress: Optional[Callable[[IngestResult], None]] = print,
+) -> IngestResult:
+    """Tell Oso Cloud `facts`, `batch_size` at a time over `max_workers` threads.
+
+    `facts` can be a lazy iterable, which is consumed as batches are sent.
+    Never raises for a failed batch; check `IngestResult.failed`.
+    """
+    oso = oso or default_oso
+    result = IngestResult()
+    send = backoff.on_exception(
+        backoff.expo,
+        Exception,
+        max_tries=max_tries,
+        giveup=lambda error: not retryable(error),
+    )(oso.client.bulk_tell)
+    started = last_report = monotonic()
+
+    def done(future: Future, batch: List[Fact]):
+        nonlocal last_report
+        if future.exception() is not None:
+            result.failed.append(batch)
+        else:
+            result.sent += len(batch)
+            oso.record_writes(tell=batch)
+        result.elapsed = monotonic() - started
+        if progress is not None and monotonic() - last_report >= REPORT_INTERVAL:
+            progress(result)
+            last_report = monotonic()
+
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="ingest") as pool:
+        pending: Dict[Future, List[Fact]] = {}
+        for batch in batches(facts, batch_size):
+            # Bound how far ahead of the network we get.
+            while len(pending) >= 2 * max_workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done(future, pending.pop(future))
+            pending[pool.submit(send, batch)] = batch
+            result.total += len(batch)
+        for future in list(pending):
+            done(future, pending.pop(future))
+
+    result.elapsed = monotonic() - started
+    if progress is not None:
+        progress(result)
+    return result
+
+
+def replay(result: IngestResult, **kwargs) -> IngestResult:
+    """Retry the batches that failed in `result`."""
+    return ingest(result.failed_facts, **kwargs)
@@ -0,0 +1,187 @@
+"""Per-request counts and timings for SQL statements and Oso calls, enabled
+with `INSTRUMENTATION=1`.
+
+`Instrumentation` listens to the engine's cursor events and wraps the Oso
+client, adding up what each request spends on both:
+
+    Server-Timing: db;dur=3.1;desc="2 queries", oso;dur=12.4;desc="5 calls",
+        pool;dur=0.0;desc="connection wait", total;dur=17.9
+
+and logs a JSON line per request at `INFO` to the `app.instrumentation`
+logger, keyed by the `oso-request-id` header. Oso calls made from `CachedOso`'s
+thread pool are attributed to the request that made them, so `oso` can add up
+to more than the request's wall time.
+
+Headers are set before a streamed body is sent, so for `?stream=1` listings
+only the log line (written once the response is closed) has the full counts.
+
+Each report is passed to every callable in `Instrumentation.reporters`, which
+can be extended with other sinks through `app.extensions["instrumentation"]`.
+"""
+import json
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import Flask, Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .authorization import CachedOso
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestMetrics:
+    request_id: Optional[str] = None
+    method: str = ""
+    path: str = ""
+    endpoint: Optional[str] = None
+    status: int = 0
+    started: float = field(default_factory=perf_counter)
+    duration: float = 0.0
+    db_time: float = 0.0
+    queries: int = 0
+    oso_time: float = 0.0
+    oso_calls: int = 0
+    pool_wait: float = 0.0
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    def add_query(self, elapsed: float):
+        with self._lock:
+            self.queries += 1
+            self.db_time += elapsed
+
+    def add_oso_call(self, elapsed: float):
+        with self._lock:
+            self.oso_calls += 1
+            self.oso_time += elapsed
+
+    def add_pool_wait(self, elapsed: float):
+        with self._lock:
+            self.pool_wait += elapsed
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            [
+                f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+                f'oso;dur={self.oso_time * 1000:.1f};desc="{self.oso_calls} calls"',
+                f'pool;dur={self.pool_wait * 1000:.1f};desc="connection wait"',
+                f"total;dur={(perf_counter() - self.started) * 1000:.1f}",
+            ]
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3),
+            "db_ms": round(self.db_time * 1000, 3),
+            "queries": self.queries,
+            "oso_ms": round(self.oso_time * 1000, 3),
+            "oso_calls": self.oso_calls,
+            "pool_wait_ms": round(self.pool_wait * 1000, 3),
+        }
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+def current_metrics() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+class InstrumentedClient:
+    """Times every method call on an Oso client."""
+
+    instrumented = True
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            metrics = _current.get()
+            if metrics is None:
+                return attr(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                metrics.add_oso_call(perf_counter() - start)
+
+        return timed
+
+
+Reporter = Callable[[RequestMetrics], None]
+
+
+def log_report(metrics: RequestMetrics):
+    logger.info(json.dumps(metrics.as_dict()))
+
+
+class Instrumentation:
+    def __init__(self, app: Flask, engine: Engine, oso: CachedOso):
+        self.reporters: List[Reporter] = [log_report]
+        app.extensions["instrumentation"] = self
+
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        if not getattr(oso.client, "instrumented", False):
+            oso.client = InstrumentedClient(oso.client)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        if _current.get() is not None and context is not None:
+            context._query_started = perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        metrics = _current.get()
+        started = getattr(context, "_query_started", None)
+        if metrics is not None and started is not None:
+            metrics.add_query(perf_counter() - started)
+
+    def _start(self):
+        _current.set(
+            RequestMetrics(
+                request_id=request.headers.get("oso-request-id"),
+                method=request.method,
+                path=request.path,
+                endpoint=request.endpoint,
+            )
+        )
+
+    def _finish(self, response: Response) -> Response:
+        metrics = _current.get()
+        if metrics is None:
+            return response
+        metrics.status = response.status_code
+        response.headers["Server-Timing"] = metrics.server_timing()
+
+        # After a streamed body has been sent.
+        @response.call_on_close
+        def report():
+            metrics.duration = perf_counter() - metrics.started
+            for reporter in self.reporters:
+                reporter(metrics)
+
+        return response
+
+    def _teardown(self, _):
+        _current.set(None)
@@ -0,0 +1,131 @@
+from random import Random
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from sqlalchemy import func, select
+from sqlalchemy.orm.session import Session
+
+from .models import Organization, Repository, User
+from .serializers import serializer_for
+
+# Comfortably below SQLite's default limit of 999 bound parameters.
+CHUNK_SIZE = 500
+# Ids tried at once by `load_random` before settling for the next row after one.
+RANDOM_CANDIDATES = 8
+
+_random = Random()
+
+
+def _id_chunks(
+    cls: Type[Any], ids: Iterable[Any], chunk_size: int
+) -> Tuple[List[str], List[List[Any]]]:
+    ordered = list(dict.fromkeys(str(id) for id in ids))
+    id_type = cls.id.type.python_type
+    chunks = [
+        [id_type(id) for id in ordered[start : start + chunk_size]]
+        for start in range(0, len(ordered), chunk_size)
+    ]
+    return ordered, chunks
+
+
+def load_by_ids(
+    session: Session,
+    cls: Type[Any],
+    ids: Iterable[Any],
+    *criteria: Any,
+    chunk_size: int = CHUNK_SIZE,
+) -> List[Any]:
+    """Load the rows of `cls` with the given ids using chunked `IN` queries.
+
+    Rows come back in the order of `ids`. Duplicate ids are loaded once, and
+    ids that don't match a row (or `criteria`) are skipped.
+    """
+    ordered, chunks = _id_chunks(cls, ids, chunk_size)
+    found = {}
+    for chunk in chunks:
+        for row in session.query(cls).filter(cls.id.in_(chunk), *criteria):
+            found[str(row.id)] = row
+    return [found[id] for id in ordered if id in found]
+
+
+def iter_dump_by_ids(
+    session: Session,
+    cls: Type[Any],
+    ids: Iterable[Any],
+    *criteria: Any,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Lazily yield the JSON dicts for `ids`, one list per chunk.
+
+    Within and across chunks, rows keep the order of `ids`.
+    """
+    serializer = serializer_for(cls)
+    ordered, chunks = _id_chunks(cls, ids, chunk_size)
+    for start, chunk in zip(range(0, len(ordered), chunk_size), chunks):
+        result = session.execute(
+            serializer.select().filter(cls.id.in_(chunk), *criteria)
+        )
+        found = {str(row["id"]): row for row in serializer.rows(result)}
+        yield [found[id] for id in ordered[start : start + chunk_size] if id in found]
+
+
+def dump_by_ids(
+    session: Session,
+    cls: Type[Any],
+    ids: Iterable[Any],
+    *criteria: Any,
+    chunk_size: int = CHUNK_SIZE,
+) -> List[Dict[str, Any]]:
+    """Like `load_by_ids`, but returns JSON dicts without hydrating ORM objects."""
+    return [
+        row
+        for rows in iter_dump_by_ids(
+            session, cls, ids, *criteria, chunk_size=chunk_size
+        )
+        for row in rows
+    ]
+
+
+def load_users_by_ids(session: Session, ids: Iterable[Any]) -> List[User]:
+    return load_by_ids(session, User, ids)
+
+
+def load_orgs_by_ids(session: Session, ids: Iterable[Any]) -> List[Organization]:
+    return load_by_ids(session, Organization, ids)
+
+
+def load_repos_by_ids(
+    session: Session, ids: Iterable[Any], org_id: Optional[int] = None
+) -> List[Repository]:
+    criteria = [] if org_id is None else [Repository.org_id == org_id]
+    return load_by_ids(session, Repository, ids, *criteria)
+
+
+def load_random(
+    session: Session,
+    cls: Type[Any],
+    candidates: int = RANDOM_CANDIDATES,
+    rng: Random = _random,
+) -> Optional[Any]:
+    """A random row of `cls`, or `None` if there are none.
+
+    Unlike `ORDER BY RANDOM()`, which reads and sorts the whole table, this
+    looks ids up in the primary key index: `candidates` ids are drawn from the
+    table's id range and one of the rows found is picked. Every row is equally
+    likely unless all the candidates land in gaps, when the first row after
+    one of them is used instead.
+    """
+    # Separate subqueries, as SQLite only reads `min` or `max` straight off
+    # the index when it's the query's only aggregate.
+    low, high = session.execute(
+        select(
+            select(func.min(cls.id)).scalar_subquery(),
+            select(func.max(cls.id)).scalar_subquery(),
+        )
+    ).one()
+    if low is None:
+        return None
+    ids = [rng.randint(low, high) for _ in range(candidates)]
+    found = session.query(cls).filter(cls.id.in_(ids)).all()
+    if found:
+        return rng.choice(found)
+    return session.query(cls).filter(cls.id >= ids[0]).order_by(cls.id).first()
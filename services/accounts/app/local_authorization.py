@@ -0,0 +1,142 @@
+"""Authorization filters evaluated in SQL against a local copy of Oso facts.
+
+`oso.list` returns every authorized id, which listings then turn into an
+`IN (...)` list. For actors who can see a lot of resources that's a large
+response from Oso Cloud and more bound parameters than SQLite allows. Instead,
+`authorized_filter` builds an `EXISTS` against the `facts` table, so
+authorization and pagination run as one indexed query.
+
+The filters translate the rules in `policy/authorization.polar`; keep the two
+in sync. Relations and attributes Oso gets from this database
+(`has_relation(repo, "organization", org)`, `is_public`, `is_protected`) are
+read from their columns directly, only roles are read from `facts`.
+
+The `facts` table is kept up to date by `facts.FactReplica`, which is always
+enabled when any endpoint filters in SQL.
+
+Which endpoints filter in SQL is set with `SQL_AUTHZ_FILTER`, a comma separated
+list of endpoint names (e.g. `repos.index`) or `*` for all of them, so the two
+paths can be compared on the same deployment.
+"""
+from typing import Any, Iterable, List, Optional, Sequence
+
+from flask import current_app, request
+from oso_cloud import Value
+from sqlalchemy import and_, cast, exists, false, or_, true
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.types import String
+
+from .authorization import value_key
+from .models import Fact, Organization, Repository
+
+# Lowest to highest; each role has every permission of the roles before it.
+ORGANIZATION_ROLES = ["member", "admin"]
+REPOSITORY_ROLES = ["reader", "editor", "maintainer", "admin"]
+
+# The least role that grants each permission.
+ORGANIZATION_PERMISSIONS = {
+    "read_details": "member",
+    "view_members": "member",
+    "create_repositories": "member",
+    "manage_members": "admin",
+    "set_default_role": "admin",
+    "delete": "admin",
+}
+REPOSITORY_PERMISSIONS = {
+    "read": "reader",
+    "read_issues": "reader",
+    "create_issues": "reader",
+    "read_jobs": "editor",
+    "write": "editor",
+    "manage_jobs": "editor",
+    "manage_issues": "editor",
+    "view_members": "maintainer",
+    "manage_members": "admin",
+    "update": "admin",
+    "delete": "admin",
+    "invite": "admin",
+}
+
+# The repository role implied by each role on the repository's organization.
+ORGANIZATION_REPOSITORY_ROLES = {"member": "reader", "admin": "admin"}
+
+
+def _at_least(roles: Sequence[str], role: str) -> List[str]:
+    return list(roles[roles.index(role) :])
+
+
+def has_role(
+    actor: Value, roles: Iterable[str], resource_type: str, resource_id: Any
+) -> ColumnElement:
+    """`EXISTS` a `has_role` fact giving `actor` one of `roles` on the resource
+    whose id is the (usually correlated) column `resource_id`."""
+    actor_type, actor_id = value_key(actor) or (None, None)
+    return exists().where(
+        Fact.name == "has_role",
+        Fact.arg0_type == actor_type,
+        Fact.arg0_id == actor_id,
+        Fact.arg1_type == "String",
+        Fact.arg1_id.in_(list(roles)),
+        Fact.arg2_type == resource_type,
+        Fact.arg2_id == cast(resource_id, String),
+    )
+
+
+def _organization_role(actor: Value, role: str) -> ColumnElement:
+    roles = _at_least(ORGANIZATION_ROLES, role)
+    return has_role(actor, roles, "Organization", Organization.id)
+
+
+def _repository_role(actor: Value, role: str) -> ColumnElement:
+    roles = _at_least(REPOSITORY_ROLES, role)
+    org_roles = [
+        org_role
+        for org_role, repo_role in ORGANIZATION_REPOSITORY_ROLES.items()
+        if repo_role in roles
+    ]
+    clauses = [has_role(actor, roles, "Repository", Repository.id)]
+    if org_roles:
+        clauses.append(has_role(actor, org_roles, "Organization", Repository.org_id))
+    if role == "reader":
+        clauses.append(Repository.public == true())
+    return or_(*clauses)
+
+
+def authorized_filter(actor: Value, action: str, cls: Any) -> ColumnElement:
+    """A `WHERE` clause matching the rows of `cls` `actor` may `action`.
+
+    Raises `ValueError` for resource types and actions that can't be decided
+    locally.
+    """
+    actor_key = value_key(actor)
+    if actor_key is None or actor_key[0] != "User":
+        raise ValueError(f"Can't filter locally for actor {actor!r}")
+    if cls is Organization:
+        if action == "read":
+            # Every user is a member of the application, which can read all
+            # organizations.
+            return true()
+        if action in ORGANIZATION_PERMISSIONS:
+            return _organization_role(actor, ORGANIZATION_PERMISSIONS[action])
+    elif cls is Repository:
+        if action == "delete":
+            return or_(
+                _repository_role(actor, "admin"),
+                and_(
+                    _repository_role(actor, "maintainer"),
+                    Repository.protected == false(),
+                ),
+            )
+        if action in REPOSITORY_PERMISSIONS:
+            return _repository_role(actor, REPOSITORY_PERMISSIONS[action])
+    raise ValueError(f"Can't filter {getattr(cls, '__name__', cls)} {action!r} locally")
+
+
+def sql_filter_enabled(endpoint: Optional[str] = None) -> bool:
+    """Whether `endpoint` (by default the current one) filters in SQL."""
+    endpoints = current_app.config.get("SQL_AUTHZ_FILTER", ())
+    return "*" in endpoints or (endpoint or request.endpoint) in endpoints
+
+
+def parse_endpoints(value: str) -> List[str]:
+    return [endpoint.strip() for endpoint in value.split(",") if endpoint.strip()]
@@ -0,0 +1,103 @@
+"""Schema migrations, with Alembic.
+
+Revisions live in `migrations/versions`, and `create_app` applies any the
+database hasn't had on boot. Write a new one after changing `models`:
+
+    OSO_AUTH=x alembic revision --autogenerate -m "add widgets"
+
+and check it by hand; `tests/test_migrations.py` fails until the migrated
+schema matches the models again.
+
+The first revision adopts databases created by `create_all` before there were
+migrations, adding whatever they're missing. Member counts it adds are counted
+from the local `facts` table when the fact replica is kept (`LOCAL_FACTS=1`),
+and otherwise from the roles in Oso Cloud, read with the client passed to
+`migrate`.
+"""
+import os
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import String, bindparam, func, select, update
+from sqlalchemy.engine import Engine
+
+from .models import Fact, Organization, Repository
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+def backfill_repository_counts(session):
+    """Recompute `Organization.repository_count` for every organization."""
+    session.execute(
+        update(Organization).values(
+            repository_count=select(func.count(Repository.id))
+            .where(Repository.org_id == Organization.id)
+            .scalar_subquery()
+        )
+    )
+
+
+def backfill_member_counts(
+    session, oso_client: Optional[Any] = None, org_id: Optional[int] = None
+):
+    """Recompute `Organization.member_count` from the local `facts` table, or
+    from the organization roles in Oso Cloud if `oso_client` is given. Only
+    for the organization `org_id`, if it's given.
+
+    `oso_client` must be the plain Oso client, not `CachedOso`, which would
+    answer from the replica.
+    """
+    organizations = Organization.__table__
+    reset = update(organizations)
+    if org_id is not None:
+        reset = reset.where(organizations.c.id == org_id)
+
+    if oso_client is None:
+        session.execute(
+            reset.values(
+                member_count=select(func.count(Fact.id))
+                .where(
+                    Fact.name == "has_role",
+                    Fact.arg0_type == "User",
+                    Fact.arg2_type == "Organization",
+                    Fact.arg2_id == organizations.c.id.cast(String),
+                )
+                .scalar_subquery()
+            )
+        )
+        return
+
+    org: Dict[str, str] = {"type": "Organization"}
+    if org_id is not None:
+        org["id"] = str(org_id)
+    roles = oso_client.get({"name": "has_role", "args": [{"type": "User"}, None, org]})
+    counts = Counter(fact["args"][2]["id"] for fact in roles)
+    session.execute(reset.values(member_count=0))
+    if counts:
+        session.execute(
+            update(organizations)
+            .where(organizations.c.id == bindparam("org_id"))
+            .values(member_count=bindparam("count")),
+            [{"org_id": int(id), "count": count} for id, count in counts.items()],
+        )
+
+
+def alembic_config() -> Config:
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS)
+    return config
+
+
+def migrate(engine: Engine, revision: str = "head", oso_client: Any = None):
+    """Apply the migrations `engine`'s database hasn't had yet.
+
+    Without the fact replica, pass the Oso client in `oso_client` to backfill
+    member counts from (see `backfill_member_counts`).
+    """
+    config = alembic_config()
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        config.attributes["oso_client"] = oso_client
+        command.upgrade(config, revision)
@@ -1,13 +1,14 @@
 from typing import Any, Type
 from sqlalchemy.types import Integer, String, Boolean
-from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
+from sqlalchemy.schema import Column, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.session import Session
-from sqlalchemy import select, func
-from sqlalchemy.orm.relationships import RelationshipProperty
+from sqlalchemy import select
 from werkzeug.exceptions import Forbidden, NotFound
 
+from .serializers import register, serializer_for
+
 Base: Type = declarative_base()
 
 
@@ -15,7 +16,8 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    username = Column(String)
+    # Logins and `/users/<username>` look users up by username.
+    username = Column(String, index=True)
     email = Column(String)
     name = Column(String)
 
@@ -27,6 +29,12 @@ class Organization(Base):
     name = Column(String, unique=True)
     description = Column(String)
     billing_address = Column(String)
+    # Maintained by `routes.repos` in the same transaction that creates or
+    # deletes a repository. See `migrations.backfill_repository_counts`.
+    repository_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # The number of `has_role` facts on the organization, maintained by
+    # `routes.role_assignments`. See `migrations.backfill_member_counts`.
+    member_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     repos = relationship("Repository")
 
@@ -47,53 +55,81 @@ class Repository(Base):
     unique_name_in_org = UniqueConstraint(name, org_id)
 
 
+class Fact(Base):
+    """A local copy of an Oso Cloud fact, used to filter listings in SQL.
+
+    Each argument is stored as the `(type, id)` pair Oso uses for it, so
+    `has_role(User{"1"}, "admin", Organization{"2"})` is
+    `("has_role", "User", "1", "String", "admin", "Organization", "2")`.
+    See `local_authorization`.
+    """
+
+    __tablename__ = "facts"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    arg0_type = Column(String)
+    arg0_id = Column(String)
+    arg1_type = Column(String)
+    arg1_id = Column(String)
+    arg2_type = Column(String)
+    arg2_id = Column(String)
+
+    __table_args__ = (
+        UniqueConstraint(
+            name, arg0_type, arg0_id, arg1_type, arg1_id, arg2_type, arg2_id
+        ),
+        # Looks up an actor's roles on a given resource.
+        Index("ix_facts_actor_resource", name, arg0_type, arg0_id, arg2_type, arg2_id),
+        # Lists everyone with a role on a given resource.
+        Index("ix_facts_resource", name, arg2_type, arg2_id, arg0_type),
+    )
+
+
+class ChangeCounter(Base):
+    """How many committed transactions have written to a table, to version
+    ETags. `facts` also counts writes to Oso. See `conditional`."""
+
+    __tablename__ = "change_counters"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# Deferred so that plain lookups (e.g. `get_or_404`) don't pay for the
+# correlated subquery; it's only loaded when a single repository is
+# serialized.
 Repository.name_with_owner = column_property(
     select(Organization.name + "/" + Repository.name)
     .filter(Organization.id == Repository.org_id)
-    .scalar_subquery()
-)
-
-
-Organization.repository_count = column_property(
-    select(func.count(Repository.id))
-    .where(Repository.org_id == Organization.id)
-    .correlate_except(Repository)
     .scalar_subquery(),
+    deferred=True,
 )
 
+# Listings select `name_with_owner` through a join instead.
+Repository.__json_joins__ = [(Organization, Organization.id == Repository.org_id)]
+Repository.__json_overrides__ = {
+    "name_with_owner": Organization.name + "/" + Repository.name
+}
 
 
-# Creates Marshmallow schemas for all models which makes
-# it easy to serialize with `as_json`
+# Compiles a serializer for every model, which makes it easy to serialize
+# with `as_json`
 def setup_schema(base):
     for mapper in base.registry.mappers:
         class_ = mapper.class_
         if hasattr(class_, "__tablename__"):
-            columns = []
-            for d in mapper.all_orm_descriptors:
-                # print(d.__dict__)
-                # breakpoint()
-                if hasattr(d, "property") and isinstance(
-                    d.property, RelationshipProperty
-                ):
-                    continue
-                if hasattr(d, "key"):
-                    columns.append(d.key)
-                elif hasattr(d, "__name__"):
-                    columns.append(d.__name__)
-                else:
-                    raise Exception("Unable to find column name for %s" % d)
-
+            serializer = register(mapper)
             print(
                 "Creating schema for %s" % class_.__name__
-                + " with columns %s" % columns
-            )
-            setattr(class_, "__columns", columns)
-            setattr(
-                class_,
-                "as_json",
-                lambda self: {c: getattr(self, c) for c in self.__class__.__columns},
+                + " with columns %s" % serializer.keys
             )
+            setattr(class_, "__columns", serializer.keys)
+            setattr(class_, "as_json", as_json)
+
+
+def as_json(self):
+    return serializer_for(self.__class__)(self)
 
 
 def get_or_raise(self, cls: Type[Any], error, **kwargs):
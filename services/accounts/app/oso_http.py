@@ -0,0 +1,142 @@
+"""Connection settings and latency histograms for the Oso Cloud client.
+
+`oso_cloud.Oso` keeps a `requests.Session`, but its default adapter only
+keeps 10 connections alive per host. With request threads, `actions_many`
+fan-out and `oso.futures` all sharing the client, the rest are opened, and
+the TLS handshake paid, on every call. `configure` mounts an adapter sized
+for that:
+
+- `OSO_POOL_SIZE` (32): connections kept alive to Oso Cloud.
+- `OSO_CONNECT_TIMEOUT` (1) and `OSO_READ_TIMEOUT` (5): seconds, replacing
+  the client's fixed timeouts. Timed out calls are retried by the client.
+
+Keep-alive probes stop idle connections from being dropped by NATs and load
+balancers in between. (`requests` already asks for gzip-compressed responses,
+which matters for large `list` and `get` results.)
+
+Every round trip is timed into `oso_latency`, a histogram per API path,
+served by the app at `/_oso_latency`.
+"""
+import os
+import socket
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from oso_cloud import Oso
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS: Tuple[float, ...] = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        # The last count is for calls slower than every bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def percentile(self, p: float) -> float:
+        """The upper bound of the bucket holding the `p`th percentile."""
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return float("inf") if self.counts[-1] else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        bounds: List[Any] = [*self.buckets, "+Inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": {str(bound): count for bound, count in zip(bounds, self.counts)},
+        }
+
+
+class LatencyHistograms:
+    """A `Histogram` per name, safe to update from any thread."""
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            self._histograms[name].observe(seconds * 1000)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: histogram.as_dict()
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+oso_latency = LatencyHistograms()
+
+
+class OsoAdapter(HTTPAdapter):
+    """Pooled keep-alive connections with our own timeouts, timing every call."""
+
+    def __init__(self, pool_size: int, timeout: Tuple[float, float]):
+        self.timeout = timeout
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = [
+            *HTTPConnection.default_socket_options,
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        kwargs["timeout"] = self.timeout
+        start = perf_counter()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            path = urlsplit(request.url).path
+            oso_latency.observe(f"{request.method} {path}", perf_counter() - start)
+
+
+def configure(
+    client: Oso,
+    pool_size: Optional[int] = None,
+    timeout: Optional[Tuple[float, float]] = None,
+) -> Oso:
+    """Mount an `OsoAdapter` on `client`'s sessions, configured from the
+    environment unless given."""
+    pool_size = pool_size or int(os.environ.get("OSO_POOL_SIZE", "32"))
+    timeout = timeout or (
+        float(os.environ.get("OSO_CONNECT_TIMEOUT", "1")),
+        float(os.environ.get("OSO_READ_TIMEOUT", "5")),
+    )
+    sessions = [client.api.session]
+    if client.api.fallback_url:
+        sessions.append(client.api.fallback_session)
+    for session in sessions:
+        adapter = OsoAdapter(pool_size, timeout)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return client
@@ -0,0 +1,161 @@
+from dataclasses import dataclass
+from itertools import chain, groupby, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlencode
+
+from flask import Response, request, stream_with_context
+from sqlalchemy.orm.session import Session
+from sqlalchemy.sql import Select
+from werkzeug.exceptions import BadRequest
+
+from .serializers import Serializer, dumps, json_response
+
+MAX_LIMIT = 1000
+# Rows fetched per round trip to the database when walking a result set, and
+# decorated (e.g. with permissions) at a time when streaming.
+BATCH_SIZE = 500
+
+Rows = List[Dict[str, Any]]
+
+
+def _int_arg(name: str) -> Optional[int]:
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+
+
+@dataclass
+class Page:
+    """Keyset pagination over `id`, read from the `limit`, `cursor` and
+    `stream` query parameters.
+
+    Without `limit`, listings return every row as before. With it, at most
+    `limit` rows with an id greater than `cursor` are returned, and the
+    `X-Next-Cursor` and `Link` headers point at the next page when there is
+    one.
+
+    With `stream=1`, the JSON array is written out in batches as rows are read
+    so memory stays flat no matter how large the result is. Streamed responses
+    can't know whether there's a next page before the body is sent, so there's
+    no `X-Next-Cursor`; pass the last id received as the next `cursor`.
+    """
+
+    limit: Optional[int] = None
+    cursor: Optional[int] = None
+    stream: bool = False
+
+    @classmethod
+    def from_request(cls) -> "Page":
+        limit = _int_arg("limit")
+        if limit is not None and not 0 < limit <= MAX_LIMIT:
+            raise BadRequest(f"limit must be between 1 and {MAX_LIMIT}")
+        stream = request.args.get("stream", "0") not in ("0", "false", "")
+        return cls(limit=limit, cursor=_int_arg("cursor"), stream=stream)
+
+    def select(self, statement: Select, column: Any) -> Select:
+        """Order `statement` by `column`, starting after the cursor."""
+        if self.cursor is not None:
+            statement = statement.where(column > self.cursor)
+        statement = statement.order_by(column)
+        if self.limit is not None:
+            # One extra row tells us whether there's a next page.
+            statement = statement.limit(self.limit + (0 if self.stream else 1))
+        return statement
+
+    def ids(self, ids: Iterable[Any]) -> List[int]:
+        """Sort `ids` and drop everything up to and including the cursor."""
+        ordered = sorted({int(id) for id in ids})
+        if self.cursor is not None:
+            ordered = [id for id in ordered if id > self.cursor]
+        return ordered
+
+    def response(
+        self,
+        batches: Iterable[Rows],
+        decorate: Callable[[Rows], None] = lambda rows: None,
+        key: Callable[[Dict[str, Any]], Any] = lambda row: row["id"],
+        grouped: bool = False,
+    ) -> Response:
+        """Render `batches` of rows as a JSON array.
+
+        `decorate` is called on each batch of rows just before it's written,
+        which lets callers fetch per-row data for a batch at a time. `key`
+        returns the id a row is paginated by.
+
+        With `grouped`, rows that share a key (e.g. a user's roles) count as
+        one against `limit` and are never split between pages, since the next
+        page starts after the key. They must be next to each other, in the
+        same batch.
+        """
+        entries: Iterable[List[Any]] = batches
+        entry_key = key
+        flatten: Callable[[List[Any]], Rows] = lambda entries: entries
+        if grouped:
+            entries = (
+                [list(rows) for _, rows in groupby(batch, key)] for batch in batches
+            )
+            entry_key = lambda group: key(group[0])
+            flatten = lambda groups: list(chain.from_iterable(groups))
+
+        if self.stream:
+            return self._stream(entries, decorate, flatten)
+
+        stop = None if self.limit is None else self.limit + 1
+        page = list(islice(chain.from_iterable(entries), stop))
+        next_cursor = None
+        if self.limit is not None and len(page) > self.limit:
+            page = page[: self.limit]
+            next_cursor = entry_key(page[-1])
+        rows = flatten(page)
+        decorate(rows)
+        response = json_response(rows)
+        if next_cursor is not None:
+            args = {**request.args.to_dict(), "cursor": next_cursor}
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+            response.headers[
+                "Link"
+            ] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+        return response
+
+    def _stream(
+        self,
+        batches: Iterable[List[Any]],
+        decorate: Callable[[Rows], None],
+        flatten: Callable[[List[Any]], Rows],
+    ) -> Response:
+        remaining = self.limit
+
+        def generate() -> Iterator[bytes]:
+            nonlocal remaining
+            separator = b""
+            yield b"["
+            for batch in batches:
+                if remaining is not None:
+                    batch = batch[:remaining]
+                    remaining -= len(batch)
+                rows = flatten(batch)
+                decorate(rows)
+                for row in rows:
+                    yield separator + dumps(row)
+                    separator = b","
+                if remaining == 0:
+                    break
+            yield b"]"
+
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def select_batches(
+    session: Session,
+    serializer: Serializer,
+    statement: Select,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Rows]:
+    """Lazily run `statement`, yielding JSON dicts `batch_size` rows at a time."""
+    result = session.execute(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions(batch_size):
+        yield serializer.rows(partition)
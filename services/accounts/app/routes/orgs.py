@@ -1,13 +1,20 @@
-from flask import Blueprint, g, request, jsonify
+from flask import Blueprint, g, request
+from sqlalchemy.exc import IntegrityError
 from typing import cast
 from werkzeug.exceptions import Forbidden, NotFound
 
 
 from ..models import Organization
 from ..authorization import oso
+from .. import conditional
+from ..loaders import iter_dump_by_ids
+from ..local_authorization import authorized_filter, sql_filter_enabled
+from ..pagination import Page, select_batches
+from ..serializers import serializer_for
 from oso_cloud import Value
 
 bp = Blueprint("orgs", __name__, url_prefix="/orgs")
+conditional.enable(bp, tables=["organizations", "facts"], views=["index"])
 
 
 @bp.route("", methods=["GET"])
@@ -16,29 +23,31 @@ def index():
         "type": "User",
         "id": str(g.current_user),
     }
-    authorized_ids = oso.list(user, "read", "Organization")
-    if authorized_ids == ["*"]:
-        orgs = g.session.query(Organization).order_by(Organization.id)
-        return jsonify([o.as_json() for o in orgs])
-    else:
-        orgs = (
-            g.session.query(Organization)
-            .filter(Organization.id.in_(authorized_ids))
-            .order_by(Organization.id)
+    page = Page.from_request()
+    serializer = serializer_for(Organization)
+    if sql_filter_enabled():
+        statement = serializer.select().where(
+            authorized_filter(user, "read", Organization)
+        )
+        orgs = select_batches(
+            g.session, serializer, page.select(statement, Organization.id)
         )
-        return jsonify([o.as_json() for o in orgs])
+    else:
+        authorized_ids = oso.list(user, "read", "Organization")
+        if authorized_ids == ["*"]:
+            orgs = select_batches(
+                g.session, serializer, page.select(serializer.select(), Organization.id)
+            )
+        else:
+            orgs = iter_dump_by_ids(g.session, Organization, page.ids(authorized_ids))
+    return page.response(
+        orgs, lambda rows: oso.add_permissions(user, "Organization", rows)
+    )
 
 
 @bp.route("", methods=["POST"])
 def create():
     payload = cast(dict, request.get_json(force=True))
-    if (
-        g.session.query(Organization)
-        .filter(Organization.name == payload["name"])
-        .first()
-        is not None
-    ):
-        return "Organization with that name already exists", 400
     org = Organization(**payload)
     user: Value = {
         "type": "User",
@@ -47,13 +56,27 @@ def create():
     if not oso.authorize(user, "create", "Organization"):
         raise Forbidden
     g.session.add(org)
-    g.session.commit()
-    oso.tell(
-        {
-            "name": "has_role",
-            "args": [user, "admin", {"type": "Organization", "id": str(org.id)}],
-        }
-    )
+    # Flush to assign the organization an id before telling Oso about it.
+    # Names are unique, so a taken one fails here instead of being looked up.
+    try:
+        g.session.flush()
+    except IntegrityError:
+        g.session.rollback()
+        return "Organization with that name already exists", 400
+    role = {
+        "name": "has_role",
+        "args": [user, "admin", {"type": "Organization", "id": str(org.id)}],
+    }
+    oso.tell(role)
+    org.member_count = 1
+    try:
+        g.session.commit()
+    except Exception:
+        # Don't leave a role on an organization that was never created, for
+        # whichever organization gets its id next.
+        g.session.rollback()
+        oso.delete(role)
+        raise
     return org.as_json(), 201  # type: ignore
 
 
@@ -63,11 +86,13 @@ def show(org_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read", {"type": "Organization", "id": org_id}):
-        raise NotFound
+    actions = oso.futures.actions(user, {"type": "Organization", "id": org_id})
     org = g.session.get_or_404(Organization, id=org_id)
+    permissions = actions.result()
+    if "read" not in permissions:
+        raise NotFound
     json = org.as_json()
-    json["permissions"] = oso.actions(user, {"type": "Organization", "id": org_id})
+    json["permissions"] = permissions
     return json
 
 
@@ -77,9 +102,10 @@ def delete(org_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read", {"type": "Organization", "id": org_id}):
+    permissions = oso.actions(user, {"type": "Organization", "id": org_id})
+    if "read" not in permissions:
         raise NotFound
-    if not oso.authorize(user, "delete", {"type": "Organization", "id": org_id}):
+    elif "delete" not in permissions:
         raise Forbidden
     org = g.session.get_or_404(Organization, id=org_id)
     g.session.delete(org)
@@ -107,16 +133,9 @@ def user_count(org_id):
     }
     if not oso.authorize(user, "read", {"type": "Organization", "id": str(org_id)}):
         raise NotFound
-    org_users = oso.get(
-        {
-            "name": "has_role",
-            "args": [
-                {
-                    "type": "User",
-                },
-                {},
-                {"type": "Organization", "id": str(org_id)},
-            ],
-        }
+    member_count = (
+        g.session.query(Organization.member_count).filter_by(id=org_id).scalar()
     )
-    return str(len(list(org_users)))
+    if member_count is None:
+        raise NotFound
+    return str(member_count)
@@ -1,13 +1,22 @@
-from flask import Blueprint, g, request, jsonify
+from flask import Blueprint, g, request
+from sqlalchemy.exc import IntegrityError
 from oso_cloud import Value
 from typing import cast
 from werkzeug.exceptions import NotFound, Forbidden
 
 
-from ..models import Repository
+from ..models import Organization, Repository
 from ..authorization import oso
+from .. import conditional
+from ..loaders import iter_dump_by_ids
+from ..local_authorization import authorized_filter, sql_filter_enabled
+from ..pagination import Page, select_batches
+from ..serializers import serializer_for
 
 bp = Blueprint("repos", __name__, url_prefix="/orgs/<int:org_id>/repos")
+conditional.enable(
+    bp, tables=["repositories", "organizations", "facts"], views=["index"]
+)
 
 
 @bp.route("", methods=["GET"])
@@ -18,15 +27,30 @@ def index(org_id):
     }
     if not oso.authorize(user, "read", {"type": "Organization", "id": org_id}):
         raise NotFound
-    authorized_ids = oso.list(user, "read", "Repository")
-    if authorized_ids == ["*"]:
-        repos = g.session.query(Repository).filter_by(org_id=org_id)
-        return jsonify([r.as_json() for r in repos])
-    else:
-        repos = g.session.query(Repository).filter(
-            Repository.id.in_(authorized_ids), Repository.org_id == org_id
+    page = Page.from_request()
+    serializer = serializer_for(Repository)
+    statement = serializer.select().filter(Repository.org_id == org_id)
+    if sql_filter_enabled():
+        statement = statement.where(authorized_filter(user, "read", Repository))
+        repos = select_batches(
+            g.session, serializer, page.select(statement, Repository.id)
         )
-        return jsonify([r.as_json() for r in repos])
+    else:
+        authorized_ids = oso.list(user, "read", "Repository")
+        if authorized_ids == ["*"]:
+            repos = select_batches(
+                g.session, serializer, page.select(statement, Repository.id)
+            )
+        else:
+            repos = iter_dump_by_ids(
+                g.session,
+                Repository,
+                page.ids(authorized_ids),
+                Repository.org_id == org_id,
+            )
+    return page.response(
+        repos, lambda rows: oso.add_permissions(user, "Repository", rows)
+    )
 
 
 @bp.route("", methods=["POST"])
@@ -35,43 +59,52 @@ def create(org_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read", {"type": "Organization", "id": org_id}):
+    permissions = oso.actions(user, {"type": "Organization", "id": org_id})
+    if "read" not in permissions:
         raise NotFound
-    if not oso.authorize(
-        user, "create_repositories", {"type": "Organization", "id": org_id}
-    ):
+    elif "create_repositories" not in permissions:
         raise Forbidden("you do not have permission to create repositories")
 
     payload = cast(dict, request.get_json(force=True))
 
-    if (
-        g.session.query(Repository)
-        .filter_by(org_id=org_id, name=payload["name"])
-        .first()
-        is not None
-    ):
-        return "Repository with that name already exists", 400
-
     repo = Repository(name=payload["name"], org_id=org_id)
     g.session.add(repo)
-    repoValue: Value = {"type": "Repository", "id": str(repo.id)}
-    oso.bulk(
-        tell=[
-            {
-                "name": "has_relation",
-                "args": [
-                    repoValue,
-                    "organization",
-                    {"type": "Organization", "id": org_id},
-                ],
-            },
-            {
-                "name": "has_role",
-                "args": [user, "admin", repoValue],
-            },
-        ]
+    # Flush to assign the repository an id before telling Oso about it. Names
+    # are unique within an organization, so a taken one fails here instead of
+    # being looked up.
+    try:
+        g.session.flush()
+    except IntegrityError:
+        g.session.rollback()
+        return "Repository with that name already exists", 400
+    g.session.query(Organization).filter_by(id=org_id).update(
+        {Organization.repository_count: Organization.repository_count + 1},
+        synchronize_session=False,
     )
-    g.session.commit()
+    repoValue: Value = {"type": "Repository", "id": str(repo.id)}
+    facts = [
+        {
+            "name": "has_relation",
+            "args": [
+                repoValue,
+                "organization",
+                {"type": "Organization", "id": str(org_id)},
+            ],
+        },
+        {
+            "name": "has_role",
+            "args": [user, "admin", repoValue],
+        },
+    ]
+    oso.bulk(tell=facts)
+    try:
+        g.session.commit()
+    except Exception:
+        # Don't leave facts about a repository that was never created, for
+        # whichever repository gets its id next.
+        g.session.rollback()
+        oso.bulk(delete=facts)
+        raise
     return repo.as_json(), 201  # type: ignore
 
 
@@ -81,11 +114,13 @@ def show(org_id, repo_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read", {"type": "Repository", "id": repo_id}):
-        raise NotFound
+    actions = oso.futures.actions(user, {"type": "Repository", "id": repo_id})
     repo = g.session.get_or_404(Repository, id=repo_id, org_id=org_id)
+    permissions = actions.result()
+    if "read" not in permissions:
+        raise NotFound
     json = repo.as_json()
-    json["permissions"] = oso.actions(user, repo)
+    json["permissions"] = permissions
     return json
 
 
@@ -95,12 +130,17 @@ def delete(org_id, repo_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read", {"type": "Repository", "id": repo_id}):
+    permissions = oso.actions(user, {"type": "Repository", "id": repo_id})
+    if "read" not in permissions:
         raise NotFound
-    if not oso.authorize(user, "delete", {"type": "Repository", "id": repo_id}):
+    elif "delete" not in permissions:
         raise Forbidden
     repo = g.session.get_or_404(Repository, id=repo_id, org_id=org_id)
     g.session.delete(repo)
+    g.session.query(Organization).filter_by(id=org_id).update(
+        {Organization.repository_count: Organization.repository_count - 1},
+        synchronize_session=False,
+    )
     oso.bulk(
         delete=[
             {
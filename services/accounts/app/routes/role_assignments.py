@@ -1,13 +1,64 @@
-from flask import Blueprint, g, request, jsonify
-from typing import cast
+from flask import Blueprint, g, request
+from typing import Dict, List, cast
 from werkzeug.exceptions import Forbidden, NotFound
 
 import oso_cloud
-from oso_cloud import Value
+from oso_cloud import Value, VariableFact
+from sqlalchemy import String
 from ..models import Organization, Repository, User
 from ..authorization import oso
+from .. import conditional
+from ..loaders import iter_dump_by_ids
+from ..migrations import backfill_member_counts
+from ..pagination import Page, select_batches
+from ..serializers import serializer_for
 
 bp = Blueprint("role_assignments", __name__, url_prefix="/orgs/<int:org_id>")
+conditional.enable(
+    bp,
+    tables=["users", "repositories", "organizations", "facts"],
+    views=[
+        "org_index",
+        "org_unassigned_users_index",
+        "repo_index",
+        "repo_unassigned_users_index",
+    ],
+)
+
+
+def _assignment_batches(page: Page, assignment_facts):
+    """Pair each user with a role, in user id order, a chunk of users at a time.
+
+    A user's roles are next to each other in the same chunk, for
+    `Page.response(grouped=True)`.
+    """
+    roles: Dict[str, List[str]] = {}
+    for a in assignment_facts:
+        roles.setdefault(a["args"][0]["id"], []).append(  # type: ignore
+            a["args"][1]["id"]  # type: ignore
+        )
+    for users in iter_dump_by_ids(g.session, User, page.ids(roles)):
+        yield [{"user": u, "role": role} for u in users for role in roles[str(u["id"])]]
+
+
+def _not_assigned(existing: VariableFact):
+    """Filters out users with a role matching `existing`."""
+    replica = oso.local_facts()
+    if replica is not None:
+        return User.id.cast(String).notin_(replica.ids(existing, 0))
+    existing_ids = {fact["args"][0]["id"] for fact in oso.get(existing)}
+    return User.id.notin_(existing_ids)
+
+
+def _recount_members(org_id: int):
+    """Recount the members of organization `org_id` after a write to its roles.
+
+    Counted from scratch, rather than adjusted by the user's roles before the
+    write, which another request could change in between. The replica's
+    roles are read in the request's transaction, which the write joined.
+    """
+    client = None if oso.local_facts() is not None else oso.client
+    backfill_member_counts(g.session, client, org_id=org_id)
 
 
 @bp.route("/unassigned_users", methods=["GET"])
@@ -21,16 +72,16 @@ def org_unassigned_users_index(org_id):
         raise NotFound
     elif "view_members" not in permissions:
         raise Forbidden
-    existing = oso.get(
-        {
-            "name": "has_role",
-            "args": [{"type": "User"}, None, {"type": "Organization", "id": org_id}],
-        }
+    existing: VariableFact = {
+        "name": "has_role",
+        "args": [{"type": "User"}, None, {"type": "Organization", "id": str(org_id)}],
+    }
+    serializer = serializer_for(User)
+    page = Page.from_request()
+    statement = serializer.select().filter(_not_assigned(existing))
+    return page.response(
+        select_batches(g.session, serializer, page.select(statement, User.id))
     )
-    existing_users: list[oso_cloud.ValueDict] = [e["args"][0] for e in existing]
-    existing_ids = {e["id"] for e in existing_users}  # type: ignore
-    unassigned = g.session.query(User).filter(User.id.notin_(existing_ids))
-    return jsonify([u.as_json() for u in unassigned])
 
 
 @bp.route("/role_assignments", methods=["GET"])
@@ -51,28 +102,12 @@ def org_index(org_id):
             "args": [{"type": "User"}, None, {"type": "Organization", "id": org_id}],
         }
     )
-    assignment_ids = [
-        (
-            a["args"][0]["id"],  # type: ignore
-            a["args"][1]["id"],  # type: ignore
-        )
-        for a in assignment_facts
-    ]
-    assignment_ids = sorted(assignment_ids, key=lambda assignment: assignment[0])
-    assignments = [
-        (g.session.query(User).filter_by(id=user_id).first(), role)
-        for (user_id, role) in assignment_ids
-    ]
-    # TODO(gj): fetch users in bulk
-    assignments_json = [
-        {
-            "user": user.as_json(),
-            "role": role,
-        }
-        for (user, role) in assignments
-        if user is not None
-    ]
-    return jsonify(assignments_json)
+    page = Page.from_request()
+    return page.response(
+        _assignment_batches(page, assignment_facts),
+        key=lambda assignment: assignment["user"]["id"],
+        grouped=True,
+    )
 
 
 @bp.route("/role_assignments", methods=["POST"])
@@ -82,19 +117,28 @@ def org_create(org_id):
         "id": str(g.current_user),
     }
     payload = cast(dict, request.get_json(force=True))
-    permissions = oso.actions(user, {"type": "Organization", "id": org_id})
+    target_user: Value = {"type": "User", "id": payload["id"]}
+    actions = oso.futures.actions(user, {"type": "Organization", "id": org_id})
+    readable = oso.futures.authorize(user, "read", target_user)
+    permissions = actions.result()
     if "read" not in permissions:
         raise NotFound
     elif "manage_members" not in permissions:
         raise Forbidden
-
     org = g.session.get_or_404(Organization, id=org_id)
-    target_user: Value = {"type": "User", "id": payload["id"]}
-    if not oso.authorize(user, "read", target_user):
+    if not readable.result():
         raise NotFound
-    oso.tell({"name": "has_role", "args": [target_user, payload["role"], org]})
+    org_value: Value = {"type": "Organization", "id": str(org.id)}
+    oso.tell(
+        {
+            "name": "has_role",
+            "args": [target_user, payload["role"], org_value],
+        }
+    )
+    _recount_members(org.id)
+    g.session.commit()
 
-    user_obj: User = g.session.get_or_404(User, id=user["id"])
+    user_obj: User = g.session.get_or_404(User, id=target_user["id"])
     return {"user": user_obj.as_json(), "role": payload["role"]}, 201  # type: ignore
 
 
@@ -105,22 +149,27 @@ def org_update(org_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    permissions = oso.actions(user, {"type": "Organization", "id": org_id})
+    target_user: Value = {"type": "User", "id": payload["id"]}
+    actions = oso.futures.actions(user, {"type": "Organization", "id": org_id})
+    readable = oso.futures.authorize(user, "read", target_user)
+    permissions = actions.result()
     if "read" not in permissions:
         raise NotFound
     elif "manage_members" not in permissions:
         raise Forbidden
     org = g.session.get_or_404(Organization, id=org_id)
-    target_user: Value = {"type": "User", "id": payload["id"]}
-    if not oso.authorize(user, "read", target_user):
+    if not readable.result():
         raise NotFound
 
+    org_value: Value = {"type": "Organization", "id": str(org.id)}
     oso.bulk(
-        delete=[{"name": "has_role", "args": [user, None, org]}],
-        tell=[{"name": "has_role", "args": [user, payload["role"], org]}],
+        delete=[{"name": "has_role", "args": [target_user, None, org_value]}],
+        tell=[{"name": "has_role", "args": [target_user, payload["role"], org_value]}],
     )
+    _recount_members(org.id)
+    g.session.commit()
 
-    user_obj: User = g.session.get_or_404(User, id=user["id"])
+    user_obj: User = g.session.get_or_404(User, id=target_user["id"])
     return {"user": user_obj.as_json(), "role": payload["role"]}  # type: ignore
 
 
@@ -131,17 +180,22 @@ def org_delete(org_id):
         "id": str(g.current_user),
     }
     payload = cast(dict, request.get_json(force=True))
-    permissions = oso.actions(user, {"type": "Organization", "id": org_id})
+    target_user: Value = {"type": "User", "id": payload["id"]}
+    actions = oso.futures.actions(user, {"type": "Organization", "id": org_id})
+    readable = oso.futures.authorize(user, "read", target_user)
+    permissions = actions.result()
     if "read" not in permissions:
         raise NotFound
     elif "manage_members" not in permissions:
         raise Forbidden
     org = g.session.get_or_404(Organization, id=org_id)
-    target_user: Value = {"type": "User", "id": payload["id"]}
-    if not oso.authorize(user, "read", target_user):
+    if not readable.result():
         raise NotFound
 
-    oso.bulk(delete=[{"name": "has_role", "args": [user, None, org]}])
+    org_value: Value = {"type": "Organization", "id": str(org.id)}
+    oso.bulk(delete=[{"name": "has_role", "args": [target_user, None, org_value]}])
+    _recount_members(org.id)
+    g.session.commit()
 
     return {}, 204
 
@@ -153,19 +207,21 @@ def repo_unassigned_users_index(org_id, repo_id):
         "id": str(g.current_user),
     }
     repo = g.session.get_or_404(Repository, id=repo_id, org_id=org_id)
-    if not oso.authorize(user, "view_members", repo):
+    permissions = oso.actions(user, {"type": "Repository", "id": repo_id})
+    if "view_members" not in permissions:
         raise NotFound
-    if not oso.authorize(user, "manage_members", repo):
+    elif "manage_members" not in permissions:
         raise Forbidden
-    existing = oso.get(
-        {
-            "name": "has_role",
-            "args": [{"type": User}, None, {"type": "Repository", "id": repo.id}],
-        }
+    existing: VariableFact = {
+        "name": "has_role",
+        "args": [{"type": "User"}, None, {"type": "Repository", "id": str(repo.id)}],
+    }
+    serializer = serializer_for(User)
+    page = Page.from_request()
+    statement = serializer.select().filter(_not_assigned(existing))
+    return page.response(
+        select_batches(g.session, serializer, page.select(statement, User.id))
     )
-    existing_ids = {fact["args"][0]["id"] for fact in existing}  # type: ignore
-    unassigned = g.session.query(User).filter(User.id.notin_(existing_ids))
-    return jsonify([u.as_json() for u in unassigned])
 
 
 @bp.route("/repos/<int:repo_id>/role_assignments", methods=["GET"])
@@ -175,7 +231,7 @@ def repo_index(org_id, repo_id):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "view_members", repo):
+    if not oso.authorize(user, "view_members", {"type": "Repository", "id": repo_id}):
         raise Forbidden
     assignment_facts = oso.get(
         {
@@ -183,28 +239,12 @@ def repo_index(org_id, repo_id):
             "args": [{"type": "User"}, None, {"type": "Repository", "id": repo_id}],
         }
     )
-    assignment_ids = [
-        (
-            a["args"][0]["id"],  # type: ignore
-            a["args"][1]["id"],  # type: ignore
-        )
-        for a in assignment_facts
-    ]
-    assignment_ids = sorted(assignment_ids, key=lambda assignment: assignment[0])
-    assignments = [
-        (g.session.query(User).filter_by(id=user_id).first(), role)
-        for (user_id, role) in assignment_ids
-    ]
-    # TODO(gj): fetch users in bulk
-    assignments_json = [
-        {
-            "user": user.as_json(),
-            "role": role,
-        }
-        for (user, role) in assignments
-        if user is not None
-    ]
-    return jsonify(assignments_json)
+    page = Page.from_request()
+    return page.response(
+        _assignment_batches(page, assignment_facts),
+        key=lambda assignment: assignment["user"]["id"],
+        grouped=True,
+    )
 
 
 @bp.route("/repos/<int:repo_id>/role_assignments", methods=["POST"])
@@ -215,14 +255,25 @@ def repo_create(org_id, repo_id):
         "id": str(g.current_user),
     }
     repo = g.session.get_or_404(Repository, id=repo_id, org_id=org_id)
-    if not oso.authorize(user, "view_members", repo):
+    permissions = oso.actions(user, {"type": "Repository", "id": repo_id})
+    if "view_members" not in permissions:
         raise NotFound
-    if not oso.authorize(user, "manage_members", repo):
+    elif "manage_members" not in permissions:
         raise Forbidden
     user: Value = {"type": "User", "id": payload["id"]}
     if not oso.authorize(user, "read", user):
         raise NotFound
-    oso.tell({"name": "has_role", "args": [user, payload["role"], repo]})
+    oso.tell(
+        {
+            "name": "has_role",
+            "args": [
+                user,
+                payload["role"],
+                {"type": "Repository", "id": str(repo.id)},
+            ],
+        }
+    )
+    g.session.commit()
     user_obj: User = g.session.get_or_404(User, id=user["id"])
     return {"user": user_obj.as_json(), "role": payload["role"]}, 201  # type: ignore
 
@@ -235,16 +286,19 @@ def repo_update(org_id, repo_id):
         "id": str(g.current_user),
     }
     repo = g.session.get_or_404(Repository, id=repo_id, org_id=org_id)
-    if not oso.authorize(user, "view_members", repo):
+    permissions = oso.actions(user, {"type": "Repository", "id": repo_id})
+    if "view_members" not in permissions:
         raise NotFound
-    if not oso.authorize(user, "manage_members", repo):
+    elif "manage_members" not in permissions:
         raise Forbidden
     user: oso_cloud.Value = {"type": "User", "id": str(payload["id"])}
 
+    repo_value: Value = {"type": "Repository", "id": str(repo.id)}
     oso.bulk(
-        delete=[{"name": "has_role", "args": [user, None, repo]}],
-        tell=[{"name": "has_role", "args": [user, payload["role"], repo]}],
+        delete=[{"name": "has_role", "args": [user, None, repo_value]}],
+        tell=[{"name": "has_role", "args": [user, payload["role"], repo_value]}],
     )
+    g.session.commit()
 
     user_obj = g.session.get_or_404(User, id=user["id"])
 
@@ -259,11 +313,20 @@ def repo_delete(org_id, repo_id):
         "id": str(g.current_user),
     }
     repo = g.session.get_or_404(Repository, id=repo_id, org_id=org_id)
-    if not oso.authorize(user, "view_members", repo):
+    permissions = oso.actions(user, {"type": "Repository", "id": repo_id})
+    if "view_members" not in permissions:
         raise NotFound
-    if not oso.authorize(user, "manage_members", repo):
+    elif "manage_members" not in permissions:
         raise Forbidden
     user: oso_cloud.Value = {"type": "User", "id": str(payload["id"])}
 
-    oso.bulk(delete=[{"name": "has_role", "args": [user, None, repo]}])
+    oso.bulk(
+        delete=[
+            {
+                "name": "has_role",
+                "args": [user, None, {"type": "Repository", "id": str(repo.id)}],
+            }
+        ]
+    )
+    g.session.commit()
     return {}, 204
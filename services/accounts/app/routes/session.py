@@ -1,9 +1,9 @@
 from flask import Blueprint, g, request, jsonify, session as flask_session
 from typing import cast
 from werkzeug.exceptions import Unauthorized
-from sqlalchemy import text
-
 
+from ..identities import identities
+from ..loaders import load_random
 from ..models import User
 
 bp = Blueprint("session", __name__, url_prefix="/session")
@@ -11,9 +11,8 @@ bp = Blueprint("session", __name__, url_prefix="/session")
 
 @bp.route("", methods=["GET"])
 def show():
-    return jsonify(
-        g.session.query(User).get(g.current_user).as_json() if g.current_user else {}
-    )
+    identity = identities().by_id(g.session, g.current_user)
+    return jsonify(identity.profile if identity else {})
 
 
 @bp.route("/login", methods=["POST"])
@@ -21,11 +20,11 @@ def create():
     payload = cast(dict, request.get_json(force=True))
     user = None
     if "username" not in payload:
-        user = g.session.query(User).order_by(text("RANDOM()")).first()
+        random_user = load_random(g.session, User)
+        if random_user is not None:
+            user = identities().by_id(g.session, random_user.id)
     else:
-        user = (
-            g.session.query(User).filter_by(username=payload["username"]).one_or_none()
-        )
+        user = identities().by_username(g.session, payload["username"])
 
     if user is None:
         flask_session.pop("current_username", None)
@@ -36,7 +35,7 @@ def create():
 
     flask_session["current_username"] = user.username
     flask_session["user_id"] = user.id
-    return jsonify(user.as_json()), 201
+    return jsonify(user.profile), 201
 
 
 @bp.route("/logout", methods=["DELETE"])
@@ -1,27 +1,49 @@
 import oso_cloud
-from flask import Blueprint, g, jsonify
+from flask import Blueprint, g
 from typing import cast
 from werkzeug.exceptions import NotFound
 
-from ..models import Organization, User, Repository
+from ..models import Organization, Repository
 from ..authorization import oso
+from .. import conditional
+from ..identities import Identity, identities
+from ..loaders import iter_dump_by_ids
+from ..pagination import Page, select_batches
+from ..serializers import serializer_for
 
 bp = Blueprint("users", __name__, url_prefix="/users")
+conditional.enable(
+    bp,
+    tables=["users", "repositories", "organizations", "facts"],
+    views=["repo_index", "org_index"],
+)
+
+
+def _identity_or_404(username: str) -> Identity:
+    identity = identities().by_username(g.session, username)
+    if identity is None:
+        raise NotFound
+    return identity
+
+
+def _user_value(username: str) -> oso_cloud.Value:
+    """The Oso value for the user named `username`: facts name users by id."""
+    return {"type": "User", "id": str(_identity_or_404(username).id)}
 
 
 @bp.route("/<username>", methods=["GET"])
 def show(username):
+    identity = _identity_or_404(username)
     if not oso.authorize(
         {
             "type": "User",
             "id": str(g.current_user),
         },
         "read_profile",
-        {"type": "User", "id": username},
+        {"type": "User", "id": str(identity.id)},
     ):
         raise NotFound
-    user = g.session.get_or_404(User, username=username)
-    return user.as_json()
+    return identity.profile
 
 
 @bp.route("/<username>/repos", methods=["GET"])
@@ -30,23 +52,31 @@ def repo_index(username):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read_profile", {"type": "User", "id": username}):
-        raise NotFound
-
+    target_user = _user_value(username)
+    allowed = oso.futures.authorize(user, "read_profile", target_user)
     # get all the repositories that the user has a role for
-    repos = oso.query(
-        "has_role", {"type": "User", "id": username}, {}, {"type": "Repository"}
+    repos = oso.get(
+        {
+            "name": "has_role",
+            "args": [target_user, None, {"type": "Repository"}],
+        }
     )
+    if not allowed.result():
+        raise NotFound
     repoIds = list(
         map(lambda fact: cast(oso_cloud.Value, fact["args"][2]).get("id", "_"), repos)
     )
-    print(repos, repoIds)
+    page = Page.from_request()
     if "_" in repoIds:
-        repo_objs = g.session.query(Repository)
-        return jsonify([r.as_json() for r in repo_objs])
+        serializer = serializer_for(Repository)
+        repo_objs = select_batches(
+            g.session, serializer, page.select(serializer.select(), Repository.id)
+        )
     else:
-        repo_objs = g.session.query(Repository).filter(Repository.id.in_(repoIds))
-        return jsonify([r.as_json() for r in repo_objs])
+        repo_objs = iter_dump_by_ids(g.session, Repository, page.ids(repoIds))
+    return page.response(
+        repo_objs, lambda rows: oso.add_permissions(user, "Repository", rows)
+    )
 
 
 @bp.route("/<username>/orgs", methods=["GET"])
@@ -55,19 +85,28 @@ def org_index(username):
         "type": "User",
         "id": str(g.current_user),
     }
-    if not oso.authorize(user, "read_profile", {"type": "User", "id": username}):
-        raise NotFound
-
-    # get all the repositories that the user has a role for
-    orgs = oso.query(
-        "has_role", {"type": "User", "id": username}, {}, {"type": "Organization"}
+    target_user = _user_value(username)
+    allowed = oso.futures.authorize(user, "read_profile", target_user)
+    # get all the organizations that the user has a role for
+    orgs = oso.get(
+        {
+            "name": "has_role",
+            "args": [target_user, None, {"type": "Organization"}],
+        }
     )
+    if not allowed.result():
+        raise NotFound
     orgIds = list(
         map(lambda fact: cast(oso_cloud.Value, fact["args"][2]).get("id", "_"), orgs)
     )
+    page = Page.from_request()
     if "_" in orgIds:
-        orgs = g.session.query(Organization)
-        return jsonify([o.as_json() for o in orgs])
+        serializer = serializer_for(Organization)
+        org_objs = select_batches(
+            g.session, serializer, page.select(serializer.select(), Organization.id)
+        )
     else:
-        orgs = g.session.query(Organization).filter(Organization.id.in_(orgIds))
-        return jsonify([o.as_json() for o in orgs])
+        org_objs = iter_dump_by_ids(g.session, Organization, page.ids(orgIds))
+    return page.response(
+        org_objs, lambda rows: oso.add_permissions(user, "Organization", rows)
+    )
@@ -0,0 +1,300 @@
+"""The accounts GraphQL subgraph, served at `/graphql`.
+
+A page that needs organizations, their repositories, members and permissions
+can fetch them in one query:
+
+    {
+      organizations {
+        name
+        permissions
+        repos { nameWithOwner permissions roleAssignments { role user { name } } }
+      }
+    }
+
+Fields resolve through per-request `DataLoader`s, so however many nodes a query
+returns, each level costs a single SQL query (an `IN` over the ids it needs)
+and a single batch of Oso checks: one `list` or `authorize_resources` call per
+action. Role assignments are a `get` per resource, fanned out concurrently, or
+one query against the fact replica (see `CachedOso.actions_many` and
+`CachedOso.get_in`).
+
+Authorization follows the REST endpoints: resources the user can't `read` are
+left out, or `null`, and role assignments are `null` without `view_members`.
+
+`Organization` and `Repository` are federation entities keyed by `id`, so other
+subgraphs (e.g. jobs) can extend them. `make publish-subgraph` exports the SDL.
+"""
+from functools import partial
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import strawberry
+from flask import Request, Response, g
+from oso_cloud import Value
+from strawberry.dataloader import DataLoader
+from strawberry.flask.views import AsyncGraphQLView
+from strawberry.types import Info
+
+from . import models
+from .authorization import oso
+from .identities import identities
+from .loaders import CHUNK_SIZE, dump_by_ids
+from .pagination import MAX_LIMIT
+from .serializers import serializer_for
+
+Row = Dict[str, Any]
+
+
+class Loaders:
+    """Batches the SQL queries and Oso checks of a query, for one request.
+
+    Loaders are keyed by string ids, as Oso uses them.
+    """
+
+    def __init__(self, user: Value):
+        self.user = user
+        self.orgs = DataLoader(self._load_orgs)
+        self.repos = DataLoader(self._load_repos)
+        self.org_repos = DataLoader(self._load_org_repos)
+        self.users = DataLoader(self._load_users)
+        self.org_permissions = DataLoader(
+            partial(self._load_permissions, "Organization")
+        )
+        self.repo_permissions = DataLoader(
+            partial(self._load_permissions, "Repository")
+        )
+        self.org_role_assignments = DataLoader(
+            partial(self._load_role_assignments, "Organization")
+        )
+        self.repo_role_assignments = DataLoader(
+            partial(self._load_role_assignments, "Repository")
+        )
+
+    def _allowed(self, action: str, resource_type: str, ids: Sequence[str]) -> Set[str]:
+        allowed = oso.authorize_many(
+            self.user, action, [{"type": resource_type, "id": id} for id in ids]
+        )
+        return {id for id, ok in allowed.items() if ok}
+
+    def _load_readable(self, cls: Any, ids: Sequence[str]) -> List[Optional[Row]]:
+        readable = self._allowed("read", cls.__name__, ids)
+        rows = {str(row["id"]): row for row in dump_by_ids(g.session, cls, readable)}
+        return [rows.get(id) for id in ids]
+
+    async def _load_orgs(self, ids: List[str]) -> List[Optional[Row]]:
+        return self._load_readable(models.Organization, ids)
+
+    async def _load_repos(self, ids: List[str]) -> List[Optional[Row]]:
+        return self._load_readable(models.Repository, ids)
+
+    async def _load_users(self, ids: List[str]) -> List[Optional[Row]]:
+        rows = {str(row["id"]): row for row in dump_by_ids(g.session, models.User, ids)}
+        return [rows.get(id) for id in ids]
+
+    async def _load_org_repos(self, org_ids: List[str]) -> List[List[Row]]:
+        authorized = set(oso.list(self.user, "read", "Repository"))
+        serializer = serializer_for(models.Repository)
+        repos: Dict[str, List[Row]] = {id: [] for id in org_ids}
+        for start in range(0, len(org_ids), CHUNK_SIZE):
+            chunk = [int(id) for id in org_ids[start : start + CHUNK_SIZE]]
+            statement = (
+                serializer.select()
+                .filter(models.Repository.org_id.in_(chunk))
+                .order_by(models.Repository.id)
+            )
+            for row in serializer.rows(g.session.execute(statement)):
+                if "*" in authorized or str(row["id"]) in authorized:
+                    repos[str(row["org_id"])].append(row)
+        return [repos[id] for id in org_ids]
+
+    async def _load_permissions(
+        self, resource_type: str, ids: List[str]
+    ) -> List[List[str]]:
+        actions = oso.actions_many(
+            self.user, [{"type": resource_type, "id": id} for id in ids]
+        )
+        return [actions[id] for id in ids]
+
+    async def _load_role_assignments(
+        self, resource_type: str, ids: List[str]
+    ) -> List[Optional[List["RoleAssignment"]]]:
+        allowed = self._allowed("view_members", resource_type, ids)
+        visible = [id for id in ids if id in allowed]
+        facts = oso.get_in(
+            {
+                "name": "has_role",
+                "args": [{"type": "User"}, None, {"type": resource_type}],
+            },
+            2,
+            visible,
+        )
+        assignments = {
+            id: [
+                RoleAssignment(
+                    role=fact["args"][1]["id"],  # type: ignore
+                    user_id=fact["args"][0]["id"],  # type: ignore
+                )
+                for fact in resource_facts
+            ]
+            for id, resource_facts in facts.items()
+        }
+        return [assignments.get(id) for id in ids]
+
+
+def loaders(info: Info) -> Loaders:
+    return info.context["loaders"]
+
+
+@strawberry.type
+class User:
+    id: strawberry.ID
+    username: str
+    email: Optional[str]
+    name: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: Row) -> "User":
+        return cls(
+            id=strawberry.ID(str(row["id"])),
+            username=row["username"],
+            email=row["email"],
+            name=row["name"],
+        )
+
+
+@strawberry.type
+class RoleAssignment:
+    role: str
+    user_id: strawberry.Private[str]
+
+    @strawberry.field
+    async def user(self, info: Info) -> Optional[User]:
+        row = await loaders(info).users.load(self.user_id)
+        return User.from_row(row) if row else None
+
+
+@strawberry.federation.type(keys=["id"])
+class Repository:
+    id: strawberry.ID
+    name: str
+    description: Optional[str]
+    org_id: strawberry.ID
+    public: Optional[bool]
+    protected: Optional[bool]
+    name_with_owner: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: Row) -> "Repository":
+        return cls(
+            id=strawberry.ID(str(row["id"])),
+            name=row["name"],
+            description=row["description"],
+            org_id=strawberry.ID(str(row["org_id"])),
+            public=row["public"],
+            protected=row["protected"],
+            name_with_owner=row["name_with_owner"],
+        )
+
+    @classmethod
+    async def resolve_reference(
+        cls, info: Info, id: strawberry.ID
+    ) -> Optional["Repository"]:
+        row = await loaders(info).repos.load(str(id))
+        return cls.from_row(row) if row else None
+
+    @strawberry.field
+    async def organization(self, info: Info) -> Optional["Organization"]:
+        row = await loaders(info).orgs.load(str(self.org_id))
+        return Organization.from_row(row) if row else None
+
+    @strawberry.field
+    async def permissions(self, info: Info) -> List[str]:
+        return await loaders(info).repo_permissions.load(str(self.id))
+
+    @strawberry.field
+    async def role_assignments(self, info: Info) -> Optional[List[RoleAssignment]]:
+        return await loaders(info).repo_role_assignments.load(str(self.id))
+
+
+@strawberry.federation.type(keys=["id"])
+class Organization:
+    id: strawberry.ID
+    name: str
+    description: Optional[str]
+    billing_address: Optional[str]
+    repository_count: int
+    member_count: int
+
+    @classmethod
+    def from_row(cls, row: Row) -> "Organization":
+        return cls(
+            id=strawberry.ID(str(row["id"])),
+            name=row["name"],
+            description=row["description"],
+            billing_address=row["billing_address"],
+            repository_count=row["repository_count"],
+            member_count=row["member_count"],
+        )
+
+    @classmethod
+    async def resolve_reference(
+        cls, info: Info, id: strawberry.ID
+    ) -> Optional["Organization"]:
+        row = await loaders(info).orgs.load(str(id))
+        return cls.from_row(row) if row else None
+
+    @strawberry.field
+    async def permissions(self, info: Info) -> List[str]:
+        return await loaders(info).org_permissions.load(str(self.id))
+
+    @strawberry.field
+    async def repos(self, info: Info) -> List[Repository]:
+        rows = await loaders(info).org_repos.load(str(self.id))
+        return [Repository.from_row(row) for row in rows]
+
+    @strawberry.field
+    async def role_assignments(self, info: Info) -> Optional[List[RoleAssignment]]:
+        return await loaders(info).org_role_assignments.load(str(self.id))
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    async def organizations(self, info: Info, first: int = 100) -> List[Organization]:
+        """The organizations the user can read, in id order."""
+        first = max(0, min(first, MAX_LIMIT))
+        authorized = oso.list(loaders(info).user, "read", "Organization")
+        if authorized == ["*"]:
+            serializer = serializer_for(models.Organization)
+            statement = (
+                serializer.select().order_by(models.Organization.id).limit(first)
+            )
+            rows = serializer.rows(g.session.execute(statement))
+        else:
+            ids = sorted({int(id) for id in authorized})[:first]
+            rows = dump_by_ids(g.session, models.Organization, ids)
+        loaders(info).orgs.prime_many({str(row["id"]): row for row in rows})
+        return [Organization.from_row(row) for row in rows]
+
+    @strawberry.field
+    async def organization(
+        self, info: Info, id: strawberry.ID
+    ) -> Optional[Organization]:
+        return await Organization.resolve_reference(info, id)
+
+    @strawberry.field
+    async def repository(self, info: Info, id: strawberry.ID) -> Optional[Repository]:
+        return await Repository.resolve_reference(info, id)
+
+    @strawberry.field
+    async def me(self, info: Info) -> Optional[User]:
+        identity = identities().by_id(g.session, g.current_user)
+        return User.from_row(identity.profile) if identity else None
+
+
+schema = strawberry.federation.Schema(query=Query, enable_federation_2=True)
+
+
+class GraphQLView(AsyncGraphQLView):
+    async def get_context(self, request: Request, response: Response) -> Any:
+        user: Value = {"type": "User", "id": str(g.current_user)}
+        return {"request": request, "response": response, "loaders": Loaders(user)}
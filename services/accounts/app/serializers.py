@@ -0,0 +1,90 @@
+from operator import attrgetter
+from typing import Any, Dict, Iterable, List, Type
+
+from flask import Response
+from sqlalchemy import select
+from sqlalchemy.orm.relationships import RelationshipProperty
+from sqlalchemy.sql import Select
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+if orjson is None:  # pragma: no cover
+    import json
+
+
+class Serializer:
+    """Precompiled row-to-dict conversion for one mapped class.
+
+    The column list is worked out once per model, so serializing a row is a
+    single `attrgetter` call (for ORM instances) or a `zip` over the tuple
+    returned by `select()` (for Core rows, which skips hydrating ORM objects).
+
+    A model can replace the expression selected for a key with
+    `__json_overrides__`, joining in whatever that needs via `__json_joins__`.
+    """
+
+    def __init__(self, mapper):
+        self.class_ = mapper.class_
+        self.keys = column_keys(mapper)
+        overrides = getattr(self.class_, "__json_overrides__", {})
+        self.columns = [
+            overrides.get(key, getattr(self.class_, key)) for key in self.keys
+        ]
+        self.joins = getattr(self.class_, "__json_joins__", [])
+        getter = attrgetter(*self.keys)
+        self._get = getter if len(self.keys) > 1 else lambda obj: (getter(obj),)
+
+    def __call__(self, obj: Any) -> Dict[str, Any]:
+        return dict(zip(self.keys, self._get(obj)))
+
+    def select(self) -> Select:
+        """A `SELECT` of exactly the columns in this model's JSON."""
+        statement = select(*self.columns).select_from(self.class_)
+        for target, onclause in self.joins:
+            statement = statement.outerjoin(target, onclause)
+        return statement
+
+    def rows(self, rows: Iterable[Any]) -> List[Dict[str, Any]]:
+        keys = self.keys
+        return [dict(zip(keys, row)) for row in rows]
+
+
+_serializers: Dict[Type, Serializer] = {}
+
+
+def column_keys(mapper) -> List[str]:
+    columns = []
+    for d in mapper.all_orm_descriptors:
+        if hasattr(d, "property") and isinstance(d.property, RelationshipProperty):
+            continue
+        if hasattr(d, "key"):
+            columns.append(d.key)
+        elif hasattr(d, "__name__"):
+            columns.append(d.__name__)
+        else:
+            raise Exception("Unable to find column name for %s" % d)
+    return columns
+
+
+def register(mapper) -> Serializer:
+    serializer = Serializer(mapper)
+    _serializers[mapper.class_] = serializer
+    return serializer
+
+
+def serializer_for(cls: Type) -> Serializer:
+    return _serializers[cls]
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+
+
+def json_response(data: Any, status: int = 200) -> Response:
+    """Like `jsonify`, but encoded with orjson when it's available."""
+    return Response(dumps(data), status=status, mimetype="application/json")
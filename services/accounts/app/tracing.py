@@ -0,0 +1,221 @@
+"""OpenTelemetry tracing, enabled with `TRACING=1` (the default in production).
+
+Every request gets a server span, continuing the trace from the gateway's
+`traceparent` header, with a child span for each SQL statement and each call
+to the Oso Cloud client. Oso spans carry the action, actor type and resource
+type, so slow round trips show up by what they were asking. Calls fanned out
+by `CachedOso.actions_many` run in the request's context and nest under it.
+
+Where spans go is configured with the standard OpenTelemetry variables, as for
+the jobs service:
+
+- `OTEL_EXPORTER_OTLP_ENDPOINT` (and `OTEL_EXPORTER_OTLP_HEADERS`) exports
+  over OTLP/HTTP, e.g. to Honeycomb.
+- `TRACING_FILE` writes each span as JSON to a local file instead.
+- `OTEL_TRACES_SAMPLER` / `OTEL_TRACES_SAMPLER_ARG` control sampling, e.g.
+  `parentbased_traceidratio` and `0.1`.
+- `OTEL_SERVICE_NAME` names the service.
+"""
+import os
+from typing import Any, Iterable, Iterator, Optional
+
+from flask import Flask, g, request
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .authorization import CachedOso, value_key
+
+tracer = trace.get_tracer(__name__)
+
+
+def default_exporter() -> Optional[SpanExporter]:
+    path = os.environ.get("TRACING_FILE")
+    if path:
+        return ConsoleSpanExporter(out=open(path, "a"))
+    if os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        return OTLPSpanExporter()
+    return None
+
+
+def configure(exporter: Optional[SpanExporter] = None) -> TracerProvider:
+    """Install a tracer provider exporting to `exporter`, or the one configured
+    by the environment. Only the first call in a process takes effect."""
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        return provider
+    provider = TracerProvider(resource=Resource.create())
+    exporter = exporter or default_exporter()
+    if exporter is not None:
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+def _value_type(value: Any) -> Optional[str]:
+    key = value_key(value)
+    return key[0] if key is not None else None
+
+
+class TracedClient:
+    """Wraps an Oso client with a span around every method call."""
+
+    traced = True
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def traced(*args, **kwargs):
+            with tracer.start_as_current_span(
+                f"oso.{name}", kind=SpanKind.CLIENT
+            ) as span:
+                span.set_attributes(_oso_attributes(name, args))
+                return attr(*args, **kwargs)
+
+        return traced
+
+
+def _oso_attributes(method: str, args: Any) -> dict:
+    attributes = {"oso.method": method}
+    if method in ("authorize", "authorize_resources", "actions", "list") and args:
+        attributes["oso.actor_type"] = _value_type(args[0]) or ""
+    if method in ("authorize", "authorize_resources", "list") and len(args) > 1:
+        attributes["oso.action"] = args[1]
+    if method == "authorize" and len(args) > 2:
+        attributes["oso.resource_type"] = _value_type(args[2]) or ""
+    elif method == "actions" and len(args) > 1:
+        attributes["oso.resource_type"] = _value_type(args[1]) or ""
+    elif method == "list" and len(args) > 2:
+        attributes["oso.resource_type"] = args[2]
+    elif method == "authorize_resources" and len(args) > 2 and args[2]:
+        attributes["oso.resource_type"] = _value_type(args[2][0]) or ""
+        attributes["oso.resource_count"] = len(args[2])
+    elif method in ("get", "query") and args:
+        attributes["oso.fact"] = args[0]["name"]
+    elif method in ("bulk_tell", "bulk_delete") and args:
+        attributes["oso.fact_count"] = len(args[0])
+    return attributes
+
+
+def _start_statement(conn, cursor, statement, parameters, execution, many):
+    if execution is None:
+        return
+    span = tracer.start_span(
+        statement.split(None, 1)[0].upper() if statement else "SQL",
+        kind=SpanKind.CLIENT,
+        attributes={
+            "db.system": conn.engine.dialect.name,
+            "db.statement": statement,
+        },
+    )
+    execution._span = span
+
+
+def _end_statement(conn, cursor, statement, parameters, execution, many):
+    span = getattr(execution, "_span", None)
+    if span is not None:
+        span.end()
+        execution._span = None
+
+
+def _statement_error(exception_context):
+    span = getattr(exception_context.execution_context, "_span", None)
+    if span is not None:
+        span.set_status(
+            Status(StatusCode.ERROR, str(exception_context.original_exception))
+        )
+        span.end()
+        exception_context.execution_context._span = None
+
+
+def instrument(app: Flask, engine: Engine, oso: CachedOso):
+    configure()
+
+    event.listen(engine, "before_cursor_execute", _start_statement)
+    event.listen(engine, "after_cursor_execute", _end_statement)
+    event.listen(engine, "handle_error", _statement_error)
+    if not getattr(oso.client, "traced", False):
+        oso.client = TracedClient(oso.client)
+
+    @app.before_request
+    def start_request_span():
+        span = tracer.start_span(
+            f"{request.method} {request.url_rule or request.path}",
+            context=propagate.extract(request.headers),
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.method": request.method,
+                "http.route": str(request.url_rule or ""),
+                "http.target": request.full_path,
+                "oso.request_id": request.headers.get("oso-request-id", ""),
+            },
+        )
+        g.trace_span = span
+        g.trace_token = context.attach(trace.set_span_in_context(span))
+
+    @app.after_request
+    def record_status(response):
+        span = g.get("trace_span")
+        if span is None:
+            return response
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(Status(StatusCode.ERROR))
+        # Detached in the context it was attached in. A streamed body is
+        # generated later, from wherever the server iterates it, so it only
+        # makes the span current around each chunk.
+        context.detach(g.pop("trace_token"))
+        if response.is_streamed:
+            response.response = _in_span(span, response.response)
+        # After the body has been sent.
+        response.call_on_close(span.end)
+        return response
+
+    @app.teardown_request
+    def record_error(error):
+        span = g.get("trace_span")
+        if span is None:
+            return
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, str(error)))
+        token = g.pop("trace_token", None)
+        if token is not None:
+            # There's no response to end the span with.
+            context.detach(token)
+            span.end()
+
+
+def _in_span(span: Span, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    chunks = iter(chunks)
+    try:
+        while True:
+            token = context.attach(trace.set_span_in_context(span))
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                context.detach(token)
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
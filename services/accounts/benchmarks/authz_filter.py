@@ -0,0 +1,111 @@
+"""Compare listing repositories through `oso.list` ids with filtering in SQL.
+
+The `list` path is given the authorized ids up front, so this only measures
+the database side; the real path also waits on Oso Cloud to return them.
+
+    python -m benchmarks.authz_filter --repos 100000
+"""
+import argparse
+from itertools import chain, islice
+from timeit import repeat
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app.facts import fact_rows
+from app.loaders import iter_dump_by_ids
+from app.local_authorization import authorized_filter
+from app.models import Base, Fact, Organization, Repository, setup_schema
+from app.pagination import Page, select_batches
+from app.serializers import serializer_for
+
+user = {"type": "User", "id": "1"}
+
+
+def seed(session, repos, orgs):
+    session.execute(
+        insert(Organization),
+        [{"id": i, "name": f"org-{i}", "billing_address": "-"} for i in range(orgs)],
+    )
+    session.execute(
+        insert(Repository),
+        [
+            {"id": i, "name": f"repo-{i}", "org_id": i % orgs, "public": i % 10 == 0}
+            for i in range(repos)
+        ],
+    )
+    # A member of half the organizations, with a direct role on some repos
+    # elsewhere.
+    facts = [
+        {
+            "name": "has_role",
+            "args": [user, "member", {"type": "Organization", "id": str(i)}],
+        }
+        for i in range(0, orgs, 2)
+    ] + [
+        {
+            "name": "has_role",
+            "args": [user, "editor", {"type": "Repository", "id": str(i)}],
+        }
+        for i in range(1, repos, 7)
+    ]
+    session.execute(insert(Fact), fact_rows(facts))
+    session.commit()
+
+
+def list_path(session, page, authorized_ids):
+    return list(
+        islice(
+            chain.from_iterable(
+                iter_dump_by_ids(session, Repository, page.ids(authorized_ids))
+            ),
+            page.limit,
+        )
+    )
+
+
+def sql_path(session, page, _):
+    serializer = serializer_for(Repository)
+    statement = serializer.select().where(authorized_filter(user, "read", Repository))
+    batches = select_batches(session, serializer, page.select(statement, Repository.id))
+    return list(islice(chain.from_iterable(batches), page.limit))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repos", type=int, default=100_000)
+    parser.add_argument("--orgs", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    setup_schema(Base)
+    session = sessionmaker(bind=engine)()
+    seed(session, args.repos, args.orgs)
+
+    authorized_ids = [
+        str(id)
+        for id in session.execute(
+            select(Repository.id).where(authorized_filter(user, "read", Repository))
+        ).scalars()
+    ]
+    print(f"{len(authorized_ids)} of {args.repos} repositories authorized")
+
+    for page in [Page(limit=100), Page(limit=100, cursor=args.repos // 2), Page()]:
+        print(f"limit={page.limit} cursor={page.cursor}")
+        baseline = None
+        for fn in [list_path, sql_path]:
+            best = min(
+                repeat(
+                    lambda: fn(session, page, authorized_ids),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            baseline = baseline or best
+            print(f"  {fn.__name__:<10} {best * 1000:8.1f}ms  {baseline / best:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""Load test the service over HTTP against a generated dataset.
+
+Serves `create_app` on a local port with `fake_oso.FakeOso` standing in for
+Oso Cloud (in process, or over HTTP with `--http`), then replays a weighted mix
+of paged and unpaged listing requests from concurrent clients and reports
+latency percentiles and throughput per endpoint.
+
+SQL queries and Oso calls per request, and the time spent on each, are read
+from the `Server-Timing` header set by `instrumentation`.
+
+    python -m benchmarks.load --users 10000 --orgs 1000 --clients 16 \\
+        --output after.json --compare before.json
+
+`--compare` exits non-zero if any endpoint's p95 latency rose, or its
+throughput fell, by more than `--threshold`. Set `SQL_AUTHZ_FILTER` and
+`LOCAL_FACTS` as for the app to compare configurations.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+from collections import defaultdict
+from dataclasses import asdict
+from random import Random
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+import requests
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from werkzeug.serving import make_server
+
+import app as accounts
+from app import create_app
+from app.authorization import oso
+from app.database import pool_metrics
+from app.fake_oso import FakeOso, FakeOsoServer
+from app.generator import Scale, generate
+from app.oso_http import oso_latency
+from app.migrations import migrate
+from app.models import User
+
+# Relative weights of each endpoint in the mix. Endpoints ending in `_all` are
+# requested without `limit`, so they return every row and per-row costs (such
+# as permissions, or identity lookups) show up in the numbers.
+MIX = {
+    "orgs": 30,
+    "org_repos": 35,
+    "org_role_assignments": 15,
+    "user_repos": 20,
+    "user_repos_all": 10,
+    "user_orgs_all": 10,
+}
+
+Request = Tuple[str, str, str]  # endpoint, path, user id
+
+
+class Sample(NamedTuple):
+    latency: float
+    # From `Server-Timing`, as (milliseconds, count).
+    db: Tuple[float, int]
+    oso: Tuple[float, int]
+    pool: Tuple[float, int]
+
+
+def server_timing(header: str) -> Dict[str, Tuple[float, int]]:
+    return {
+        name: (float(duration), int(count or 0))
+        for name, duration, count in re.findall(
+            r'(\w+);dur=([\d.]+)(?:;desc="(\d+)[^"]*")?', header
+        )
+    }
+
+
+def requests_for(
+    store: Any, usernames: Dict[str, str], page_size: int, seed: int
+) -> Iterator[Request]:
+    """An endless, weighted mix of requests for members of organizations.
+
+    `usernames` maps user ids, as in facts, to the usernames in `/users` URLs.
+    """
+    rng = Random(seed)
+    members = sorted(
+        (fact[1][1], fact[3][1])
+        for fact in store.match(
+            {
+                "name": "has_role",
+                "args": [{"type": "User"}, None, {"type": "Organization"}],
+            }
+        )
+    )
+    endpoints = list(MIX)
+    weights = [MIX[endpoint] for endpoint in endpoints]
+    query = f"?limit={page_size}"
+    while True:
+        user, org = rng.choice(members)
+        endpoint = rng.choices(endpoints, weights)[0]
+        path = {
+            "orgs": f"/orgs{query}",
+            "org_repos": f"/orgs/{org}/repos{query}",
+            "org_role_assignments": f"/orgs/{org}/role_assignments{query}",
+            "user_repos": f"/users/{usernames[user]}/repos{query}",
+            "user_repos_all": f"/users/{usernames[user]}/repos",
+            "user_orgs_all": f"/users/{usernames[user]}/orgs",
+        }[endpoint]
+        yield endpoint, path, user
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(url: str, mix: Iterator[Request], count: int, clients: int):
+    """Send `count` requests from the mix over `clients` threads."""
+    samples: Dict[str, List[Sample]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = Lock()
+    remaining = count
+
+    def client():
+        nonlocal remaining
+        with requests.Session() as session:
+            while True:
+                with lock:
+                    if remaining == 0:
+                        return
+                    remaining -= 1
+                    endpoint, path, user = next(mix)
+                start = perf_counter()
+                response = session.get(url + path, headers={"x-user-id": user})
+                elapsed = perf_counter() - start
+                timing = server_timing(response.headers.get("Server-Timing", ""))
+                sample = Sample(
+                    elapsed,
+                    timing.get("db", (0.0, 0)),
+                    timing.get("oso", (0.0, 0)),
+                    timing.get("pool", (0.0, 0)),
+                )
+                with lock:
+                    samples[endpoint].append(sample)
+                    if response.status_code >= 400:
+                        errors[endpoint] += 1
+
+    threads = [Thread(target=client) for _ in range(clients)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, perf_counter() - start
+
+
+def summarize(samples: List[Sample], errors: int, elapsed: float) -> Dict[str, Any]:
+    latencies = [sample.latency for sample in samples]
+    n = max(len(samples), 1)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": 1000 * sum(latencies) / max(len(latencies), 1),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "sql_queries": sum(sample.db[1] for sample in samples) / n,
+        "db_ms": sum(sample.db[0] for sample in samples) / n,
+        "oso_calls": sum(sample.oso[1] for sample in samples) / n,
+        "oso_ms": sum(sample.oso[0] for sample in samples) / n,
+        "pool_wait_ms": sum(sample.pool[0] for sample in samples) / n,
+    }
+
+
+def print_results(results: Dict[str, Any]):
+    print(
+        f"{'endpoint':<22}{'reqs':>7}{'errs':>6}{'req/s':>9}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'sql':>7}{'oso':>7}"
+    )
+    for endpoint, stats in results["endpoints"].items():
+        print(
+            f"{endpoint:<22}{stats['requests']:>7}{stats['errors']:>6}"
+            f"{stats['throughput']:>9.1f}{stats['p50_ms']:>9.1f}"
+            f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+            f"{stats['sql_queries']:>7.1f}{stats['oso_calls']:>7.1f}"
+        )
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float):
+    """Print the change against `baseline`, returning whether it regressed."""
+    regressed = False
+    for endpoint, stats in results["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            continue
+        p95 = stats["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        throughput = (
+            stats["throughput"] / before["throughput"] - 1
+            if before["throughput"]
+            else 0.0
+        )
+        flag = ""
+        if p95 > threshold or throughput < -threshold:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"{endpoint:<22} p95 {p95:+7.1%}  req/s {throughput:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    for name, default in asdict(Scale(users=2_000, orgs=200)).items():
+        parser.add_argument(
+            "--" + name.replace("_", "-"), type=type(default), default=default
+        )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each Oso call"
+    )
+    parser.add_argument(
+        "--http",
+        action="store_true",
+        help="talk to the fake over HTTP with the real Oso client",
+    )
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="a previous --output to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    scale = Scale(**{name: getattr(args, name) for name in asdict(Scale())})
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    path = os.path.join(tempfile.mkdtemp(), "load.db")
+    engine = create_engine(f"sqlite:///{path}")
+    migrate(engine)
+    session = sessionmaker(bind=engine)()
+    fake = FakeOso(generate(session, scale, args.seed))
+    session.commit()
+    usernames = {
+        str(id): username
+        for id, username in session.execute(select(User.id, User.username))
+    }
+    print(f"Generated {scale}: {len(fake.store)} facts")
+
+    logging.getLogger("app.instrumentation").setLevel(logging.WARNING)
+    if args.http:
+        oso_server = FakeOsoServer(fake).__enter__()
+        oso.client = oso_server.client()
+    else:
+        oso.client = fake
+    # For the per-request counts in `Server-Timing`.
+    accounts.INSTRUMENTATION = True
+    app = create_app(f"sqlite:///{path}")
+    fake.latency = args.latency
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    mix = requests_for(fake.store, usernames, args.page_size, args.seed)
+    samples, errors, elapsed = run(url, mix, args.requests, args.clients)
+    server.shutdown()
+
+    results = {
+        "config": {
+            **vars(args),
+            "SQL_AUTHZ_FILTER": app.config["SQL_AUTHZ_FILTER"],
+            "LOCAL_FACTS": app.config["LOCAL_FACTS"],
+        },
+        "total": summarize(
+            [sample for values in samples.values() for sample in values],
+            sum(errors.values()),
+            elapsed,
+        ),
+        "endpoints": {
+            endpoint: summarize(samples[endpoint], errors[endpoint], elapsed)
+            for endpoint in MIX
+        },
+        # Only with --http, see `oso_http`.
+        "oso_latency": oso_latency.as_dict(),
+    }
+    print_results(results)
+    total = results["total"]
+    print(
+        f"{total['requests']} requests in {elapsed:.1f}s"
+        f" ({total['throughput']:.1f} req/s, p95 {total['p95_ms']:.1f}ms)"
+    )
+    print(
+        f"Waited {pool_metrics.wait_time * 1000:.1f}ms in total for"
+        f" {pool_metrics.checkouts} connections (max {pool_metrics.max_wait * 1000:.1f}ms,"
+        f" {pool_metrics.timeouts} timeouts)"
+    )
+    for path, histogram in results["oso_latency"].items():
+        print(
+            f"{path:<30}{histogram['count']:>7} calls, p50 <{histogram['p50_ms']}ms,"
+            f" p95 <{histogram['p95_ms']}ms"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
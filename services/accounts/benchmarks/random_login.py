@@ -0,0 +1,72 @@
+"""Compare picking a random user with `ORDER BY RANDOM()` and `load_random`.
+
+`ORDER BY RANDOM()` reads and sorts the whole table, so it slows down as the
+table grows; `load_random` looks a few ids up in the primary key index and
+should take about the same time at every size. Every third user is deleted
+to leave the gaps that ids get in practice.
+
+    python -m benchmarks.random_login --sizes 10000 100000 1000000
+"""
+import argparse
+from timeit import repeat
+
+from sqlalchemy import create_engine, delete, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app.loaders import load_random
+from app.models import Base, User
+
+INSERT_BATCH_SIZE = 50_000
+
+
+def seed(session, start, stop):
+    for batch in range(start, stop, INSERT_BATCH_SIZE):
+        session.execute(
+            insert(User),
+            [
+                {"id": id, "username": f"user-{id}", "name": f"User {id}"}
+                for id in range(batch, min(batch + INSERT_BATCH_SIZE, stop))
+            ],
+        )
+    session.execute(delete(User).where(User.id % 3 == 0, User.id >= start))
+    session.commit()
+
+
+def order_by_random(session):
+    return session.query(User).order_by(text("RANDOM()")).first()
+
+
+def sampled(session):
+    return load_random(session, User)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", default="sqlite://")
+    args = parser.parse_args()
+
+    engine = create_engine(args.db)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.execute(delete(User))
+
+    print(f"{'users':>10}{'ORDER BY RANDOM()':>20}{'load_random':>14}")
+    seeded = 1
+    for size in sorted(args.sizes):
+        seed(session, seeded, size + 1)
+        seeded = size + 1
+        times = [
+            min(repeat(lambda: fn(session), number=1, repeat=args.repeat))
+            for fn in (order_by_random, sampled)
+        ]
+        print(f"{size:>10}{times[0] * 1000:>18.2f}ms{times[1] * 1000:>12.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Compare the legacy `as_json` path with precompiled serializers.
+
+    python -m benchmarks.serialization --rows 20000
+"""
+import argparse
+import json
+from timeit import repeat
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker, undefer
+
+from app.models import Base, Organization, Repository, setup_schema
+from app.serializers import dumps, serializer_for
+
+
+def seed(session, rows):
+    orgs = max(rows // 100, 1)
+    session.execute(
+        insert(Organization),
+        [{"id": i, "name": f"org-{i}", "billing_address": "-"} for i in range(orgs)],
+    )
+    session.execute(
+        insert(Repository),
+        [
+            {"id": i, "name": f"repo-{i}", "org_id": i % orgs, "description": "-"}
+            for i in range(rows)
+        ],
+    )
+    session.commit()
+
+
+def legacy(session, cls):
+    # What `setup_schema` used to attach: one `getattr` per column per row,
+    # then encoded the way `jsonify` does it.
+    columns = serializer_for(cls).keys
+    rows = [
+        {c: getattr(o, c) for c in columns}
+        for o in session.query(cls).options(undefer("*"))
+    ]
+    session.expunge_all()
+    return json.dumps(rows, sort_keys=True).encode()
+
+
+def orm(session, cls):
+    rows = [o.as_json() for o in session.query(cls).options(undefer("*"))]
+    session.expunge_all()
+    return dumps(rows)
+
+
+def core(session, cls):
+    serializer = serializer_for(cls)
+    return dumps(serializer.rows(session.execute(serializer.select())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    setup_schema(Base)
+    session = sessionmaker(bind=engine)()
+    seed(session, args.rows)
+
+    for cls in [Repository, Organization]:
+        count = session.query(cls).count()
+        print(f"{cls.__name__} ({count} rows)")
+        baseline = None
+        for fn in [legacy, orm, core]:
+            best = min(repeat(lambda: fn(session, cls), number=1, repeat=args.repeat))
+            baseline = baseline or best
+            print(f"  {fn.__name__:<8} {best * 1000:8.1f}ms  {baseline / best:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from app.models import Base
+
+config = context.config
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=Base.metadata,
+        # SQLite can't alter most columns in place; batch operations copy the
+        # table instead.
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+# `app.migrations.migrate` passes the connection it's migrating.
+connection = config.attributes.get("connection")
+if connection is not None:
+    run_migrations(connection)
+else:
+    # As in `create_app`: without the fact replica, member counts are
+    # backfilled from Oso Cloud.
+    if os.environ.get("LOCAL_FACTS", "0") != "1":
+        from app.authorization import oso
+
+        config.attributes.setdefault("oso_client", oso.client)
+    engine = create_engine(os.environ.get("DATABASE_URL", "sqlite:///roles.db"))
+    with engine.connect() as connection:
+        run_migrations(connection)
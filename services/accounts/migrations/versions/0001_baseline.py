@@ -0,0 +1,122 @@
+"""The schema as `create_all` used to make it.
+
+Databases created before migrations have their tables already, possibly
+without the later counter columns and indexes, so this only adds what's
+missing. On an empty database, it creates everything.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from app.migrations import backfill_member_counts, backfill_repository_counts
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String()),
+            sa.Column("email", sa.String()),
+            sa.Column("name", sa.String()),
+        )
+    if "organizations" not in tables:
+        op.create_table(
+            "organizations",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), unique=True),
+            sa.Column("description", sa.String()),
+            sa.Column("billing_address", sa.String()),
+            sa.Column(
+                "repository_count", sa.Integer(), nullable=False, server_default="0"
+            ),
+            sa.Column("member_count", sa.Integer(), nullable=False, server_default="0"),
+        )
+    if "repositories" not in tables:
+        op.create_table(
+            "repositories",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(256)),
+            sa.Column("description", sa.String(256)),
+            sa.Column("org_id", sa.Integer(), sa.ForeignKey("organizations.id")),
+            sa.Column("public", sa.Boolean()),
+            sa.Column("protected", sa.Boolean()),
+            sa.UniqueConstraint("name", "org_id"),
+        )
+    if "facts" not in tables:
+        op.create_table(
+            "facts",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("arg0_type", sa.String()),
+            sa.Column("arg0_id", sa.String()),
+            sa.Column("arg1_type", sa.String()),
+            sa.Column("arg1_id", sa.String()),
+            sa.Column("arg2_type", sa.String()),
+            sa.Column("arg2_id", sa.String()),
+            sa.UniqueConstraint(
+                "name",
+                "arg0_type",
+                "arg0_id",
+                "arg1_type",
+                "arg1_id",
+                "arg2_type",
+                "arg2_id",
+            ),
+        )
+    if "change_counters" not in tables:
+        op.create_table(
+            "change_counters",
+            sa.Column("name", sa.String(), primary_key=True),
+            sa.Column("version", sa.Integer(), nullable=False),
+        )
+
+    columns = {c["name"] for c in inspector.get_columns("organizations")}
+    for name, backfill in [
+        ("repository_count", backfill_repository_counts),
+        # Counted from Oso Cloud, unless the roles are replicated locally.
+        (
+            "member_count",
+            lambda bind: backfill_member_counts(
+                bind, context.config.attributes.get("oso_client")
+            ),
+        ),
+    ]:
+        if name not in columns:
+            op.add_column(
+                "organizations",
+                sa.Column(name, sa.Integer(), nullable=False, server_default="0"),
+            )
+            backfill(op.get_bind())
+
+    for table, index, index_columns in [
+        ("repositories", "ix_repositories_org_id", ["org_id"]),
+        (
+            "facts",
+            "ix_facts_actor_resource",
+            ["name", "arg0_type", "arg0_id", "arg2_type", "arg2_id"],
+        ),
+        ("facts", "ix_facts_resource", ["name", "arg2_type", "arg2_id", "arg0_type"]),
+    ]:
+        if index not in {i["name"] for i in inspector.get_indexes(table)}:
+            op.create_index(index, table, index_columns)
+
+
+def downgrade() -> None:
+    for table in ["change_counters", "facts", "repositories", "organizations", "users"]:
+        op.drop_table(table)
@@ -0,0 +1,29 @@
+"""Index users by username.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 21:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases that `0001` adopted may have been created by a `create_all`
+    # that already had it.
+    indexes = {i["name"] for i in sa.inspect(op.get_bind()).get_indexes("users")}
+    if "ix_users_username" not in indexes:
+        op.create_index("ix_users_username", "users", ["username"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_username", table_name="users")
@@ -1,9 +1,31 @@
+import os
+
 import pytest
+import app as accounts
 from app import create_app
+from app.authorization import oso
+from app.fake_oso import FakeOsoServer
+
+
+@pytest.fixture(scope="session")
+def oso_client():
+    """Oso Cloud at `OSO_URL` if it's set, otherwise a local fake."""
+    if os.getenv("OSO_URL"):
+        yield oso.client
+        return
+    with FakeOsoServer() as server:
+        yield server.client()
+
+
+@pytest.fixture(autouse=True)
+def instrumentation(monkeypatch):
+    """Tests count queries and Oso calls in `Server-Timing`."""
+    monkeypatch.setattr(accounts, "INSTRUMENTATION", True)
 
 
 @pytest.fixture()
-def app():
+def app(oso_client, monkeypatch):
+    monkeypatch.setattr(oso, "client", oso_client)
     app = create_app(db_path="sqlite://", load_fixtures=True)
     app.config.update(
         {
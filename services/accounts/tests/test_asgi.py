@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from asgiref.testing import ApplicationCommunicator
+
+from app.asgi import ThreadedWsgiToAsgi
+
+
+async def get(asgi_app, path, headers=()):
+    communicator = ApplicationCommunicator(
+        asgi_app,
+        {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "GET",
+            "path": path.split("?")[0],
+            "query_string": path.partition("?")[2].encode(),
+            "headers": [(k.encode(), v.encode()) for k, v in headers],
+        },
+    )
+    await communicator.send_input({"type": "http.request"})
+    start = await communicator.receive_output(5)
+    body = b""
+    while True:
+        message = await communicator.receive_output(5)
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return start["status"], body
+
+
+def test_serves_concurrent_requests(app):
+    asgi_app = ThreadedWsgiToAsgi(app)
+
+    async def main():
+        return await asyncio.gather(
+            *(get(asgi_app, "/orgs", [("x-user-id", "1")]) for _ in range(4))
+        )
+
+    responses = asyncio.run(main())
+    assert [status for status, _ in responses] == [200] * 4
+    assert all(body == responses[0][1] for _, body in responses)
+
+
+def test_lifespan_is_acknowledged(app):
+    async def main():
+        communicator = ApplicationCommunicator(
+            ThreadedWsgiToAsgi(app), {"type": "lifespan"}
+        )
+        await communicator.send_input({"type": "lifespan.startup"})
+        started = await communicator.receive_output(1)
+        await communicator.send_input({"type": "lifespan.shutdown"})
+        stopped = await communicator.receive_output(1)
+        return started["type"], stopped["type"]
+
+    assert asyncio.run(main()) == (
+        "lifespan.startup.complete",
+        "lifespan.shutdown.complete",
+    )
+
+
+def test_streams_responses_and_tears_down(app):
+    closed = []
+    app.teardown_request(lambda _: closed.append(True))
+    asgi_app = ThreadedWsgiToAsgi(app)
+
+    status, body = asyncio.run(get(asgi_app, "/orgs?stream=1", [("x-user-id", "1")]))
+    assert status == 200
+    assert json.loads(body)
+    assert closed == [True]
@@ -0,0 +1,250 @@
+import os
+import re
+from threading import Barrier
+
+from flask import Flask
+
+from app.authorization import _MISSING, PERMISSIONS, CachedOso, DecisionCache
+
+POLICY = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "policy", "authorization.polar"
+)
+
+john = {"type": "User", "id": "1"}
+paul = {"type": "User", "id": "2"}
+beatles = {"type": "Organization", "id": "1"}
+monsters = {"type": "Organization", "id": "2"}
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = []
+
+    def authorize(self, actor, action, resource, context_facts=[]):
+        self.calls.append("authorize")
+        return action == "read"
+
+    def actions(self, actor, resource, context_facts=[]):
+        self.calls.append("actions")
+        return ["read", "view_members"]
+
+    def authorize_resources(self, actor, action, resources, context_facts=[]):
+        self.calls.append("authorize_resources")
+        return [r for r in resources if r["id"] != "2"]
+
+    def list(self, actor, action, resource_type, context_facts=[]):
+        self.calls.append("list")
+        return ["1"]
+
+    def tell(self, fact):
+        self.calls.append("tell")
+
+    def bulk(self, delete=[], tell=[]):
+        self.calls.append("bulk")
+
+
+def test_decisions_are_cached_per_request():
+    client = CountingClient()
+    oso = CachedOso(client)
+
+    with Flask(__name__).test_request_context():
+        assert oso.authorize(john, "read", beatles)
+        assert oso.authorize(john, "read", {"type": "Organization", "id": 1})
+        assert not oso.authorize(john, "delete", beatles)
+    assert client.calls == ["authorize", "authorize"]
+
+    with Flask(__name__).test_request_context():
+        assert oso.authorize(john, "read", beatles)
+    assert client.calls == ["authorize", "authorize", "authorize"]
+
+
+def test_authorize_is_answered_from_actions():
+    client = CountingClient()
+    oso = CachedOso(client)
+
+    with Flask(__name__).test_request_context():
+        assert "view_members" in oso.actions(john, beatles)
+        assert oso.authorize(john, "view_members", beatles)
+        assert not oso.authorize(john, "delete", beatles)
+    assert client.calls == ["actions"]
+
+
+def test_writes_invalidate_request_cache():
+    client = CountingClient()
+    oso = CachedOso(client)
+
+    with Flask(__name__).test_request_context():
+        oso.actions(john, beatles)
+        oso.tell({"name": "has_role", "args": [john, "admin", beatles]})
+        oso.actions(john, beatles)
+    assert client.calls == ["actions", "tell", "actions"]
+
+
+def test_no_caching_outside_of_a_request():
+    client = CountingClient()
+    oso = CachedOso(client)
+
+    oso.authorize(john, "read", beatles)
+    oso.authorize(john, "read", beatles)
+    assert client.calls == ["authorize", "authorize"]
+
+
+def test_decisions_are_shared_across_requests():
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache())
+
+    for _ in range(3):
+        with Flask(__name__).test_request_context():
+            assert oso.authorize(john, "read", beatles)
+            assert oso.list(john, "read", "Organization") == ["1"]
+    assert client.calls == ["authorize", "list"]
+
+
+def test_writes_only_invalidate_affected_values():
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache())
+
+    oso.actions(john, beatles)
+    oso.actions(paul, monsters)
+    oso.list(paul, "read", "Repository")
+    oso.tell({"name": "has_role", "args": [john, "admin", beatles]})
+    oso.actions(john, beatles)
+    oso.actions(paul, monsters)
+    oso.list(paul, "read", "Repository")
+    assert client.calls == ["actions", "actions", "list", "tell", "actions"]
+
+    # A new relation on a repository can change which repositories anyone is
+    # allowed to list.
+    repo = {"type": "Repository", "id": "1"}
+    oso.bulk(tell=[{"name": "has_relation", "args": [repo, "organization", beatles]}])
+    oso.actions(paul, monsters)
+    oso.list(paul, "read", "Repository")
+    assert client.calls[-2:] == ["bulk", "list"]
+
+
+def test_wildcard_writes_invalidate_everything():
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache())
+
+    oso.actions(john, beatles)
+    oso.actions(paul, monsters)
+    oso.bulk(delete=[{"name": "has_role", "args": [john, None, beatles]}])
+    oso.actions(paul, monsters)
+    assert client.calls == ["actions", "actions", "bulk"]
+
+    oso.bulk(delete=[{"name": "has_role", "args": [None, None, beatles]}])
+    oso.actions(paul, monsters)
+    assert client.calls == ["actions", "actions", "bulk", "bulk", "actions"]
+
+
+def test_decisions_expire(monkeypatch):
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache(ttl=10))
+    now = 1000.0
+    monkeypatch.setattr("app.authorization.monotonic", lambda: now)
+
+    oso.authorize(john, "read", beatles)
+    now += 5
+    oso.authorize(john, "read", beatles)
+    now += 10
+    oso.authorize(john, "read", beatles)
+    assert client.calls == ["authorize", "authorize"]
+
+
+def test_decision_cache_is_bounded():
+    cache = DecisionCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get("b") is _MISSING
+
+
+def test_authorize_many_uses_one_round_trip():
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache())
+
+    oso.actions(john, beatles)
+    allowed = oso.authorize_many(
+        john, "view_members", [beatles, monsters, {"type": "Organization", "id": 3}]
+    )
+    assert allowed == {"1": True, "2": False, "3": True}
+    assert client.calls == ["actions", "authorize_resources"]
+
+    assert oso.authorize_many(john, "view_members", [monsters]) == {"2": False}
+    assert client.calls == ["actions", "authorize_resources"]
+
+
+def test_actions_many_checks_each_permission_once():
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache())
+
+    oso.actions(john, beatles)
+    orgs = [{"type": "Organization", "id": str(i)} for i in range(1, 12)]
+    actions = oso.actions_many(john, orgs)
+    assert actions["1"] == ["read", "view_members"]
+    assert actions["2"] == []
+    assert actions["3"] == sorted(PERMISSIONS["Organization"])
+    # However many resources there are.
+    assert client.calls == ["actions"] + ["authorize_resources"] * len(
+        PERMISSIONS["Organization"]
+    )
+
+    calls = len(client.calls)
+    oso.actions_many(john, orgs)
+    assert len(client.calls) == calls
+
+
+def test_actions_many_fetches_small_batches_one_by_one():
+    client = CountingClient()
+    oso = CachedOso(client, DecisionCache())
+
+    repos = [{"type": "Repository", "id": str(i)} for i in range(1, 4)]
+    actions = oso.actions_many(john, repos)
+    assert actions == {str(i): ["read", "view_members"] for i in range(1, 4)}
+    assert client.calls == ["actions"] * 3
+
+    widgets = [{"type": "Widget", "id": str(i)} for i in range(1, 40)]
+    oso.actions_many(john, widgets)
+    assert client.calls == ["actions"] * 42
+
+
+def test_permissions_match_the_policy():
+    with open(POLICY) as f:
+        policy = re.sub(r"#.*", "", f.read())
+    declared = {
+        name: re.findall(r'"(\w+)"', permissions)
+        for name, permissions in re.findall(
+            r"(?:actor|resource)\s+(\w+)\s*{[^}]*?permissions\s*=\s*\[([^\]]*)\]",
+            policy,
+        )
+    }
+    assert declared == PERMISSIONS
+
+
+def test_futures_overlap_and_share_the_request_cache():
+    client = CountingClient()
+    oso = CachedOso(client)
+    barrier = Barrier(2, timeout=5)
+
+    def actions(actor, resource, context_facts=[]):
+        barrier.wait()
+        return CountingClient.actions(client, actor, resource)
+
+    def authorize(actor, action, resource, context_facts=[]):
+        barrier.wait()
+        return CountingClient.authorize(client, actor, action, resource)
+
+    client.actions = actions
+    client.authorize = authorize
+    with Flask(__name__).test_request_context():
+        # Each call blocks until the other has started.
+        permissions = oso.futures.actions(john, beatles)
+        allowed = oso.futures.authorize(john, "read", paul)
+        assert "view_members" in permissions.result()
+        assert allowed.result()
+
+        assert oso.authorize(john, "view_members", beatles)
+    assert sorted(client.calls) == ["actions", "authorize"]
@@ -0,0 +1,107 @@
+import gzip
+
+from app.authorization import oso
+
+john = {"x-user-id": "1"}
+
+
+def oso_calls(response):
+    return response.headers["Server-Timing"].split("oso;")[1].split('"')[1]
+
+
+def test_unchanged_listing_is_not_modified(client):
+    first = client.get("/orgs/1/repos", headers=john)
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    etag = first.headers["ETag"]
+
+    again = client.get("/orgs/1/repos", headers={**john, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+    assert oso_calls(again) == "0 calls"
+
+    # Another user, or another page, is another ETag.
+    paul = client.get("/orgs/1/repos", headers={"x-user-id": "2"})
+    assert paul.headers["ETag"] != etag
+    page = client.get("/orgs/1/repos?limit=1", headers=john)
+    assert page.headers["ETag"] != etag
+
+
+def test_writes_change_the_etag(client):
+    etag = client.get("/orgs/1/repos", headers=john).headers["ETag"]
+    created = client.post("/orgs/1/repos", json={"name": "Let It Be"}, headers=john)
+    assert created.status_code == 201
+
+    response = client.get("/orgs/1/repos", headers={**john, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Let It Be" in [repo["name"] for repo in response.json]
+
+    # Role assignments only change facts.
+    etag = client.get("/orgs/1/role_assignments", headers=john).headers["ETag"]
+    assigned = client.post(
+        "/orgs/1/role_assignments", json={"id": "2", "role": "admin"}, headers=john
+    )
+    assert assigned.status_code == 201
+    response = client.get(
+        "/orgs/1/role_assignments", headers={**john, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+
+
+def test_large_responses_are_compressed(client):
+    small = client.get("/orgs/1", headers={**john, "Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+
+    # Every fixture user but the Beatles, always well over `GZIP_MIN_SIZE`.
+    response = client.get(
+        "/orgs/1/unassigned_users", headers={**john, "Accept-Encoding": "gzip"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    plain = client.get("/orgs/1/unassigned_users", headers=john)
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_only_listings_have_etags(client):
+    assert "ETag" in client.get("/orgs", headers=john).headers
+
+    response = client.get("/orgs/1", headers=john)
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    # Just the organization, no versions for an ETag.
+    assert response.headers["Server-Timing"].split("db;")[1].split('"')[1] == (
+        "1 queries"
+    )
+
+
+def test_etags_are_keyed_with_the_secret(app, client):
+    etag = client.get("/orgs", headers=john).headers["ETag"]
+    app.secret_key = "another secret"
+    assert client.get("/orgs", headers=john).headers["ETag"] != etag
+
+
+def test_reset_changes_the_etag(client):
+    etag = client.get("/orgs", headers=john).headers["ETag"]
+    assert client.post("/_reset").status_code == 200
+    # The counters start over, but not the epoch.
+    response = client.get("/orgs", headers={**john, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_revoking_roles_changes_the_etag(client):
+    etag = client.get("/orgs", headers=john).headers["ETag"]
+    # Outside of any request, so no `facts` version is bumped.
+    oso.delete(
+        {
+            "name": "has_role",
+            "args": [
+                {"type": "User", "id": "1"},
+                "owner",
+                {"type": "Organization", "id": "1"},
+            ],
+        }
+    )
+    response = client.get("/orgs", headers={**john, "If-None-Match": etag})
+    assert response.status_code == 200
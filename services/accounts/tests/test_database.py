@@ -0,0 +1,92 @@
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.pool import StaticPool
+
+from app.authorization import oso
+from app.conditional import versions
+from app.database import TimedQueuePool, make_engine, pool_metrics
+from app.facts import FactReplica, fact_filter
+from app.models import Fact, User
+
+
+def test_file_sqlite_is_pooled_with_wal(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    engine = make_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    assert isinstance(engine.pool, TimedQueuePool)
+    assert engine.pool.size() == 3
+
+    checkouts = pool_metrics.checkouts
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert pool_metrics.checkouts == checkouts + 1
+    assert engine.pool.status_dict()["checked_out"] == 0
+
+
+def test_memory_sqlite_shares_one_connection():
+    engine = make_engine("sqlite://")
+    assert isinstance(engine.pool, StaticPool)
+
+
+def count_sessions(app):
+    opened = []
+    Session = app.extensions["sessionmaker"]
+
+    def open_session():
+        opened.append(Session())
+        return opened[-1]
+
+    app.extensions["sessionmaker"] = open_session
+    return opened
+
+
+def test_session_is_opened_on_first_use(app, client):
+    opened = count_sessions(app)
+    assert client.options("/orgs").status_code == 200
+    assert client.get("/org_role_choices").status_code == 200
+    assert opened == []
+
+    assert client.get("/orgs", headers={"x-user-id": "1"}).status_code == 200
+    assert client.get("/orgs?stream=1", headers={"x-user-id": "1"}).json
+    assert len(opened) == 2
+    assert all(not session.in_transaction() for session in opened)
+
+
+def test_session_is_closed_after_an_error(app):
+    opened = count_sessions(app)
+
+    @app.route("/_fail")
+    def fail():
+        g.session.query(User).first()
+        raise RuntimeError("boom")
+
+    app.config["PROPAGATE_EXCEPTIONS"] = False
+    assert app.test_client().get("/_fail").status_code == 500
+    assert len(opened) == 1
+    assert not opened[0].in_transaction()
+
+
+def test_oso_writes_before_first_use_open_the_session(app, monkeypatch):
+    monkeypatch.setattr(oso, "replica", FactReplica())
+    before = versions(app.extensions["sessionmaker"](), ["facts"]).get("facts", 0)
+    opened = count_sessions(app)
+    fact = {
+        "name": "has_role",
+        "args": [
+            {"type": "User", "id": "2"},
+            "member",
+            {"type": "Organization", "id": "3"},
+        ],
+    }
+
+    @app.route("/_tell", methods=["POST"])
+    def tell():
+        # Oso first, before anything else has used the session.
+        oso.tell(fact)
+        g.session.commit()
+        return {}
+
+    assert app.test_client().post("/_tell").status_code == 200
+    assert len(opened) == 1
+    session = app.extensions["sessionmaker"]()
+    assert session.query(Fact).filter(fact_filter(fact)).count() == 1
+    assert versions(session, ["facts"]) == {"facts": before + 1}
@@ -0,0 +1,157 @@
+import pytest
+from flask import Flask, g
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.authorization import CachedOso
+from app.facts import FactReplica, reconcile
+from app.models import Base, Fact
+
+john = {"type": "User", "id": "1"}
+paul = {"type": "User", "id": "2"}
+beatles = {"type": "Organization", "id": "1"}
+monsters = {"type": "Organization", "id": "2"}
+
+
+def role(user, name, resource):
+    return {"name": "has_role", "args": [user, name, resource]}
+
+
+def output(fact):
+    args = [
+        {"type": "String", "id": arg} if isinstance(arg, str) else arg
+        for arg in fact["args"]
+    ]
+    return {"name": fact["name"], "args": args}
+
+
+class RecordingClient:
+    def __init__(self, facts=[]):
+        self.facts = list(facts)
+        self.calls = []
+
+    def get(self, fact):
+        self.calls.append("get")
+        return [
+            output(f)
+            for f in self.facts
+            if f["name"] == fact["name"]
+            and all(f["args"][-1].get(k) == v for k, v in fact["args"][-1].items())
+        ]
+
+    def tell(self, fact):
+        self.calls.append("tell")
+
+    def bulk(self, delete=[], tell=[]):
+        self.calls.append("bulk")
+
+
+@pytest.fixture()
+def Session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture()
+def app(Session):
+    app = Flask(__name__)
+
+    @app.before_request
+    def open_session():
+        g.session = Session()
+
+    return app
+
+
+def test_writes_are_mirrored_in_the_request_transaction(app, Session):
+    client = RecordingClient()
+    oso = CachedOso(client, replica=FactReplica())
+    members = {"name": "has_role", "args": [{"type": "User"}, None, beatles]}
+
+    with app.test_request_context():
+        app.preprocess_request()
+        oso.tell(role(john, "admin", beatles))
+        oso.bulk(tell=[role(paul, "member", beatles), role(paul, "member", monsters)])
+        g.session.commit()
+
+        assert oso.get(members) == [
+            output(role(john, "admin", beatles)),
+            output(role(paul, "member", beatles)),
+        ]
+        assert oso.local_facts().count(members) == 2
+
+        oso.bulk(
+            delete=[{"name": "has_role", "args": [paul, None, beatles]}],
+            tell=[role(paul, "admin", beatles)],
+        )
+        g.session.rollback()
+    assert client.calls == ["tell", "bulk", "bulk"]
+
+    with app.test_request_context():
+        app.preprocess_request()
+        # The rolled back update never made it.
+        assert oso.get(members)[1] == output(role(paul, "member", beatles))
+        oso.bulk(delete=[{"name": "has_role", "args": [paul, None, {}]}])
+        g.session.commit()
+
+    assert [fact.arg0_id for fact in Session().query(Fact)] == ["1"]
+
+
+def test_writes_outside_a_session_are_skipped(Session):
+    client = RecordingClient()
+    oso = CachedOso(client, replica=FactReplica())
+    oso.tell(role(john, "admin", beatles))
+    assert oso.local_facts() is None
+    assert Session().query(Fact).count() == 0
+
+    session = Session()
+    with oso.replica.bind(session):
+        oso.tell(role(john, "admin", beatles))
+        oso.tell(role(john, "admin", beatles))
+    session.commit()
+    assert Session().query(Fact).count() == 1
+
+
+def test_reconcile(Session):
+    session = Session()
+    replica = FactReplica()
+    with replica.bind(session):
+        replica.tell([role(john, "admin", beatles), role(paul, "member", beatles)])
+    session.commit()
+
+    client = RecordingClient([role(paul, "admin", monsters)])
+    assert reconcile(session, client) == 1
+    facts = [(f.arg0_id, f.arg1_id, f.arg2_id) for f in session.query(Fact)]
+    assert facts == [("2", "admin", "2")]
+
+
+def test_get_in_binds_each_id(app):
+    facts = [
+        role(john, "admin", beatles),
+        role(paul, "member", beatles),
+        role(paul, "admin", monsters),
+        role(john, "member", {"type": "Organization", "id": "3"}),
+    ]
+    orgs = {
+        "name": "has_role",
+        "args": [{"type": "User"}, None, {"type": "Organization"}],
+    }
+    expected = {
+        "1": [output(facts[0]), output(facts[1])],
+        "2": [output(facts[2])],
+        "4": [],
+    }
+
+    client = RecordingClient(facts)
+    assert CachedOso(client).get_in(orgs, 2, ["1", "2", "4"]) == expected
+    # Only ever the facts about one organization at a time.
+    assert client.calls == ["get"] * 3
+
+    client = RecordingClient()
+    oso = CachedOso(client, replica=FactReplica())
+    with app.test_request_context():
+        app.preprocess_request()
+        oso.bulk(tell=facts)
+        assert oso.get_in(orgs, 2, ["1", "2", "4"]) == expected
+    assert client.calls == ["bulk"]
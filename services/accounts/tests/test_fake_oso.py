@@ -0,0 +1,107 @@
+import requests
+
+from app.fake_oso import FakeOso, FakeOsoServer
+
+alice = {"type": "User", "id": "alice"}
+bob = {"type": "User", "id": "bob"}
+acme = {"type": "Organization", "id": "acme"}
+anvils = {"type": "Repository", "id": "anvils"}
+rockets = {"type": "Repository", "id": "rockets"}
+false = {"type": "Boolean", "id": "false"}
+
+
+def make_oso():
+    return FakeOso(
+        [
+            {"name": "has_role", "args": [alice, "member", acme]},
+            {"name": "has_role", "args": [bob, "admin", acme]},
+            {"name": "has_relation", "args": [anvils, "organization", acme]},
+            {"name": "is_protected", "args": [anvils, false]},
+            {"name": "has_role", "args": [alice, "maintainer", rockets]},
+            {"name": "is_protected", "args": [rockets, false]},
+            {"name": "is_public", "args": [rockets]},
+        ]
+    )
+
+
+def test_organization_roles_grant_repository_roles():
+    oso = make_oso()
+    assert oso.actions(alice, acme) == [
+        "create_repositories",
+        "read",
+        "read_details",
+        "view_members",
+    ]
+    assert "manage_members" in oso.actions(bob, acme)
+    assert oso.authorize(alice, "read", anvils)
+    assert not oso.authorize(alice, "write", anvils)
+    assert oso.authorize(bob, "invite", anvils)
+
+
+def test_maintainers_delete_unprotected_repositories():
+    oso = make_oso()
+    assert oso.authorize(alice, "delete", rockets)
+    oso.bulk(
+        delete=[{"name": "is_protected", "args": [rockets, None]}],
+        tell=[
+            {
+                "name": "is_protected",
+                "args": [rockets, {"type": "Boolean", "id": "true"}],
+            }
+        ],
+    )
+    assert not oso.authorize(alice, "delete", rockets)
+    assert oso.authorize(alice, "write", rockets)
+
+
+def test_list():
+    oso = make_oso()
+    assert oso.list(alice, "read", "Organization") == ["*"]
+    assert oso.list(alice, "read", "Repository") == ["anvils", "rockets"]
+    assert oso.list(bob, "read", "Repository") == ["anvils", "rockets"]
+    assert oso.list(bob, "write", "Repository") == ["anvils"]
+    assert oso.authorize_resources(alice, "write", [anvils, rockets]) == [rockets]
+
+
+def test_get_matches_patterns():
+    oso = make_oso()
+    roles = oso.get(
+        {"name": "has_role", "args": [{"type": "User"}, None, {"type": "Organization"}]}
+    )
+    assert sorted(fact["args"][0]["id"] for fact in roles) == ["alice", "bob"]
+    assert oso.get({"name": "has_role", "args": [alice, "admin", acme]}) == []
+
+    oso.delete({"name": "has_role", "args": [alice, "member", acme]})
+    assert not oso.authorize(alice, "read", anvils)
+    assert oso.calls["bulk"] == 1
+
+
+def test_server_speaks_the_client_api():
+    with FakeOsoServer(make_oso()) as server:
+        assert requests.get(server.url + "/api").status_code == 401
+        client = server.client()
+
+        assert client.authorize(alice, "read", anvils)
+        assert client.actions(bob, anvils)[:3] == ["create_issues", "delete", "invite"]
+        assert client.list(alice, "read", "Repository") == ["anvils", "rockets"]
+        assert client.authorize_resources(alice, "write", [anvils, rockets]) == [
+            rockets
+        ]
+        assert client.authorize(
+            bob,
+            "read",
+            rockets,
+            [{"name": "has_role", "args": [bob, "reader", rockets]}],
+        )
+        assert not client.authorize(bob, "write", rockets)
+
+        client.tell({"name": "has_role", "args": [bob, "member", acme]})
+        client.bulk(delete=[{"name": "has_role", "args": [bob, "admin", None]}])
+        roles = client.get({"name": "has_role", "args": [bob, None, None]})
+        assert roles == [
+            {
+                "name": "has_role",
+                "args": [bob, {"type": "String", "id": "member"}, acme],
+            }
+        ]
+        assert server.fake.calls["get"] == 1
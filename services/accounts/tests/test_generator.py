@@ -0,0 +1,58 @@
+from collections import Counter
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app.facts import fact_rows
+from app.generator import Scale, generate, write_local_facts
+from app.models import Base, Fact, Organization, Repository, User
+
+SCALE = Scale(users=50, orgs=8, repos_per_org=5, members_per_org=6)
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_generate_is_deterministic():
+    assert list(generate(make_session(), SCALE, seed=1)) == list(
+        generate(make_session(), SCALE, seed=1)
+    )
+    assert list(generate(make_session(), SCALE, seed=1)) != list(
+        generate(make_session(), SCALE, seed=2)
+    )
+
+
+def test_generated_rows_match_facts():
+    session = make_session()
+    facts = list(generate(session, SCALE))
+
+    assert session.scalar(select(func.count()).select_from(User)) == SCALE.users
+    usernames = session.scalars(select(User.username)).all()
+    assert len(set(usernames)) == len(usernames)
+
+    orgs = session.scalars(select(Organization)).all()
+    assert len(orgs) == SCALE.orgs
+    assert len({org.name for org in orgs}) == SCALE.orgs
+    repos = Counter(session.scalars(select(Repository.org_id)))
+    members = Counter(
+        fact["args"][2]["id"]
+        for fact in facts
+        if fact["name"] == "has_role" and fact["args"][2]["type"] == "Organization"
+    )
+    for org in orgs:
+        assert org.repository_count == repos[org.id]
+        assert org.member_count == members[str(org.id)]
+
+    relations = [fact for fact in facts if fact["name"] == "has_relation"]
+    assert len(relations) == sum(repos.values())
+    # Every fact has a shape the replica can store.
+    session.execute(insert(Fact), fact_rows(facts))
+
+
+def test_write_local_facts():
+    session = make_session()
+    count = write_local_facts(session, generate(session, SCALE))
+    assert session.scalar(select(func.count()).select_from(Fact)) == count > 0
@@ -0,0 +1,61 @@
+from sqlalchemy import update
+
+from app.identities import IdentityMap
+from app.models import User
+
+john = {"x-user-id": "1"}
+
+
+def db_queries(response):
+    return response.headers["Server-Timing"].split("db;")[1].split('"')[1]
+
+
+def test_session_is_served_from_the_identity_map(client):
+    first = client.get("/session", headers=john)
+    assert first.json["username"] == "john"
+
+    again = client.get("/session", headers=john)
+    assert again.json == first.json
+    assert db_queries(again) == "0 queries"
+
+
+def test_users_are_resolved_by_username(client):
+    response = client.get("/users/john", headers=john)
+    assert response.status_code == 200
+    assert response.json["id"] == 1
+
+    # Facts name users by id, so john's roles are found by his username.
+    orgs = client.get("/users/john/orgs", headers=john)
+    assert orgs.status_code == 200
+    assert "The Beatles" in [org["name"] for org in orgs.json]
+
+    assert client.get("/users/john", headers={"x-user-id": "2"}).status_code == 404
+    assert client.get("/users/nobody", headers=john).status_code == 404
+
+
+def test_writes_invalidate_identities(app):
+    Session = app.extensions["sessionmaker"]
+    identities: IdentityMap = app.extensions["identities"]
+    session = Session()
+    assert identities.by_username(session, "john").id == 1  # type: ignore
+
+    john = session.get(User, 1)
+    john.username = "johnny"
+    session.commit()
+    assert identities.by_username(session, "john") is None
+    assert identities.by_id(session, 1).username == "johnny"  # type: ignore
+
+    session.execute(update(User).values(name="Anonymous"))
+    session.commit()
+    assert len(identities) == 0
+    assert identities.by_id(session, 1).profile["name"] == "Anonymous"  # type: ignore
+    session.close()
+
+
+def test_identity_map_is_bounded(app):
+    identities = IdentityMap(maxsize=2)
+    with app.extensions["sessionmaker"]() as session:
+        for id in [1, 2, 3, 1]:
+            assert identities.by_id(session, id).id == id  # type: ignore
+        assert identities.by_id(session, "not an id") is None
+    assert len(identities) == 2
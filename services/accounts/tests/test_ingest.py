@@ -0,0 +1,84 @@
+from threading import Lock
+
+from app.authorization import CachedOso, DecisionCache
+from app.ingest import ingest, replay
+
+
+def fact(i):
+    return {
+        "name": "has_role",
+        "args": [{"type": "User", "id": str(i)}, "member", {"type": "Organization"}],
+    }
+
+
+class FlakyClient:
+    """Fails the first call for every batch in `flaky`, and every call for
+    batches in `broken`."""
+
+    def __init__(self, flaky=(), broken=()):
+        self.flaky = set(flaky)
+        self.broken = set(broken)
+        self.told = []
+        self.lock = Lock()
+
+    def bulk_tell(self, facts):
+        first = facts[0]["args"][0]["id"]
+        with self.lock:
+            if first in self.broken:
+                raise ConnectionError(first)
+            if first in self.flaky:
+                self.flaky.remove(first)
+                raise ConnectionError(first)
+            self.told.extend(facts)
+
+
+class RecordingOso(CachedOso):
+    def __init__(self, client):
+        super().__init__(client, DecisionCache())
+        self.recorded = []
+
+    def record_writes(self, delete=[], tell=[]):
+        self.recorded.extend(tell)
+
+
+def test_ingest_retries_and_collects_failures():
+    facts = [fact(i) for i in range(95)]
+    client = FlakyClient(flaky=["10"], broken=["40"])
+    oso = RecordingOso(client)
+    reports = []
+
+    result = ingest(
+        facts, oso, batch_size=10, max_workers=3, max_tries=2, progress=reports.append
+    )
+
+    assert result.total == 95
+    assert result.sent == 85
+    assert result.failed_facts == facts[40:50]
+    assert sorted(oso.recorded, key=lambda f: int(f["args"][0]["id"])) == (
+        facts[:40] + facts[50:]
+    )
+    assert len(client.told) == 85
+    assert reports[-1] is result
+
+    client.broken.clear()
+    replayed = replay(result, oso=oso, progress=None)
+    assert replayed.sent == 10 and not replayed.failed
+    assert len(oso.recorded) == 95
+
+
+class RejectingClient:
+    def __init__(self, status):
+        self.status = status
+        self.calls = 0
+
+    def bulk_tell(self, facts):
+        self.calls += 1
+        raise Exception(f"Got unexpected error from Oso Service: {self.status}\n")
+
+
+def test_ingest_only_retries_transient_errors():
+    for status, calls in [(400, 1), (403, 1), (429, 2), (503, 2)]:
+        client = RejectingClient(status)
+        result = ingest([fact(0)], RecordingOso(client), max_tries=2, progress=None)
+        assert result.failed_facts == [fact(0)]
+        assert client.calls == calls, status
@@ -0,0 +1,53 @@
+import json
+import logging
+import re
+
+from app.authorization import PERMISSIONS
+
+
+def timings(response):
+    return {
+        name: (float(duration), description)
+        for name, duration, description in re.findall(
+            r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?',
+            response.headers["Server-Timing"],
+        )
+    }
+
+
+def test_requests_report_sql_and_oso_usage(app, client):
+    reports = []
+    app.extensions["instrumentation"].reporters.append(reports.append)
+
+    response = client.get(
+        "/orgs", headers={"x-user-id": "1", "oso-request-id": "request-1"}
+    )
+    assert response.status_code == 200
+    # Reported once the body has been sent.
+    assert reports == []
+    response.close()
+
+    server_timing = timings(response)
+    # The ETag's version lookup, then the listing.
+    assert server_timing["db"][1] == "2 queries"
+    # One `list`, then an `authorize_resources` per permission from the
+    # thread pool, however many orgs there are.
+    calls = len(PERMISSIONS["Organization"]) + 1
+    assert server_timing["oso"][1] == f"{calls} calls"
+
+    [report] = reports
+    assert report.request_id == "request-1"
+    assert report.endpoint == "orgs.index"
+    assert report.status == 200
+    assert (report.queries, report.oso_calls) == (2, calls)
+    assert report.duration >= report.db_time
+
+
+def test_reports_are_logged(client, caplog):
+    caplog.set_level(logging.INFO, logger="app.instrumentation")
+    client.get(
+        "/orgs", headers={"x-user-id": "1", "oso-request-id": "request-2"}
+    ).close()
+
+    [record] = [r for r in caplog.records if r.name == "app.instrumentation"]
+    assert json.loads(record.getMessage())["request_id"] == "request-2"
@@ -0,0 +1,85 @@
+from collections import Counter
+from random import Random
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.loaders import load_random, load_repos_by_ids, load_users_by_ids
+from app.models import Base, Organization, Repository, User
+
+
+@pytest.fixture()
+def engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture()
+def session(engine):
+    session = sessionmaker(bind=engine)()
+    session.add_all(User(id=i, username=f"user{i}") for i in range(1, 1201))
+    session.add_all(Organization(id=i, name=f"org{i}") for i in range(1, 3))
+    session.add_all(
+        Repository(id=i, name=f"repo{i}", org_id=1 + i % 2) for i in range(1, 11)
+    )
+    session.commit()
+    yield session
+    session.close()
+
+
+@pytest.fixture()
+def queries(engine):
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    return statements
+
+
+def test_load_users_by_ids_issues_one_query(session, queries):
+    users = load_users_by_ids(session, ["7", "3", "5", "3", "9999"])
+    assert [u.id for u in users] == [7, 3, 5]
+    assert len(queries) == 1
+
+
+def test_load_users_by_ids_chunks_large_id_lists(session, queries):
+    ids = list(range(1200, 0, -1))
+    users = load_users_by_ids(session, ids)
+    assert [u.id for u in users] == ids
+    assert len(queries) == 3
+
+
+def test_load_repos_by_ids_filters_by_org(session, queries):
+    repos = load_repos_by_ids(session, range(1, 11), org_id=1)
+    assert [r.id for r in repos] == [2, 4, 6, 8, 10]
+    assert len(queries) == 1
+
+
+def test_load_random_is_uniform_despite_gaps(session, queries):
+    session.query(User).filter(User.id % 3 != 0).delete(synchronize_session=False)
+    session.commit()
+    queries.clear()
+
+    rng = Random(0)
+    picks = Counter(load_random(session, User, rng=rng).id for _ in range(4000))
+    assert set(picks) == set(range(3, 1201, 3))
+    assert max(picks.values()) < 30
+    # The id range, the candidates and rarely the row after one; never a
+    # scan of the table.
+    assert len(queries) < 2.1 * 4000
+    assert not any("RANDOM" in statement for statement in queries)
+
+
+def test_load_random_falls_back_to_the_next_row(session):
+    session.query(User).filter(User.id != 1200).delete(synchronize_session=False)
+    session.add(User(id=1, username="first"))
+    session.commit()
+    picks = {load_random(session, User, candidates=1).id for _ in range(50)}
+    assert 1200 in picks and picks <= {1, 1200}
+
+    session.query(User).delete()
+    assert load_random(session, User) is None
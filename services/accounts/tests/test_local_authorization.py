@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app.facts import fact_row
+from app.local_authorization import authorized_filter
+from app.models import Base, Fact, Organization, Repository
+
+john = {"type": "User", "id": "1"}
+paul = {"type": "User", "id": "2"}
+
+
+def role(user, name, resource_type, resource_id):
+    return {
+        "name": "has_role",
+        "args": [user, name, {"type": resource_type, "id": str(resource_id)}],
+    }
+
+
+@pytest.fixture()
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all(
+        [
+            Organization(id=1, name="The Beatles"),
+            Organization(id=2, name="Monsters Inc."),
+            Repository(id=1, name="Abbey Road", org_id=1),
+            Repository(id=2, name="Let It Be", org_id=1, protected=True),
+            Repository(id=3, name="Paperwork", org_id=2),
+            Repository(id=4, name="Scare Floor", org_id=2, public=True),
+            Repository(id=5, name="Door Vault", org_id=2, protected=True),
+        ]
+    )
+    facts = [
+        role(john, "admin", "Organization", 1),
+        role(paul, "member", "Organization", 1),
+        role(paul, "maintainer", "Repository", 2),
+        role(paul, "maintainer", "Repository", 3),
+        role(paul, "reader", "Repository", 5),
+    ]
+    session.execute(insert(Fact), [fact_row(f) for f in facts])
+    session.commit()
+    yield session
+    session.close()
+
+
+def authorized(session, user, action, cls):
+    statement = (
+        select(cls.id).where(authorized_filter(user, action, cls)).order_by(cls.id)
+    )
+    return list(session.execute(statement).scalars())
+
+
+def test_read(session):
+    assert authorized(session, john, "read", Organization) == [1, 2]
+    assert authorized(session, john, "read", Repository) == [1, 2, 4]
+    assert authorized(session, paul, "read", Repository) == [1, 2, 3, 4, 5]
+
+
+def test_role_hierarchy(session):
+    assert authorized(session, john, "manage_members", Organization) == [1]
+    assert authorized(session, paul, "manage_members", Organization) == []
+    assert authorized(session, paul, "view_members", Organization) == [1]
+
+    assert authorized(session, john, "invite", Repository) == [1, 2]
+    assert authorized(session, paul, "write", Repository) == [2, 3]
+    assert authorized(session, paul, "invite", Repository) == []
+
+
+def test_maintainers_cannot_delete_protected_repositories(session):
+    assert authorized(session, john, "delete", Repository) == [1, 2]
+    assert authorized(session, paul, "delete", Repository) == [3]
+
+
+def test_unsupported(session):
+    with pytest.raises(ValueError):
+        authorized_filter(john, "comment", Repository)
+    with pytest.raises(ValueError):
+        authorized_filter({"type": "Group", "id": "1"}, "read", Repository)
@@ -0,0 +1,189 @@
+import pytest
+from sqlalchemy import create_engine, event, insert, text
+
+import app as accounts
+from app import create_app
+from app.authorization import oso
+from app.facts import fact_rows, reconcile
+from app.migrations import migrate
+from app.models import Base, Fact
+
+
+class FactClient:
+    """Just enough of Oso Cloud to store role facts and allow everything."""
+
+    def __init__(self):
+        self.facts = []
+
+    def _matches(self, pattern, fact):
+        for want, arg in zip(pattern["args"], fact["args"]):
+            if isinstance(want, str):
+                want = {"type": "String", "id": want}
+            if want and any(arg.get(k) != v for k, v in want.items()):
+                return False
+        return pattern["name"] == fact["name"]
+
+    def _value(self, arg):
+        if isinstance(arg, str):
+            return {"type": "String", "id": arg}
+        return {"type": arg["type"], "id": str(arg["id"])}
+
+    def authorize(self, actor, action, resource, context_facts=[]):
+        return True
+
+    def actions(self, actor, resource, context_facts=[]):
+        return ["read", "manage_members", "view_members", "create_repositories"]
+
+    def get(self, pattern):
+        return [fact for fact in self.facts if self._matches(pattern, fact)]
+
+    def tell(self, fact):
+        self.bulk(tell=[fact])
+
+    def delete(self, fact):
+        self.bulk(delete=[fact])
+
+    def bulk(self, delete=[], tell=[]):
+        for pattern in delete:
+            self.facts = [f for f in self.facts if not self._matches(pattern, f)]
+        for fact in tell:
+            fact = {
+                "name": fact["name"],
+                "args": [self._value(a) for a in fact["args"]],
+            }
+            if fact not in self.facts:
+                self.facts.append(fact)
+
+
+@pytest.fixture(params=[False, True], ids=["oso", "replica"])
+def client(request, monkeypatch):
+    monkeypatch.setattr(oso, "client", FactClient())
+    monkeypatch.setattr(accounts, "LOCAL_FACTS", request.param)
+    app = create_app("sqlite://")
+    with app.test_client() as client:
+        client.environ_base["HTTP_X_USER_ID"] = "1"
+        yield client
+
+
+def member_count(client):
+    return int(client.get("/orgs/1/user_count").get_data())
+
+
+def test_role_assignments_maintain_member_count(client):
+    org = client.post("/orgs", json={"name": "The Beatles"}).json
+    assert org["member_count"] == 1
+    assert member_count(client) == 1
+
+    client.post("/orgs/1/role_assignments", json={"id": "2", "role": "member"})
+    client.post("/orgs/1/role_assignments", json={"id": "2", "role": "member"})
+    assert member_count(client) == 2
+
+    client.post("/orgs/1/role_assignments", json={"id": "2", "role": "admin"})
+    assert member_count(client) == 3
+    client.patch("/orgs/1/role_assignments", json={"id": "2", "role": "member"})
+    assert member_count(client) == 2
+
+    client.delete("/orgs/1/role_assignments", json={"id": "2"})
+    client.delete("/orgs/1/role_assignments", json={"id": "3"})
+    assert member_count(client) == 1
+
+    # Recounted rather than adjusted, so a role that changed in between
+    # (here, without this service knowing) is counted too.
+    oso.client.tell(
+        {
+            "name": "has_role",
+            "args": [
+                {"type": "User", "id": "3"},
+                "member",
+                {"type": "Organization", "id": "1"},
+            ],
+        }
+    )
+    if client.application.config["LOCAL_FACTS"]:
+        reconcile(client.application.extensions["sessionmaker"](), oso.client)
+    client.post("/orgs/1/role_assignments", json={"id": "2", "role": "member"})
+    assert member_count(client) == 3
+
+
+def test_failed_creates_take_back_their_facts(client):
+    client.post("/orgs", json={"name": "The Beatles"})
+    told = list(oso.client.facts)
+
+    def fail(session):
+        raise RuntimeError("commit failed")
+
+    Session = client.application.extensions["sessionmaker"]
+    event.listen(Session, "before_commit", fail)
+    assert client.post("/orgs", json={"name": "The Monkees"}).status_code == 500
+    response = client.post("/orgs/1/repos", json={"name": "Abbey Road"})
+    assert response.status_code == 500
+    assert oso.client.facts == told
+
+
+def test_migrate_backfills_member_count_from_facts():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE organizations (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO organizations (id) VALUES (1), (2)"))
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Fact),
+            fact_rows(
+                {
+                    "name": "has_role",
+                    "args": [
+                        {"type": "User", "id": str(user)},
+                        role,
+                        {"type": "Organization", "id": "1"},
+                    ],
+                }
+                for user, role in [(1, "admin"), (2, "member"), (3, "member")]
+            ),
+        )
+
+    migrate(engine)
+
+    with engine.connect() as conn:
+        counts = conn.execute(
+            text("SELECT id, member_count FROM organizations ORDER BY id")
+        ).all()
+    assert [tuple(c) for c in counts] == [(1, 3), (2, 0)]
+
+
+def test_migrate_backfills_member_count_from_oso_without_the_replica(
+    tmp_path, monkeypatch
+):
+    fact_client = FactClient()
+    monkeypatch.setattr(oso, "client", fact_client)
+    fact_client.bulk(
+        tell=[
+            {
+                "name": "has_role",
+                "args": [
+                    {"type": "User", "id": str(user)},
+                    role,
+                    {"type": "Organization", "id": str(org)},
+                ],
+            }
+            for user, role, org in [(1, "admin", 1), (2, "member", 1), (3, "admin", 2)]
+        ]
+    )
+    # A database from before member counts, with the roles only in Oso Cloud.
+    path = tmp_path / "accounts.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE organizations DROP COLUMN member_count"))
+        conn.execute(
+            text("INSERT INTO organizations (name) VALUES ('a'), ('b'), ('c')")
+        )
+    engine.dispose()
+
+    app = create_app(f"sqlite:///{path}")
+    assert not app.config["LOCAL_FACTS"]
+    client = app.test_client()
+    client.environ_base["HTTP_X_USER_ID"] = "1"
+    assert [
+        int(client.get(f"/orgs/{org}/user_count").get_data()) for org in (1, 2, 3)
+    ] == [2, 1, 0]
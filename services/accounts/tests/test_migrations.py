@@ -0,0 +1,74 @@
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect, text
+
+from app.migrations import alembic_config, migrate
+from app.models import Base
+
+
+HEAD = ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def revision(engine):
+    with engine.connect() as conn:
+        return MigrationContext.configure(conn).get_current_revision()
+
+
+def test_migrated_schema_matches_the_models():
+    engine = create_engine("sqlite://")
+    migrate(engine)
+
+    with engine.connect() as conn:
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+
+
+def test_migrate_adds_and_backfills_repository_count():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE organizations (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO organizations (id) VALUES (1), (2)"))
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO repositories (name, org_id) VALUES ('a', 1), ('b', 1)")
+        )
+
+    migrate(engine)
+    migrate(engine)
+
+    assert revision(engine) == HEAD
+    columns = {c["name"] for c in inspect(engine).get_columns("organizations")}
+    assert "repository_count" in columns
+    with engine.connect() as conn:
+        counts = conn.execute(
+            text("SELECT id, repository_count FROM organizations ORDER BY id")
+        ).all()
+    assert [tuple(c) for c in counts] == [(1, 2), (2, 0)]
+
+
+def test_migrate_adds_missing_indexes():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_facts_resource"))
+
+    migrate(engine)
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("facts")}
+    assert "ix_facts_resource" in indexes
+
+
+def test_migrate_adds_indexes_to_databases_without_them():
+    engine = create_engine("sqlite://")
+    migrate(engine, "0001")
+    assert "ix_users_username" not in {
+        index["name"] for index in inspect(engine).get_indexes("users")
+    }
+
+    migrate(engine)
+
+    assert revision(engine) == HEAD
+    assert "ix_users_username" in {
+        index["name"] for index in inspect(engine).get_indexes("users")
+    }
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.fake_oso import FakeOso, FakeOsoServer
+from app.oso_http import Histogram, OsoAdapter, oso_latency
+
+john = {"type": "User", "id": "1"}
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(buckets=(1, 10, 100))
+    for ms in [0.5] * 90 + [5] * 9 + [500]:
+        histogram.observe(ms)
+    assert histogram.percentile(50) == 1
+    assert histogram.percentile(95) == 10
+    assert histogram.percentile(100) == float("inf")
+    assert histogram.as_dict()["buckets"] == {"1": 90, "10": 9, "100": 0, "+Inf": 1}
+
+
+def test_calls_reuse_pooled_connections():
+    facts = [
+        {
+            "name": "has_role",
+            "args": [john, "member", {"type": "Organization", "id": str(i)}],
+        }
+        for i in range(200)
+    ]
+    with FakeOsoServer(FakeOso(facts)) as server:
+        client = server.client()
+        adapter = client.api.session.get_adapter(server.url)
+        assert isinstance(adapter, OsoAdapter)
+
+        oso_latency.clear()
+        with ThreadPoolExecutor(8) as executor:
+            list(
+                executor.map(
+                    lambda i: client.authorize(
+                        john, "read", {"type": "Organization", "id": str(i)}
+                    ),
+                    range(64),
+                )
+            )
+        pool = adapter.poolmanager.connection_from_url(server.url)
+        assert pool.num_connections <= 8
+        assert oso_latency.as_dict()["POST /api/authorize"]["count"] == 64
+
+        # Large results come back compressed, as requests asks for by default.
+        response = client.api.session.get(
+            server.url + "/api/facts",
+            params={"predicate": "has_role", "args.0.type": "User", "args.0.id": "1"},
+        )
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert len(response.json()) == 200
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+from flask import Flask, g
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import BadRequest
+
+from app.loaders import iter_dump_by_ids
+from app.models import Base, Organization, setup_schema
+from app.pagination import Page, select_batches
+from app.serializers import serializer_for
+
+
+@pytest.fixture()
+def app():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    setup_schema(Base)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    for i in range(1, 8):
+        session.add(Organization(id=i, name=f"org {i}", billing_address="x"))
+    session.commit()
+    session.close()
+
+    app = Flask(__name__)
+    serializer = serializer_for(Organization)
+
+    @app.route("/orgs")
+    def index():
+        g.session = Session()
+        page = Page.from_request()
+        statement = page.select(serializer.select(), Organization.id)
+        return page.response(
+            select_batches(g.session, serializer, statement, batch_size=2),
+            lambda rows: g.batches.append([row["id"] for row in rows]),
+        )
+
+    @app.route("/orgs/authorized")
+    def authorized():
+        g.session = Session()
+        page = Page.from_request()
+        ids = page.ids(["6", "2", "4", "2"])
+        return page.response(iter_dump_by_ids(g.session, Organization, ids))
+
+    @app.route("/assignments")
+    def assignments():
+        # Users 1 and 3 have two roles each.
+        roles = [(1, "admin"), (1, "member"), (2, "member"), (3, "a"), (3, "b")]
+        page = Page.from_request()
+        rows = [{"id": id, "role": role} for id, role in roles]
+        rows = [row for row in rows if page.cursor is None or row["id"] > page.cursor]
+        return page.response(
+            [rows[:3], rows[3:]],
+            lambda rows: g.batches.append([row["role"] for row in rows]),
+            grouped=True,
+        )
+
+    @app.before_request
+    def reset_batches():
+        g.batches = []
+
+    return app
+
+
+def get(app, path):
+    with app.test_client() as client:
+        response = client.get(path)
+        return response, json.loads(response.get_data()), g.batches
+
+
+def ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_unpaginated_returns_everything(app):
+    response, rows, _ = get(app, "/orgs")
+    assert ids(rows) == [1, 2, 3, 4, 5, 6, 7]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_keyset_pages(app):
+    response, rows, batches = get(app, "/orgs?limit=3")
+    assert ids(rows) == [1, 2, 3]
+    assert batches == [[1, 2, 3]]
+    assert response.headers["X-Next-Cursor"] == "3"
+    assert 'cursor=3>; rel="next"' in response.headers["Link"]
+
+    response, rows, _ = get(app, "/orgs?limit=3&cursor=3")
+    assert ids(rows) == [4, 5, 6]
+
+    response, rows, _ = get(app, "/orgs?limit=3&cursor=6")
+    assert ids(rows) == [7]
+    assert "X-Next-Cursor" not in response.headers
+    assert "Link" not in response.headers
+
+
+def test_pages_over_authorized_ids(app):
+    response, rows, _ = get(app, "/orgs/authorized?limit=1&cursor=2")
+    assert ids(rows) == [4]
+    assert response.headers["X-Next-Cursor"] == "4"
+
+
+def test_stream_decorates_a_batch_at_a_time(app):
+    response, rows, batches = get(app, "/orgs?stream=1")
+    assert ids(rows) == [1, 2, 3, 4, 5, 6, 7]
+    assert batches == [[1, 2], [3, 4], [5, 6], [7]]
+
+    response, rows, batches = get(app, "/orgs?stream=1&limit=3&cursor=1")
+    assert ids(rows) == [2, 3, 4]
+    assert batches == [[2, 3], [4]]
+
+
+def test_grouped_rows_stay_on_one_page(app):
+    response, rows, _ = get(app, "/assignments?limit=1")
+    assert [row["role"] for row in rows] == ["admin", "member"]
+    assert response.headers["X-Next-Cursor"] == "1"
+
+    response, rows, _ = get(app, "/assignments?limit=1&cursor=1")
+    assert [row["role"] for row in rows] == ["member"]
+    response, rows, _ = get(app, "/assignments?limit=1&cursor=2")
+    assert [row["role"] for row in rows] == ["a", "b"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response, rows, batches = get(app, "/assignments?stream=1&limit=2")
+    assert [row["role"] for row in rows] == ["admin", "member", "member"]
+    assert batches == [["admin", "member", "member"]]
+
+
+def test_invalid_arguments(app):
+    for args in ["limit=0", "limit=100000", "limit=x", "cursor=x"]:
+        with app.test_request_context(f"/orgs?{args}"):
+            with pytest.raises(BadRequest):
+                Page.from_request()
@@ -0,0 +1,211 @@
+"""Every route's queries, checked with `EXPLAIN QUERY PLAN` against a generated
+dataset: none may read a whole table, or a whole index.
+
+The exceptions are listings in `PAGED_SCANS`, which read a table in id order
+and stop once they have a page, as long as they're `LIMIT`ed and don't need
+sorting first.
+"""
+import re
+import shutil
+from types import SimpleNamespace
+from typing import Any, List
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from app import create_app
+from app.authorization import oso
+from app.facts import FactReplica
+from app.fake_oso import FakeOso
+from app.generator import Scale, generate, write_local_facts
+from app.migrations import migrate
+from app.models import Base, Repository, User
+
+SCALE = Scale(users=10_000, orgs=1_000)
+TABLES = set(Base.metadata.tables)
+# "SCAN TABLE users" before SQLite 3.36.
+SCAN = re.compile(r"SCAN (?:TABLE )?(\w+)")
+LIMIT = re.compile(r"\bLIMIT\b")
+# Not served from the database, or not by a request.
+UNCHECKED = {"static", "reset_data"}
+# (endpoint, table): listings that page through most of a table.
+PAGED_SCANS = {
+    # Everyone can read every organization.
+    ("orgs.index", "organizations"),
+    ("graphql", "organizations"),
+    # Everyone but the few members.
+    ("role_assignments.org_unassigned_users_index", "users"),
+    ("role_assignments.repo_unassigned_users_index", "users"),
+}
+
+DASHBOARD = """{
+  me { username }
+  organizations(first: 20) {
+    permissions
+    repos { nameWithOwner permissions roleAssignments { role user { name } } }
+    roleAssignments { role user { name } }
+  }
+}"""
+
+
+class CreatingFakeOso(FakeOso):
+    """`FakeOso`, letting anyone create an organization."""
+
+    def authorize(self, actor, action, resource, context_facts=[]):
+        if action == "create":
+            return True
+        return super().authorize(actor, action, resource, context_facts)
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    """A generated database, an admin of organization 1 and a user outside it."""
+    path = tmp_path_factory.mktemp("plans") / "generated.db"
+    engine = create_engine(f"sqlite:///{path}")
+    migrate(engine)
+    with sessionmaker(bind=engine)() as session:
+        facts = list(generate(session, SCALE))
+        write_local_facts(session, facts)
+        session.commit()
+        roles = {
+            fact["args"][0]["id"]: fact["args"][1]
+            for fact in facts
+            if fact["name"] == "has_role"
+            and fact["args"][2] == {"type": "Organization", "id": "1"}
+        }
+        admin = next(int(id) for id, role in roles.items() if role == "admin")
+        yield SimpleNamespace(
+            path=path,
+            facts=facts,
+            admin=admin,
+            username=session.get(User, admin).username,
+            outsider=next(
+                id for id in range(1, SCALE.users + 1) if str(id) not in roles
+            ),
+            repo=session.scalar(select(Repository.id).filter_by(org_id=1)),
+        )
+    engine.dispose()
+
+
+def requests_for(data):
+    """Requests by the admin of organization 1, one or more per route."""
+    repo = f"/orgs/1/repos/{data.repo}"
+    user = f"/users/{data.username}"
+    outsider = str(data.outsider)
+    return [
+        ("GET", "/orgs?limit=20", None, 200),
+        ("POST", "/orgs", {"name": "Let It Be"}, 201),
+        ("POST", "/orgs", {"name": "Let It Be"}, 400),
+        ("GET", "/orgs/1", None, 200),
+        ("GET", "/orgs/1/user_count", None, 200),
+        ("GET", "/orgs/1/repos?limit=20", None, 200),
+        ("POST", "/orgs/1/repos", {"name": "Abbey Road"}, 201),
+        ("POST", "/orgs/1/repos", {"name": "Abbey Road"}, 400),
+        ("GET", repo, None, 200),
+        ("GET", "/orgs/1/role_assignments?limit=20", None, 200),
+        ("GET", "/orgs/1/unassigned_users?limit=20", None, 200),
+        ("POST", "/orgs/1/role_assignments", {"id": outsider, "role": "member"}, 201),
+        ("PATCH", "/orgs/1/role_assignments", {"id": outsider, "role": "admin"}, 200),
+        ("GET", f"{repo}/role_assignments?limit=20", None, 200),
+        ("GET", f"{repo}/unassigned_users?limit=20", None, 200),
+        ("POST", f"{repo}/role_assignments", {"id": outsider, "role": "editor"}, 201),
+        ("PATCH", f"{repo}/role_assignments", {"id": outsider, "role": "editor"}, 200),
+        ("DELETE", f"{repo}/role_assignments", {"id": outsider}, 204),
+        ("DELETE", "/orgs/1/role_assignments", {"id": outsider}, 204),
+        ("GET", "/org_role_choices", None, 200),
+        ("GET", "/repo_role_choices", None, 200),
+        ("GET", "/session", None, 200),
+        ("POST", "/session/login", {"username": data.username}, 201),
+        ("POST", "/session/login", {}, 201),
+        ("DELETE", "/session/logout", None, 204),
+        ("GET", user, None, 200),
+        ("GET", f"{user}/repos?limit=20", None, 200),
+        ("GET", f"{user}/orgs?limit=20", None, 200),
+        ("POST", "/graphql", {"query": DASHBOARD}, 200),
+        ("GET", "/_oso_latency", None, 200),
+        ("DELETE", repo, None, 204),
+        ("DELETE", "/orgs/1", None, 204),
+    ]
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    """The tables `plan` reads all of, or all of an index of."""
+    scans = [SCAN.match(step) for step in plan]
+    return [scan.group(1) for scan in scans if scan and scan.group(1) in TABLES]
+
+
+def paged(statement: str, plan: List[str]) -> bool:
+    """Whether `statement` can stop reading once it has a page of rows."""
+    return bool(LIMIT.search(statement)) and not any("TEMP B-TREE" in s for s in plan)
+
+
+@pytest.mark.parametrize("sql_filter", [False, True], ids=["oso", "sql_filter"])
+def test_no_route_scans_a_table(dataset, tmp_path, monkeypatch, sql_filter):
+    # The requests write, so each run gets a copy of its own.
+    path = tmp_path / "plans.db"
+    shutil.copy(dataset.path, path)
+    monkeypatch.setattr(oso, "client", CreatingFakeOso(dataset.facts))
+    app = create_app(f"sqlite:///{path}")
+    if sql_filter:
+        app.config["SQL_AUTHZ_FILTER"] = ["*"]
+        monkeypatch.setattr(oso, "replica", FactReplica())
+
+    queries: List[Any] = []
+
+    @event.listens_for(
+        app.extensions["sessionmaker"].kw["bind"], "before_cursor_execute"
+    )
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(
+            ("SELECT", "INSERT", "UPDATE", "DELETE")
+        ):
+            queries.append((statement, parameters))
+
+    urls = app.url_map.bind("localhost")
+    checked = set()
+    scans = []
+    with create_engine(f"sqlite:///{path}").connect() as explain:
+        for method, url, body, status in requests_for(dataset):
+            # Make every request run all of its queries.
+            app.extensions["identities"].clear()
+            oso.decisions.clear()
+            queries.clear()
+            response = app.test_client().open(
+                url, method=method, json=body, headers={"x-user-id": dataset.admin}
+            )
+            assert response.status_code == status, f"{method} {url}"
+            endpoint = urls.match(url.split("?")[0], method)[0]
+            checked.add(endpoint)
+            for statement, parameters in queries:
+                plan = [
+                    step[-1]
+                    for step in explain.exec_driver_sql(
+                        "EXPLAIN QUERY PLAN " + statement, parameters
+                    )
+                ]
+                for table in full_scans(plan):
+                    if (endpoint, table) in PAGED_SCANS and paged(statement, plan):
+                        continue
+                    scans.append(f"{method} {url} scans {table}: {statement}")
+
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+    assert checked == endpoints - UNCHECKED
+    assert scans == []
+
+
+def test_full_scans():
+    assert full_scans(["SCAN users"]) == ["users"]
+    assert full_scans(["SCAN TABLE users"]) == ["users"]
+    assert full_scans(["SCAN facts USING COVERING INDEX ix_facts_resource"]) == [
+        "facts"
+    ]
+    assert full_scans(["SEARCH users USING INDEX ix_users_username"]) == []
+    assert full_scans(["SCAN CONSTANT ROW", "SCAN (subquery-1)"]) == []
+
+    page = "SELECT * FROM users ORDER BY {} LIMIT ?"
+    assert paged(page.format("id"), ["SCAN users"])
+    assert not paged(
+        page.format("name"), ["SCAN users", "USE TEMP B-TREE FOR ORDER BY"]
+    )
+    assert not paged("SELECT * FROM users", ["SCAN users"])
@@ -0,0 +1,135 @@
+import pytest
+
+from app import create_app
+from app.authorization import PERMISSIONS, oso
+from app.fake_oso import FakeOso
+from app.schema import schema
+
+DASHBOARD = """
+query ($first: Int!) {
+  organizations(first: $first) {
+    id
+    permissions
+    repos {
+      nameWithOwner
+      permissions
+      roleAssignments { role user { username } }
+    }
+    roleAssignments { role user { username } }
+  }
+}
+"""
+
+
+@pytest.fixture()
+def fake(monkeypatch):
+    fake = FakeOso()
+    monkeypatch.setattr(oso, "client", fake)
+    return fake
+
+
+@pytest.fixture()
+def client(fake):
+    client = create_app("sqlite://", load_fixtures=True).test_client()
+    # Decisions cached by earlier tests are about other data.
+    oso.decisions.clear()
+    return client
+
+
+def graphql(client, query, **variables):
+    response = client.post(
+        "/graphql",
+        json={"query": query, "variables": variables},
+        headers={"x-user-id": "1"},
+    )
+    assert response.status_code == 200
+    assert "errors" not in response.json, response.json["errors"]
+    return response
+
+
+def test_matches_rest_authorization(client):
+    orgs = graphql(client, DASHBOARD, first=100).json["data"]["organizations"]
+    rest = client.get("/orgs", headers={"x-user-id": "1"}).json
+    assert [org["id"] for org in orgs] == [str(org["id"]) for org in rest]
+    assert [org["permissions"] for org in orgs] == [org["permissions"] for org in rest]
+
+    for org in orgs:
+        if "view_members" in org["permissions"]:
+            assert org["roleAssignments"]
+        else:
+            assert org["roleAssignments"] is None
+        repos = client.get(f"/orgs/{org['id']}/repos", headers={"x-user-id": "1"})
+        assert [repo["nameWithOwner"] for repo in org["repos"]] == [
+            repo["name_with_owner"] for repo in repos.json
+        ]
+
+
+def test_oso_calls_are_batched_per_level(client, fake):
+    for first in (1, 10):
+        oso.decisions.clear()
+        fake.calls.clear()
+        response = graphql(client, DASHBOARD, first=first)
+        queries = response.headers["Server-Timing"].split('desc="')[1].split()[0]
+        # Organizations, their repositories, and the users assigned roles on
+        # each (one query per level, if there are any).
+        assert int(queries) <= 4
+        orgs = response.json["data"]["organizations"]
+        assert len(orgs) == first
+        # Role assignments are a concurrent `get` per visible resource, each
+        # only about that resource.
+        visible = [
+            node
+            for org in orgs
+            for node in [org, *org["repos"]]
+            if node["roleAssignments"] is not None
+        ]
+        assert fake.calls["get"] == len(visible)
+        assert fake.calls["list"] == 2
+        # `view_members` on each level, then each level's permissions: an
+        # `actions` per node for a few nodes, at most a call per permission
+        # for many.
+        checks = fake.calls["actions"] + fake.calls["authorize_resources"]
+        assert checks <= 2 + len(PERMISSIONS["Organization"]) + len(
+            PERMISSIONS["Repository"]
+        )
+
+
+def test_resolves_federated_entities(client, fake):
+    # The fixtures give every user a role in a random organization.
+    fake.bulk(
+        delete=[
+            {
+                "name": "has_role",
+                "args": [
+                    {"type": "User", "id": "1"},
+                    None,
+                    {"type": "Organization", "id": "2"},
+                ],
+            }
+        ]
+    )
+    response = graphql(
+        client,
+        """
+        query ($representations: [_Any!]!) {
+          _entities(representations: $representations) {
+            ... on Repository { id nameWithOwner }
+          }
+        }
+        """,
+        representations=[
+            {"__typename": "Repository", "id": "1"},
+            {"__typename": "Repository", "id": "2"},
+        ],
+    )
+    # john can read the Beatles' repository, but not the Monsters'.
+    assert response.json["data"]["_entities"] == [
+        {"id": "1", "nameWithOwner": "The Beatles/Abbey Road"},
+        None,
+    ]
+
+
+def test_schema_is_a_federation_subgraph():
+    sdl = schema.as_str()
+    assert 'type Repository @key(fields: "id")' in sdl
+    assert 'type Organization @key(fields: "id")' in sdl
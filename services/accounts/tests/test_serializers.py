@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.migrations import backfill_repository_counts
+from app.models import Base, Organization, Repository, setup_schema
+from app.serializers import dumps, serializer_for
+
+
+@pytest.fixture()
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    setup_schema(Base)
+    session = sessionmaker(bind=engine)()
+    beatles = Organization(name="The Beatles", billing_address="64 Penny Ln")
+    session.add(beatles)
+    session.add(Repository(name="Abbey Road", org=beatles, public=True))
+    session.add(Repository(name="Let It Be", org=beatles))
+    session.flush()
+    backfill_repository_counts(session)
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_rows_match_as_json(session):
+    for cls in [Organization, Repository]:
+        serializer = serializer_for(cls)
+        expected = [
+            {key: getattr(obj, key) for key in serializer.keys}
+            for obj in session.query(cls).order_by(cls.id)
+        ]
+        assert [obj.as_json() for obj in session.query(cls).order_by(cls.id)] == (
+            expected
+        )
+        rows = session.execute(serializer.select().order_by(cls.id))
+        assert serializer.rows(rows) == expected
+
+
+def test_serialized_columns(session):
+    org = session.query(Organization).one().as_json()
+    assert org["repository_count"] == 2
+    assert "repos" not in org
+
+    repo = session.query(Repository).filter_by(name="Abbey Road").one().as_json()
+    assert repo["name_with_owner"] == "The Beatles/Abbey Road"
+    assert repo["public"] is True
+    assert "org" not in repo
+
+
+def test_dumps_matches_json(session):
+    serializer = serializer_for(Repository)
+    rows = serializer.rows(session.execute(serializer.select()))
+    assert json.loads(dumps(rows)) == rows
+
+
+def test_listing_select_joins_owner():
+    setup_schema(Base)
+    statement = str(serializer_for(Repository).select())
+    assert "LEFT OUTER JOIN organizations" in statement
+    assert "(SELECT" not in statement
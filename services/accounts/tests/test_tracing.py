@@ -0,0 +1,85 @@
+import pytest
+
+pytest.importorskip("opentelemetry.sdk")
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+
+import app as accounts
+from app import tracing
+from app.authorization import PERMISSIONS, oso
+from app.fake_oso import FakeOso
+
+
+@pytest.fixture()
+def spans(monkeypatch):
+    exporter = InMemorySpanExporter()
+    tracing.configure().add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(accounts, "TRACING", True)
+    monkeypatch.setattr(oso, "client", FakeOso())
+    yield exporter
+    exporter.shutdown()
+
+
+def test_request_spans_nest_sql_and_oso_calls(spans):
+    client = accounts.create_app("sqlite://", load_fixtures=True).test_client()
+    spans.clear()
+    oso.decisions.clear()
+
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    response = client.get(
+        "/orgs",
+        headers={
+            "x-user-id": "1",
+            "traceparent": f"00-{trace_id}-00f067aa0ba902b7-01",
+        },
+    )
+    assert response.status_code == 200
+    response.close()
+
+    [request] = [
+        span for span in spans.get_finished_spans() if span.name == "GET /orgs"
+    ]
+    assert format(request.context.trace_id, "032x") == trace_id
+    assert request.attributes["http.status_code"] == 200
+
+    children = [
+        span
+        for span in spans.get_finished_spans()
+        if span.parent is not None and span.parent.span_id == request.context.span_id
+    ]
+    assert "SELECT" in {span.name for span in children}
+    # One check per permission, from the thread pool.
+    checks = [span for span in children if span.name == "oso.authorize_resources"]
+    assert len(checks) == len(PERMISSIONS["Organization"])
+    assert {span.attributes["oso.resource_type"] for span in checks} == {"Organization"}
+    [listed] = [span for span in children if span.name == "oso.list"]
+    assert listed.attributes["oso.action"] == "read"
+
+
+def test_streamed_responses_end_their_span_once_sent(spans, caplog):
+    client = accounts.create_app("sqlite://", load_fixtures=True).test_client()
+    spans.clear()
+
+    response = client.get("/orgs?stream=1", headers={"x-user-id": "1"})
+    assert not [s for s in spans.get_finished_spans() if s.name == "GET /orgs"]
+    # Not left current while the server gets around to sending the body.
+    assert not trace.get_current_span().is_recording()
+    assert response.json
+    response.close()
+
+    [request] = [
+        span for span in spans.get_finished_spans() if span.name == "GET /orgs"
+    ]
+    # Including the statements that ran while the body was being sent.
+    statements = [
+        span
+        for span in spans.get_finished_spans()
+        if span.name == "SELECT" and span.context.trace_id == request.context.trace_id
+    ]
+    assert statements
+    assert all(span.end_time <= request.end_time for span in statements)
+    assert "Failed to detach context" not in caplog.text